@@ -0,0 +1,145 @@
+"""
+Aggregations for the analytics endpoint. Every function runs a single aggregated query:
+buckets and rolling averages over the daily rollup (DailySpending), top products over Product.
+"""
+from collections import deque
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Sequence
+
+from django.db import connection
+from django.db.models import Case, Count, F, Func, IntegerField, OuterRef, Sum, ValueRange, When, Window
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import DailySpending, Product, Transaction
+from .normalization import user_spelling
+from .rollups import day_range
+
+
+BUCKETS = {
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+
+class DayNumber(Func):
+    """
+    Integer number of a day (consecutive days differ by 1) - numeric ORDER BY for RANGE window frames
+    """
+    output_field = IntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # PostgreSQL: date - date is an integer
+        return super().as_sql(compiler, connection, template="(%(expressions)s - DATE '1970-01-01')", **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template="CAST(julianday(%(expressions)s) AS INTEGER)", **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template="TO_DAYS(%(expressions)s)", **extra_context)
+
+
+def _money(value: Any) -> float:
+    return float(value or 0)
+
+
+def bucket_totals(user: Any, start: date, end: date, bucket: str = "month") -> list[dict[str, Any]]:
+    """
+    Income and expense per week/month
+    :param user: owner
+    :param start: first day (local)
+    :param end: last day (local)
+    :param bucket: "week" (starting on Monday) or "month"
+    :return: list of {start, income, expense, net, count}
+    """
+    rows = (
+        DailySpending.objects
+        .filter(user=user, day__gte=start, day__lte=end)
+        .annotate(bucket=BUCKETS[bucket]("day"))
+        .values("bucket")
+        .annotate(income=Sum("income"), expense=Sum("expense"), count=Sum("count"))
+        .order_by("bucket")
+    )
+    return [
+        {
+            "start": row["bucket"].isoformat(),
+            "income": _money(row["income"]),
+            "expense": _money(row["expense"]),
+            "net": _money((row["income"] or 0) + (row["expense"] or 0)),
+            "count": row["count"],
+        }
+        for row in rows
+    ]
+
+
+def top_products(user: Any, start: date, end: date, limit: int = 10) -> list[dict[str, Any]]:
+    """
+    Products with the highest spend (sum of negative prices), grouped by canonical product
+    (by name for products without one). A canonical product is shown under the user's most frequent spelling of it
+    :param user: owner
+    :param start: first day (local)
+    :param end: last day (local)
+    :param limit: number of products
+    :return: list of {name, total, count}, biggest spend first
+    """
+    transactions = Transaction.objects.filter(day_range(start, end), user=user)
+    rows = (
+        Product.objects
+        .filter(transaction__in=transactions, price__lt=0)
+        .values("canonical", group=Case(When(canonical__isnull=True, then="name"), default=user_spelling(user, OuterRef("canonical"))))
+        .annotate(total=Sum("price"), count=Count("id"))
+        .order_by("total", "group", "canonical")[:limit]
+    )
+    return [{"name": row["group"], "total": _money(row["total"]), "count": row["count"]} for row in rows]
+
+
+def rolling_averages(user: Any, start: date, end: date, windows: Sequence[int] = (7, 30)) -> list[dict[str, Any]]:
+    """
+    Average daily net amount over the last N calendar days (days without transactions count as 0),
+    for every day with transactions
+    :param user: owner
+    :param start: first day (local)
+    :param end: last day (local)
+    :param windows: window lengths (days)
+    :return: list of {day, net, avg_<N>...}
+    """
+    # Earlier days are needed to fill the windows of the first days
+    rows = (
+        DailySpending.objects
+        .filter(user=user, day__gte=start - timedelta(days=max(windows) - 1), day__lte=end)
+        .annotate(net=F("income") + F("expense"))
+        .order_by("day")
+    )
+
+    if connection.features.supports_over_clause and connection.features.supports_frame_range_fixed_distance:
+        rows = rows.annotate(**{
+            f"sum_{window}": Window(Sum("net"), order_by=DayNumber("day").asc(), frame=ValueRange(start=-(window - 1), end=0))
+            for window in windows
+        })
+        values = rows.values("day", "net", *(f"sum_{window}" for window in windows))
+    else:
+        values = _rolling_sums(rows.values("day", "net"), windows)
+
+    return [
+        {
+            "day": row["day"].isoformat(),
+            "net": _money(row["net"]),
+            **{f"avg_{window}": round(_money(row[f"sum_{window}"]) / window, 2) for window in windows},
+        }
+        for row in values if row["day"] >= start
+    ]
+
+
+def _rolling_sums(rows: Any, windows: Sequence[int]) -> list[dict[str, Any]]:
+    # Fallback for databases without RANGE window frames
+    result = []
+    queues = {window: deque() for window in windows}
+    sums = {window: Decimal(0) for window in windows}
+    for row in rows:
+        for window, queue in queues.items():
+            queue.append((row["day"], row["net"]))
+            sums[window] += row["net"]
+            while queue[0][0] <= row["day"] - timedelta(days=window):
+                sums[window] -= queue.popleft()[1]
+        result.append({**row, **{f"sum_{window}": sums[window] for window in windows}})
+    return result
@@ -0,0 +1,458 @@
+"""
+Benchmark of the OCR pipeline stages.
+
+Parsing stages run over a corpus of synthetic receipt text, OCR stages over receipts rendered to images.
+Every stage reports p50/p95 latency, throughput and peak RSS, so results of two runs (ex. before and after
+a change) can be compared directly. Run with `python manage.py benchmark_ocr`.
+
+`compare_backends` runs the OCR with several inference backends (see ocr_backends.py) over the same fixtures and
+reports their accuracy against the printed text and against the reference backend, next to their latency.
+Run with `python manage.py compare_ocr_backends`.
+"""
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import unicodedata
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence, Union
+
+import cv2
+import numpy as np
+from numpy import ndarray
+from rapidfuzz.distance import Levenshtein
+
+from .ocr import ReceiptEngine, ReceiptParser
+from .ocr_pool import ReaderPool
+from .preprocessing import PreprocessedImage, ReceiptPreprocessor
+from .segmentation import ProjectionSegmenter
+from .uploads import decode_flag, image_info
+
+
+PRODUCT_NAMES = [
+    "CHLEB PSZENNY", "MLEKO 3,2%", "MASŁO EXTRA", "JAJA L 10SZT", "SER GOUDA", "JOGURT NAT", "BANANY LUZ",
+    "JABŁKA", "POMIDORY", "WODA MIN 1,5L", "KAWA MIELONA", "HERBATA", "CUKIER 1KG", "MĄKA TORTOWA", "RYŻ",
+    "MAKARON", "SZYNKA", "KIEŁBASA", "PAPIER TOAL", "PŁYN DO NACZYŃ", "TORBA", "SVETER", "CZEKOLADA", "SOK POM",
+]
+SHOP_NAMES = ["SKLEP ABC", "MARKET 24", "DELIKATESY", "SUPERSAM", "SKLEP SPOŻYWCZY"]
+PAYMENT_LINES = ["Karta", "Płatność kartą", "Gotówka", "Gotówka PLN", "BLIK", "Przelew"]
+DISCOUNT_NAMES = ["Rabat", "Opust", "Zniżka", "Obniżka"]
+FIXTURE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Fields of a parsed receipt compared between backends
+COMPARED_FIELDS = ("date", "time", "total", "payment_method", "items")
+
+
+@dataclass
+class StageStats:
+    """
+    Measurements of a single stage
+    """
+    calls: int
+    p50_ms: float
+    p95_ms: float
+    mean_ms: float
+    throughput_per_s: float
+    peak_rss_mb: float  # Peak RSS of the process after the stage (monotonic - stages are run from the cheapest)
+    python_peak_mb: Optional[float] = None  # Peak of traced allocations during the stage (trace_memory=True)
+
+
+def price(value: float) -> str:
+    return f"{value:.2f}".replace(".", ",")
+
+
+def synthetic_receipt(rng: random.Random, typo_rate: float = 0.0) -> list[str]:
+    """
+    Generate raw output of a receipt in the format returned by the OCR
+    :param rng: random generator
+    :param typo_rate: probability of an OCR-like typo in each character of the item names
+    :return: raw output
+    """
+    def typo(text: str) -> str:
+        return "".join(
+            rng.choice("ABCDEFGHIJKLMNOPRSTUWYZ0") if char.isalpha() and rng.random() < typo_rate else char
+            for char in text
+        )
+
+    lines = [rng.choice(SHOP_NAMES), f"ul. Przykładowa {rng.randint(1, 200)}", f"NIP {rng.randint(10 ** 9, 10 ** 10 - 1)}", "PARAGON FISKALNY"]
+
+    total = 0.0
+    for _ in range(rng.randint(1, 25)):
+        name = typo(rng.choice(PRODUCT_NAMES))
+        count = rng.choice([1, 1, 1, 2, 3])
+        unit = round(rng.uniform(0.5, 80), 2)
+        amount = round(count * unit, 2)
+        if rng.random() < 0.5:
+            lines.append(f"{name} {count}*{price(unit)} {price(amount)} A")
+        else:
+            lines.append(f"{name} {count}szt x{price(unit)} {price(amount)} A")
+        total += amount
+
+        if rng.random() < 0.1:
+            discount = round(min(amount, rng.uniform(0.1, 5)), 2)
+            lines.append(f"{rng.choice(DISCOUNT_NAMES)} -{price(discount)}")
+            total -= discount
+
+    total = round(total, 2)
+    when = datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+    lines += [
+        f"SPRZEDAŻ OPODATKOWANA A {price(total)}",
+        f"PTU A 23% {price(total * 0.23 / 1.23)}",
+        f"SUMA PTU {price(total * 0.23 / 1.23)}",
+        f"SUMA PLN {price(total)}",
+        when.strftime("%Y-%m-%d %H:%M"),
+        f"ABC{rng.randint(10 ** 9, 10 ** 10 - 1)}",
+        rng.choice(PAYMENT_LINES),
+    ]
+    return lines
+
+
+def text_corpus(count: int, seed: int = 0, typo_rate: float = 0.02) -> list[list[str]]:
+    """
+    :param count: number of receipts
+    :param seed: random seed (the same seed always gives the same corpus)
+    :param typo_rate: probability of a typo in each character of the item names
+    :return: raw outputs
+    """
+    rng = random.Random(seed)
+    return [synthetic_receipt(rng, typo_rate=typo_rate) for _ in range(count)]
+
+
+def ascii_text(line: str) -> str:
+    # Text of a line as rendered by `render_receipt` (Hershey fonts are ASCII only)
+    return unicodedata.normalize("NFKD", line).encode("ascii", "ignore").decode()
+
+
+def render_receipt(lines: Sequence[str], width: int = 1400, line_height: int = 90, font_scale: float = 2.0,
+                   background: Optional[tuple[int, int]] = (4000, 3000), angle: float = 0.0) -> ndarray:
+    """
+    Render raw output as a photo of a printed receipt
+    :param lines: text lines
+    :param width: width of the paper (px)
+    :param line_height: distance between lines (px)
+    :param font_scale: OpenCV font scale
+    :param background: size (height, width) of the dark table the receipt lies on. None = paper only
+    :param angle: rotation of the photo (degrees)
+    :return: BGR image
+    """
+    paper = np.full((line_height * (len(lines) + 2), width, 3), 250, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(paper, ascii_text(line), (40, line_height * (i + 1)), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 3)
+
+    if background is None:
+        image = paper
+    else:
+        height, bg_width = max(background[0], paper.shape[0] + 200), max(background[1], width + 200)
+        image = np.full((height, bg_width, 3), 60, dtype=np.uint8)
+        y, x = (height - paper.shape[0]) // 2, (bg_width - width) // 2
+        image[y:y + paper.shape[0], x:x + width] = paper
+
+    if angle:
+        matrix = cv2.getRotationMatrix2D((image.shape[1] / 2, image.shape[0] / 2), angle, 1.0)
+        image = cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]), borderValue=(60, 60, 60))
+
+    return image
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(function: Callable[[Any], Any], inputs: Sequence[Any], repeat: int = 1, warmup: int = 1,
+            trace_memory: bool = False) -> StageStats:
+    """
+    Time a function over inputs
+    :param function: stage (called with a single input)
+    :param inputs: inputs of the stage
+    :param repeat: how many times every input is processed
+    :param warmup: number of untimed calls before the measurement
+    :param trace_memory: additionally run the stage once under tracemalloc (untimed)
+    :return: StageStats
+    """
+    if not inputs:
+        raise ValueError("No inputs")
+    if repeat < 1:
+        raise ValueError("repeat must be at least 1")
+
+    for item in list(inputs)[:warmup]:
+        function(item)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            call_start = time.perf_counter()
+            function(item)
+            latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    python_peak = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            for item in inputs:
+                function(item)
+            python_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    latencies_ms = np.array(latencies) * 1000
+    return StageStats(
+        calls=len(latencies),
+        p50_ms=round(float(np.percentile(latencies_ms, 50)), 4),
+        p95_ms=round(float(np.percentile(latencies_ms, 95)), 4),
+        mean_ms=round(float(latencies_ms.mean()), 4),
+        throughput_per_s=round(len(latencies) / elapsed, 2) if elapsed else float("inf"),
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        python_peak_mb=None if python_peak is None else round(python_peak, 3)
+    )
+
+
+def _skip_reason(error: Exception) -> dict[str, str]:
+    return {"skipped": f"{type(error).__name__}: {error}"}
+
+
+def run_benchmark(receipts: int = 200, images: int = 3, seed: int = 0, repeat: int = 1,
+                  ocr: bool = True, reader_pool: Optional[ReaderPool] = None, gpu: bool = False,
+                  trace_memory: bool = False, progress: Optional[Callable[[str], None]] = None,
+                  decode_min_side: Optional[int] = 2000) -> dict[str, Any]:
+    """
+    Benchmark all stages of the pipeline
+    :param receipts: size of the text corpus (parsing stages)
+    :param images: number of rendered images (decoding, preprocessing and OCR stages)
+    :param seed: random seed of the corpus
+    :param repeat: how many times every input is processed
+    :param ocr: whether to run the OCR stages (detect, extract_text, extract_text_preprocessed, extract_text_projection,
+                extract_text_roi, run)
+    :param reader_pool: readers used by the OCR stages (defaults to a new pool)
+    :param gpu: whether the default pool uses GPU
+    :param trace_memory: also measure peak Python allocations of every stage
+    :param progress: called with the name of every stage before it starts
+    :param decode_min_side: minimal longer side of images reduced by the decode_reduced stage (OCR_DECODE_MIN_SIDE)
+    :return: JSON-serializable report
+    """
+    corpus = text_corpus(receipts, seed=seed)
+    rendered = [render_receipt(lines) for lines in text_corpus(images, seed=seed + 1)]
+    encoded = [cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes() for image in rendered]
+
+    # Inputs of the intermediate stages are prepared outside of the measurement
+    preprocessed = [ReceiptPreprocessor()(image) for image in rendered]
+    sections = []
+    for lines in corpus:
+        try:
+            sections.append(ReceiptParser.split_sections(lines))
+        except ValueError:
+            pass
+
+    def parse_end_to_end(lines: list[str]) -> None:
+        try:
+            ReceiptParser.parse(lines)
+        except ValueError:
+            pass
+
+    def decode_reduced(data: bytes) -> ndarray:
+        # Upload decoding of the scan views (grayscale, 1/2 or 1/4 resolution - see uploads.py)
+        return cv2.imdecode(np.frombuffer(data, np.uint8), decode_flag(image_info(data), min_side=decode_min_side))
+
+    stages: dict[str, Any] = {}
+    plan: list[tuple[str, Callable[[Any], Any], Sequence[Any]]] = [
+        ("split_receipt_sections", lambda lines: ReceiptParser.split_sections(lines), [lines for lines in corpus if lines]),
+        ("extract_items", lambda s: ReceiptParser.extract_items(s.items), sections),
+        ("parse", parse_end_to_end, corpus),
+        ("decode", lambda data: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), encoded),
+        ("decode_reduced", decode_reduced, encoded),
+        ("preprocess", ReceiptPreprocessor(), rendered),
+        ("segment_lines", ProjectionSegmenter(), [prepared.image for prepared in preprocessed]),
+    ]
+
+    for name, function, inputs in plan:
+        if progress is not None:
+            progress(name)
+        try:
+            stages[name] = asdict(measure(function, inputs, repeat=repeat, trace_memory=trace_memory))
+        except ValueError as ve:
+            stages[name] = _skip_reason(ve)
+
+    if ocr:
+        try:
+            pool = reader_pool or ReaderPool(size=1, gpu=gpu)
+            pool.warm_up()
+        except Exception as e:
+            for name in ("detect", "extract_text", "extract_text_preprocessed", "extract_text_projection", "extract_text_roi", "run"):
+                stages[name] = _skip_reason(e)
+        else:
+            engine = ReceiptEngine(reader_pool=pool)
+            preprocessing_engine = ReceiptEngine(reader_pool=pool, preprocessor=ReceiptPreprocessor())
+
+            def run_parser(image: ndarray) -> None:
+                parser = ReceiptParser(reader_pool=pool)
+                parser.load_image_from_np_ndarray(image)
+                try:
+                    parser.run()
+                except ValueError:
+                    pass
+
+            def detect(prepared: PreprocessedImage) -> None:
+                # CRAFT detection alone, the counterpart of segment_lines
+                with pool.reader() as reader:
+                    reader.detect(prepared.image, canvas_size=prepared.canvas_size)
+
+            ocr_plan = (
+                ("detect", detect, preprocessed),
+                ("extract_text", engine.read_text, rendered),
+                ("extract_text_preprocessed", preprocessing_engine.read_text, rendered),
+                ("extract_text_projection", lambda image: preprocessing_engine.read_text(image, detector='projection'), rendered),
+                ("extract_text_roi", lambda image: preprocessing_engine.read_text(image, roi=True), rendered),
+                ("run", run_parser, rendered),
+            )
+            for name, function, inputs in ocr_plan:
+                if progress is not None:
+                    progress(name)
+                try:
+                    stages[name] = asdict(measure(function, inputs, repeat=repeat, trace_memory=trace_memory))
+                except ValueError as ve:
+                    stages[name] = _skip_reason(ve)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "seed": seed,
+            "receipts": receipts,
+            "images": images,
+            "image_shape": list(rendered[0].shape) if rendered else None,
+            "repeat": repeat,
+        },
+        "stages": stages,
+    }
+
+
+def fixture_samples(images: int = 5, seed: int = 0, directory: Union[str, Path, None] = None) -> list[tuple[ndarray, list[str]]]:
+    """
+    Images with the text printed on them
+    :param images: number of rendered receipts (if no directory is given)
+    :param seed: random seed of the rendered receipts
+    :param directory: directory of photos (.jpg, .jpeg, .png), each with a .txt file of the same name holding its text
+    :return: list of (image, text lines)
+    """
+    if directory is None:
+        corpus = text_corpus(images, seed=seed)
+        return [(render_receipt(lines), [ascii_text(line) for line in lines]) for lines in corpus]
+
+    samples = []
+    for image_path in sorted(Path(directory).iterdir()):
+        text_path = image_path.with_suffix(".txt")
+        if image_path.suffix.lower() not in FIXTURE_EXTENSIONS or not text_path.exists():
+            continue
+        image = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        samples.append((image, text_path.read_text(encoding="utf-8").splitlines()))
+    if not samples:
+        raise ValueError(f"No fixtures (image + .txt) in {directory}")
+    return samples
+
+
+def _flat(lines: Sequence[str]) -> str:
+    # Paragraph mode joins lines differently than they are printed - only the characters are compared
+    return " ".join(" ".join(lines).split())
+
+
+def _fields(lines: Sequence[str]) -> Optional[dict[str, Any]]:
+    try:
+        result = ReceiptParser.parse(lines).to_json()
+    except ValueError:
+        return None
+    return {name: result[name] for name in COMPARED_FIELDS}
+
+
+def _field_agreement(fields: Sequence[Optional[dict[str, Any]]], expected: Sequence[Optional[dict[str, Any]]]) -> float:
+    # Share of the compared fields equal to the expected ones (a receipt that can't be parsed matches nothing)
+    matches = sum(
+        got is not None and want is not None and got[name] == want[name]
+        for got, want in zip(fields, expected) for name in COMPARED_FIELDS
+    )
+    return round(matches / (len(expected) * len(COMPARED_FIELDS)), 4) if expected else 0.0
+
+
+def compare_backends(pools: dict[str, ReaderPool], samples: Sequence[tuple[ndarray, Sequence[str]]], reference: str,
+                     repeat: int = 1, preprocess: bool = True, progress: Optional[Callable[[str], None]] = None) -> dict[str, Any]:
+    """
+    Compare the accuracy and speed of OCR inference backends
+    :param pools: reader pools of the compared backends (ex. `backend.reader_pool()`), by backend name
+    :param samples: images with the text printed on them (`fixture_samples`)
+    :param reference: name of the reference backend (one of `pools`)
+    :param repeat: how many times every image is read by the timed pass
+    :param preprocess: whether images are preprocessed before OCR (OCR_PREPROCESS)
+    :param progress: called with the name of every backend before it starts
+    :return: JSON-serializable report:
+             char_accuracy - mean Levenshtein similarity of the OCR text and the printed text,
+             field_accuracy - share of the parsed fields (date, time, total, payment method, items) equal
+             to the ones parsed from the printed text,
+             reference_text_agreement / reference_field_agreement - the same against the reference backend's output,
+             speedup - p50 latency of the reference backend divided by p50 latency of the backend
+    """
+    if reference not in pools:
+        raise ValueError(f"Reference backend {reference} is not compared")
+    if not samples:
+        raise ValueError("No samples")
+
+    images = [image for image, _ in samples]
+    truth_text = [_flat(lines) for _, lines in samples]
+    truth_fields = [_fields(lines) for _, lines in samples]
+
+    outputs: dict[str, list[list[str]]] = {}
+    backends: dict[str, Any] = {}
+    # The reference first - the others are compared with its output
+    for name in [reference] + [name for name in pools if name != reference]:
+        if progress is not None:
+            progress(name)
+        engine = ReceiptEngine(reader_pool=pools[name], preprocessor=ReceiptPreprocessor() if preprocess else None)
+        try:
+            pools[name].warm_up()
+            # The untimed pass collecting the output is the warmup of the timed one
+            outputs[name] = [list(engine.read_text(image)) for image in images]
+        except Exception as e:
+            if name == reference:
+                raise
+            backends[name] = _skip_reason(e)
+            continue
+        stats = measure(engine.read_text, images, repeat=repeat, warmup=0)
+
+        texts = [_flat(output) for output in outputs[name]]
+        fields = [_fields(output) for output in outputs[name]]
+        reference_texts = [_flat(output) for output in outputs[reference]]
+        backends[name] = {
+            "char_accuracy": round(float(np.mean([Levenshtein.normalized_similarity(text, truth) for text, truth in zip(texts, truth_text)])), 4),
+            "field_accuracy": _field_agreement(fields, truth_fields),
+            "reference_text_agreement": round(float(np.mean([Levenshtein.normalized_similarity(text, other) for text, other in zip(texts, reference_texts)])), 4),
+            "reference_field_agreement": _field_agreement(fields, [_fields(output) for output in outputs[reference]]),
+            "p50_ms": stats.p50_ms,
+            "p95_ms": stats.p95_ms,
+            "throughput_per_s": stats.throughput_per_s,
+            "speedup": round(backends[reference]["p50_ms"] / stats.p50_ms, 2) if name != reference and stats.p50_ms else 1.0,
+            "peak_rss_mb": stats.peak_rss_mb,
+        }
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "reference": reference,
+            "samples": len(samples),
+            "repeat": repeat,
+            "preprocess": preprocess,
+        },
+        "backends": backends,
+    }
@@ -0,0 +1,207 @@
+"""
+Bulk changes of products and transactions: `{"upsert": [...], "delete": [ids]}` in one request.
+
+All items are validated together (`many=True` serializer) and applied in a single database transaction
+with `bulk_create`/`bulk_update` - either every item is saved or none is, and errors are reported per item.
+"""
+import copy
+from typing import Any, Optional
+
+from django.db import transaction
+from django.db.models import Model, QuerySet, prefetch_related_objects
+from rest_framework import serializers
+
+from . import rollups
+from .normalization import assign_canonical
+from .serializers import ProductSerializer, TransactionSerializer
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves primary keys from objects fetched up front, so a list of items is validated with one query per relation
+    """
+    def __init__(self, objects: dict[int, Model], **kwargs: Any):
+        self.objects = objects
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data: Any) -> Model:
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return self.objects[int(data)]
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+
+
+class BulkOperation:
+    """
+    Validates and applies a list of upserts (items with an "id" are updated, the rest created) and deletions
+    """
+    serializer_class: type[serializers.ModelSerializer]
+
+    def __init__(self, queryset: QuerySet, data: Any, context: Optional[dict[str, Any]] = None,
+                 max_items: int = 1000, **save_kwargs: Any):
+        """
+        :param queryset: objects the request may change (scoped to the user)
+        :param data: request body
+        :param context: serializer context
+        :param max_items: maximum number of upserts + deletions
+        :param save_kwargs: attributes set on created objects (ex. user)
+        """
+        self.queryset = queryset
+        self.data = data
+        self.context = context or {}
+        self.max_items = max_items
+        self.save_kwargs = save_kwargs
+        self.errors: dict[str, Any] = {}
+
+    def is_valid(self) -> bool:
+        if not isinstance(self.data, dict):
+            self.errors = {"detail": "Oczekiwano obiektu z polami 'upsert' i 'delete'"}
+            return False
+
+        upserts, deletes = self.data.get("upsert", []), self.data.get("delete", [])
+        if not isinstance(upserts, list) or not isinstance(deletes, list):
+            self.errors = {"detail": "Pola 'upsert' i 'delete' muszą być listami"}
+            return False
+        if len(upserts) + len(deletes) > self.max_items:
+            self.errors = {"detail": f"Maksymalna liczba zmian: {self.max_items}"}
+            return False
+
+        self.serializer = self.serializer_class(data=upserts, many=True, context=self.context)
+        self.prefetch_relations(upserts)
+        self.serializer.is_valid()
+        upsert_errors = [dict(errors) for errors in self.serializer.errors] or [{} for _ in upserts]
+
+        # Primary keys are checked against the user's objects with a single query
+        self.update_ids = [item.get("id") if isinstance(item, dict) else None for item in upserts]
+        requested = [pk for pk in self.update_ids + deletes if isinstance(pk, int)]
+        self.existing = self.queryset.in_bulk(requested)
+
+        seen: set[int] = set()
+        for index, pk in enumerate(self.update_ids):
+            if pk is None:
+                continue
+            if not isinstance(pk, int) or pk not in self.existing:
+                upsert_errors[index]["id"] = [f"Nie znaleziono obiektu o id {pk}"]
+            elif pk in seen:
+                upsert_errors[index]["id"] = ["Obiekt występuje wielokrotnie"]
+            seen.add(pk)
+
+        delete_errors: list[dict[str, Any]] = []
+        for pk in deletes:
+            if not isinstance(pk, int) or pk not in self.existing:
+                delete_errors.append({"id": [f"Nie znaleziono obiektu o id {pk}"]})
+            elif pk in seen:
+                delete_errors.append({"id": ["Obiekt występuje wielokrotnie"]})
+            else:
+                delete_errors.append({})
+            if isinstance(pk, int):
+                seen.add(pk)
+
+        self.delete_ids = deletes
+        if any(upsert_errors) or any(delete_errors):
+            self.errors = {"detail": "Nie zapisano żadnej zmiany", "upsert": upsert_errors, "delete": delete_errors}
+            return False
+        return True
+
+    def prefetch_relations(self, upserts: list[Any]) -> None:
+        """
+        Replace the related fields of the item serializer with ones resolving every referenced object at once
+        """
+        fields = self.serializer.child.fields
+        for name, field in list(fields.items()):
+            if not isinstance(field, serializers.PrimaryKeyRelatedField) or field.read_only:
+                continue
+            pks = set()
+            for item in upserts:
+                try:
+                    pks.add(int(item[name]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            fields[name] = PrefetchedPrimaryKeyRelatedField(
+                field.get_queryset().in_bulk(pks),
+                queryset=field.get_queryset(), required=field.required, allow_null=field.allow_null
+            )
+
+    def save(self) -> dict[str, Any]:
+        """
+        Apply the changes (call `is_valid` first)
+        :return: response data: saved objects (in request order) and deleted ids
+        """
+        model = self.queryset.model
+        objects: list[Model] = []
+        created: list[Model] = []
+        updated: list[Model] = []
+        # Deleted objects and updated objects with their old values
+        previous: list[Model] = [self.existing[pk] for pk in self.delete_ids]
+        fields: set[str] = set()
+
+        for pk, validated_data in zip(self.update_ids, self.serializer.validated_data):
+            if pk is None:
+                obj = model(**validated_data, **self.save_kwargs)
+                created.append(obj)
+            else:
+                obj = self.existing[pk]
+                previous.append(copy.copy(obj))
+                for field, value in validated_data.items():
+                    setattr(obj, field, value)
+                fields.update(validated_data)
+                updated.append(obj)
+            objects.append(obj)
+
+        self.before_write(objects, fields)
+        with transaction.atomic():
+            model.objects.bulk_create(created)
+            if updated and fields:
+                model.objects.bulk_update(updated, list(fields))
+            if self.delete_ids:
+                self.queryset.filter(pk__in=self.delete_ids).delete()
+            self.changed(previous, objects)
+
+        return {"upsert": self.represent(objects), "delete": self.delete_ids}
+
+    def before_write(self, objects: list[Model], fields: set[str]) -> None:
+        """
+        Hook run before the changes are written
+        :param objects: created and updated objects (with the new values)
+        :param fields: fields written by bulk_update (can be extended)
+        """
+
+    def changed(self, previous: list[Model], current: list[Model]) -> None:
+        """
+        Hook run in the database transaction after the changes are applied
+        :param previous: deleted objects and updated objects with their old values
+        :param current: created and updated objects
+        """
+
+    def represent(self, objects: list[Model]) -> list[dict[str, Any]]:
+        return self.serializer_class(objects, many=True, context=self.context).data
+
+
+class ProductBulkOperation(BulkOperation):
+    serializer_class = ProductSerializer
+
+    def before_write(self, objects: list[Model], fields: set[str]) -> None:
+        # bulk_create/bulk_update don't send pre_save - canonical products are assigned here
+        assign_canonical(objects)
+        if "name" in fields:
+            fields.add("canonical")
+
+
+class TransactionBulkOperation(BulkOperation):
+    serializer_class = TransactionSerializer
+
+    def changed(self, previous: list[Model], current: list[Model]) -> None:
+        # bulk_create/bulk_update don't send signals - recompute every day a transaction left or entered
+        days: dict[int, set] = {}
+        for tx in previous + current:
+            days.setdefault(tx.user_id, set()).add(rollups.local_day(tx.date))
+        for user_id, user_days in days.items():
+            rollups.refresh_days(user_id, user_days)
+
+    def represent(self, objects: list[Model]) -> list[dict[str, Any]]:
+        prefetch_related_objects(objects, "products")
+        return super().represent(objects)
@@ -0,0 +1,78 @@
+"""
+Streaming export of transactions with their products.
+
+Rows are read with `QuerySet.iterator(chunk_size=...)` (products are prefetched per chunk) and written
+to the response one by one, so the memory used by an export doesn't depend on the number of transactions.
+"""
+import csv
+import json
+from typing import Any, Iterator
+
+from django.db.models import QuerySet
+
+from .models import Transaction
+
+
+CSV_HEADER = ["transaction_id", "date", "total_amount", "description", "product_id", "product_name", "product_price"]
+
+
+class _Echo:
+    """
+    File-like object returning what is written, so csv.writer can produce single lines
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_transactions(queryset: QuerySet, chunk_size: int = 2000) -> Iterator[Transaction]:
+    """
+    Iterate over transactions in (date, id) order, fetching products once per chunk
+    :param queryset: transactions to export
+    :param chunk_size: number of transactions fetched at once
+    :return: iterator of transactions with prefetched products
+    """
+    return queryset.order_by("date", "id").prefetch_related("products").iterator(chunk_size=chunk_size)
+
+
+def transaction_to_dict(transaction: Transaction) -> dict[str, Any]:
+    return {
+        "id": transaction.pk,
+        "date": transaction.date.isoformat(),
+        "total_amount": str(transaction.total_amount),
+        "description": transaction.description,
+        "products": [
+            {"id": product.pk, "name": product.name, "price": str(product.price)}
+            for product in transaction.products.all()
+        ],
+    }
+
+
+def ndjson_lines(queryset: QuerySet, chunk_size: int = 2000) -> Iterator[str]:
+    """
+    One JSON object per transaction (products nested), one per line
+    :param queryset: transactions to export
+    :param chunk_size: number of transactions fetched at once
+    :return: iterator of lines
+    """
+    for transaction in iter_transactions(queryset, chunk_size):
+        yield json.dumps(transaction_to_dict(transaction), ensure_ascii=False) + "\n"
+
+
+def csv_lines(queryset: QuerySet, chunk_size: int = 2000) -> Iterator[str]:
+    """
+    One row per product (transaction columns repeated), transactions without products get a single row
+    with empty product columns
+    :param queryset: transactions to export
+    :param chunk_size: number of transactions fetched at once
+    :return: iterator of lines
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+
+    for transaction in iter_transactions(queryset, chunk_size):
+        columns = [transaction.pk, transaction.date.isoformat(), transaction.total_amount, transaction.description]
+        products = transaction.products.all()
+        if not products:
+            yield writer.writerow(columns + ["", "", ""])
+        for product in products:
+            yield writer.writerow(columns + [product.pk, product.name, product.price])
@@ -0,0 +1,206 @@
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+# Below this number of windows the prefilter costs more than it saves
+PREFILTER_MIN_WINDOWS = 64
+
+
+class MatchTable:
+    """
+    Scored windows of every keyword of a `KeywordMatcher` in a single text (sorted by start index).
+    Windows scoring below the matcher's `min_threshold` are either missing or scored 0
+    """
+    __slots__ = ('_entries',)
+
+    def __init__(self, entries: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        self._entries = entries
+
+    def find(self, keyword: str, threshold: float, start: int = 0) -> Optional[tuple[int, int]]:
+        """
+        Best window of a keyword, same as `fuzzy_find_substring(text[start:], keyword, threshold)`,
+        but with indexes relative to the whole text
+        :param keyword: keyword (as passed to the matcher)
+        :param threshold: confidence threshold (can't be lower than the matcher's `min_threshold`)
+        :param start: ignore windows starting before this index
+        :return: tuple: (index_start, index_end) or None
+        """
+        starts, ends, scores = self._entries[keyword]
+
+        lo = int(np.searchsorted(starts, start))
+        if lo >= len(scores):
+            return None
+
+        i = lo + int(np.argmax(scores[lo:]))  # First occurrence of the maximum, same as a strict '>' in a loop
+        if scores[i] <= 0 or scores[i] < threshold:
+            return None
+
+        return int(starts[i]), int(ends[i])
+
+    def score(self, keyword: str, start: int = 0) -> float:
+        """
+        Score of the best window of a keyword (0 if no window reaches the matcher's `min_threshold`)
+        :param keyword: keyword (as passed to the matcher)
+        :param start: ignore windows starting before this index
+        :return: fuzz.ratio of the best window
+        """
+        starts, _, scores = self._entries[keyword]
+        lo = int(np.searchsorted(starts, start))
+        return float(scores[lo:].max()) if lo < len(scores) else 0.0
+
+    def first(self, keywords: Sequence[str], threshold: float, start: int = 0) -> Optional[tuple[str, tuple[int, int]]]:
+        """
+        First keyword (in the given order) with a match
+        :param keywords: keywords to check
+        :param threshold: confidence threshold
+        :param start: ignore windows starting before this index
+        :return: tuple: (keyword, (index_start, index_end)) or None
+        """
+        for keyword in keywords:
+            match = self.find(keyword, threshold, start=start)
+            if match is not None:
+                return keyword, match
+        return None
+
+
+class KeywordMatcher:
+    """
+    Compiled set of keywords searched in one pass over a text.
+
+    Windows (text[i:i + len(keyword) + offset]) of all keywords are scored with fuzz.ratio in a single
+    rapidfuzz `cdist` call. On long texts, windows are first prefiltered with an upper bound of their score:
+    fuzz.ratio = 200 * LCS / (len(window) + len(keyword)), and the LCS can't be longer than the number of characters
+    the window shares with the keyword. Character counts of all windows come from one table of cumulative sums
+    built for the characters of all keywords at once
+    """
+
+    def __init__(self, keywords: Sequence[str], min_threshold: float, offset: int = 2, ignore_case: bool = True):
+        """
+        :param keywords: keywords
+        :param min_threshold: lowest threshold that will be used with `MatchTable.find`
+        :param offset: search window offset
+        :param ignore_case: ignore case. If set to True, converts keywords to lowercase (the text is always lowercased)
+        """
+        self.keywords = list(dict.fromkeys(keywords))
+        self.patterns = [keyword.lower() if ignore_case else keyword for keyword in self.keywords]
+        self.min_threshold = min_threshold
+        self.offset = offset
+
+        # Keywords of the same length share their windows
+        self._groups: dict[int, list[int]] = {}
+        for index, pattern in enumerate(self.patterns):
+            self._groups.setdefault(len(pattern), []).append(index)
+
+        # Character index used by the prefilter
+        self._chars = sorted(set(''.join(self.patterns)))
+        self._char_codes = np.array([ord(char) for char in self._chars], dtype=np.uint32)
+        self._char_rows = [
+            np.array([self._chars.index(char) for char in sorted(set(pattern))], dtype=np.intp)
+            for pattern in self.patterns
+        ]
+        self._char_counts = [
+            np.array([pattern.count(char) for char in sorted(set(pattern))], dtype=np.int32)[:, None]
+            for pattern in self.patterns
+        ]
+
+    def scan(self, text: str) -> MatchTable:
+        """
+        Score all keywords over the text
+        :param text: search section
+        :return: MatchTable
+        """
+        text = text.lower()
+        n = len(text)
+        cumulative = None
+
+        windows: list[str] = []
+        groups: dict[int, tuple[slice, np.ndarray, np.ndarray]] = {}
+
+        for size, members in self._groups.items():
+            count = n - size + 1
+            end = size + self.offset
+            if count <= 0:
+                starts = np.empty(0, dtype=np.intp)
+            elif count >= PREFILTER_MIN_WINDOWS and size > 0 and end > 0:
+                if cumulative is None:
+                    cumulative = self._cumulative_char_counts(text)
+                starts = self._candidates(cumulative, n, size, members)
+            else:
+                starts = np.arange(count)
+
+            group = slice(len(windows), len(windows) + len(starts))
+            windows.extend(text[i:i + end] for i in starts.tolist())
+
+            if end > 0:
+                ends = np.minimum(starts + end, n)
+            else:
+                ends = starts + np.array([len(window) for window in windows[group]], dtype=np.intp)
+
+            groups[size] = (group, starts, ends)
+
+        if windows:
+            # float64 - the same values as fuzz.ratio, so ties and threshold checks give identical results
+            scores = process.cdist(self.patterns, windows, scorer=fuzz.ratio, dtype=np.float64, score_cutoff=max(self.min_threshold, 0))
+        else:
+            scores = np.zeros((len(self.patterns), 0))
+
+        entries = {}
+        for size, members in self._groups.items():
+            group, starts, ends = groups[size]
+            for index in members:
+                entries[self.keywords[index]] = (starts, ends, scores[index, group])
+
+        return MatchTable(entries)
+
+    def _cumulative_char_counts(self, text: str) -> np.ndarray:
+        # Row per keyword character: how many times it occurs in text[:i]
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        occurrences = codes[None, :] == self._char_codes[:, None]
+        cumulative = np.zeros((len(self._chars), len(text) + 1), dtype=np.int32)
+        np.cumsum(occurrences, axis=1, out=cumulative[:, 1:])
+        return cumulative
+
+    def _candidates(self, cumulative: np.ndarray, n: int, size: int, members: list[int]) -> np.ndarray:
+        # Windows that can reach min_threshold for at least one keyword of this length
+        starts = np.arange(n - size + 1)
+        stops = np.minimum(starts + size + self.offset, n)
+        window_counts = cumulative[:, stops] - cumulative[:, starts]
+        lengths = stops - starts
+
+        possible = np.zeros(len(starts), dtype=bool)
+        for index in members:
+            shared = np.minimum(window_counts[self._char_rows[index]], self._char_counts[index]).sum(axis=0)
+            upper_bound = 200 * shared / (lengths + size)
+            possible |= (upper_bound > 0) & (upper_bound >= self.min_threshold - 1e-9)
+
+        return starts[possible]
+
+
+@lru_cache(maxsize=256)
+def compile_keywords(keywords: tuple[str, ...], min_threshold: float, offset: int = 2, ignore_case: bool = True) -> KeywordMatcher:
+    """
+    Build (or reuse) a KeywordMatcher - matchers are compiled once per set of keywords
+    :param keywords: keywords
+    :param min_threshold: lowest threshold that will be used with `MatchTable.find`
+    :param offset: search window offset
+    :param ignore_case: ignore case
+    :return: KeywordMatcher
+    """
+    return KeywordMatcher(keywords, min_threshold=min_threshold, offset=offset, ignore_case=ignore_case)
+
+
+def fuzzy_find_substring(text: str, pattern: str, threshold: int = 85, offset: int = 2, ignore_case: bool = True) -> Optional[tuple[int, int]]:
+    """
+    Perform fuzzy search (single keyword `KeywordMatcher`)
+
+    :param text: search section
+    :param pattern: keyword
+    :param threshold: confidence threshold
+    :param offset: search window offset
+    :param ignore_case: ignore case. If set to True, converts search section and keyword to lowercase before performing fuzzy search
+    :return: tuple: (index_start, index_end) or None
+    """
+    return compile_keywords((pattern,), threshold, offset, ignore_case).scan(text).find(pattern, threshold)
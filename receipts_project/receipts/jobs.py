@@ -0,0 +1,133 @@
+"""
+Database-backed queue of receipt scans.
+
+The API stores uploads as `ScanJob` rows and returns immediately, OCR worker processes
+(`python manage.py run_scan_workers`) claim pending jobs one by one and store the result.
+No external broker is needed - the queue is just the `receipts_scanjob` table.
+"""
+import time
+import traceback
+from datetime import timedelta
+from typing import Any, Optional
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ScanJob
+from .scanning import decode_image, scan_image
+
+
+def enqueue_scan(user: Any, file_bytes: bytes) -> ScanJob:
+    """
+    Queue an uploaded image for scanning
+    :param user: owner of the job
+    :param file_bytes: encoded image
+    :return: pending ScanJob
+    """
+    return ScanJob.objects.create(user=user, image=file_bytes)
+
+
+def claim_next_job() -> Optional[ScanJob]:
+    """
+    Atomically move the oldest pending job to RUNNING.
+    The conditional UPDATE guarantees that only one worker wins a job, on any database backend
+    :return: claimed ScanJob or None if the queue is empty
+    """
+    while True:
+        job_id = (
+            ScanJob.objects.filter(status=ScanJob.Status.PENDING)
+            .order_by("created_at", "id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+
+        claimed = ScanJob.objects.filter(pk=job_id, status=ScanJob.Status.PENDING).update(
+            status=ScanJob.Status.RUNNING,
+            started_at=timezone.now()
+        )
+        if claimed:
+            return ScanJob.objects.get(pk=job_id)
+        # Another worker was faster - try the next job
+
+
+def run_job(job: ScanJob) -> ScanJob:
+    """
+    Scan the image of a claimed job and store the result (or the error)
+    :param job: RUNNING ScanJob
+    :return: finished ScanJob
+    """
+    try:
+        job.result = scan_image(decode_image(bytes(job.image)), user=job.user)
+        job.status = ScanJob.Status.DONE
+    except ValueError as ve:
+        job.status = ScanJob.Status.FAILED
+        job.error = f"Błąd danych: {str(ve)}"
+    except Exception as e:
+        traceback.print_exc()
+        job.status = ScanJob.Status.FAILED
+        job.error = f"Błąd parsowania: {str(e)}"
+
+    job.image = b""
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "error", "image", "finished_at"])
+    return job
+
+
+def requeue_stale_jobs(older_than: timedelta) -> int:
+    """
+    Put back RUNNING jobs whose worker most likely died
+    :param older_than: how long a job may run before it's considered stale
+    :return: number of requeued jobs
+    """
+    return ScanJob.objects.filter(
+        status=ScanJob.Status.RUNNING,
+        started_at__lt=timezone.now() - older_than
+    ).update(status=ScanJob.Status.PENDING, started_at=None)
+
+
+def work(poll_interval: float = 1.0, max_jobs: Optional[int] = None, burst: bool = False,
+         stale_after: Optional[timedelta] = None) -> int:
+    """
+    Worker loop: claim and run jobs until stopped
+    :param poll_interval: seconds to sleep when the queue is empty
+    :param max_jobs: stop after this many jobs (None = run forever)
+    :param burst: stop as soon as the queue is empty
+    :param stale_after: requeue jobs running longer than this whenever the queue is empty (None = never)
+    :return: number of processed jobs
+    """
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        close_old_connections()
+        job = claim_next_job()
+
+        # Jobs of workers that died while the others keep running
+        if job is None and stale_after is not None and requeue_stale_jobs(stale_after):
+            job = claim_next_job()
+
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+        processed += 1
+
+    return processed
+
+
+def wait_for_job(job: ScanJob, timeout: float, poll_interval: float = 0.25) -> ScanJob:
+    """
+    Long-poll: wait until the job is finished or the timeout expires
+    :param job: ScanJob
+    :param timeout: maximum number of seconds to wait
+    :param poll_interval: seconds between database checks
+    :return: refreshed ScanJob
+    """
+    deadline = time.monotonic() + timeout
+    while not job.is_finished and time.monotonic() < deadline:
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+        job.refresh_from_db(fields=["status", "result", "error", "finished_at"])
+    return job
@@ -0,0 +1,218 @@
+"""
+Receipt layout recovered from OCR boxes (`ReceiptEngine` detail mode).
+
+EasyOCR with `detail=1, paragraph=False` returns every recognized fragment with its bounding box and confidence.
+1. Boxes are grouped into rows with a sweep over the boxes sorted by vertical center: a box joins the current row
+   if its center is close enough to the row's center (relative to the text height), otherwise it starts a new row.
+2. Rows are joined into lines, so the text-based section search works unchanged, and every character of the joined
+   text is mapped back to its box - any span of the text (an item name, a price, the total) gets the confidence of
+   the boxes it was read from.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from statistics import median
+from typing import Any, Iterable, Optional, Sequence, TypeVar
+
+# Box type grouped by `sweep_rows` (anything with `cy`, `height` and `x0`)
+B = TypeVar("B")
+
+
+@dataclass(frozen=True, slots=True)
+class TextBox:
+    """
+    Fragment of text recognized by the OCR, with its axis-aligned bounding box (pixels of the OCR input)
+    """
+    text: str
+    confidence: float
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+
+    @property
+    def cy(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+    @classmethod
+    def from_readtext(cls, entry: Sequence[Any]) -> "TextBox":
+        """
+        :param entry: `readtext(detail=1)` entry: (4 corner points, text, confidence)
+        """
+        points, text, confidence = entry
+        xs = [float(point[0]) for point in points]
+        ys = [float(point[1]) for point in points]
+        return cls(str(text).strip(), float(confidence), min(xs), min(ys), max(xs), max(ys))
+
+    def to_json(self) -> list[Any]:
+        return [self.text, round(self.confidence, 4), self.x0, self.y0, self.x1, self.y1]
+
+    @classmethod
+    def from_json(cls, data: Sequence[Any]) -> "TextBox":
+        text, confidence, x0, y0, x1, y1 = data
+        return cls(text, float(confidence), float(x0), float(y0), float(x1), float(y1))
+
+
+@dataclass(frozen=True, slots=True)
+class DetectedBox:
+    """
+    Text box found by a detector (pixels of the OCR input), not recognized yet
+    """
+    x0: int
+    x1: int
+    y0: int
+    y1: int
+
+    @property
+    def cy(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+    def to_horizontal(self) -> list[int]:
+        # EasyOCR horizontal_list entry
+        return [self.x0, self.x1, self.y0, self.y1]
+
+
+@dataclass(frozen=True, slots=True)
+class Row:
+    """
+    Boxes of one printed line, left to right
+    """
+    boxes: tuple[TextBox, ...]
+
+    @property
+    def text(self) -> str:
+        return " ".join(box.text for box in self.boxes)
+
+    @property
+    def right(self) -> float:
+        return self.boxes[-1].x1
+
+    @property
+    def height(self) -> float:
+        return median(box.height for box in self.boxes)
+
+    def confidence(self, start: int, end: int) -> Optional[float]:
+        """
+        Confidence of text[start:end]: the lowest confidence of the boxes it overlaps
+        """
+        confidences, offset = [], 0
+        for box in self.boxes:
+            if offset < end and offset + len(box.text) > start:
+                confidences.append(box.confidence)
+            offset += len(box.text) + 1
+        return min(confidences) if confidences else None
+
+
+def sweep_rows(boxes: Iterable[B], tolerance: float = 0.5) -> list[list[B]]:
+    """
+    Group boxes into rows (sorted sweep by vertical center, O(n log n))
+    :param boxes: anything with `cy`, `height` and `x0` (recognized or only detected boxes)
+    :param tolerance: maximum distance of a box center from the row center, relative to the text height
+    :return: rows from top to bottom, boxes of a row from left to right
+    """
+    rows: list[list[B]] = []
+    current: list[B] = []
+    center = height = 0.0
+
+    for box in sorted(boxes, key=lambda box: (box.cy, box.x0)):
+        if current and abs(box.cy - center) <= tolerance * max(height, box.height):
+            current.append(box)
+            # Running means, so a slightly tilted line doesn't drift away from its first box
+            center += (box.cy - center) / len(current)
+            height += (box.height - height) / len(current)
+            continue
+        if current:
+            rows.append(sorted(current, key=lambda box: box.x0))
+        current, center, height = [box], box.cy, box.height
+
+    if current:
+        rows.append(sorted(current, key=lambda box: box.x0))
+    return rows
+
+
+def group_rows(boxes: Iterable[TextBox], tolerance: float = 0.5) -> list[Row]:
+    """
+    Group recognized boxes into rows (see `sweep_rows`), skipping empty fragments
+    :param boxes: recognized boxes
+    :param tolerance: maximum distance of a box center from the row center, relative to the text height
+    :return: rows from top to bottom
+    """
+    return [Row(tuple(row)) for row in sweep_rows((box for box in boxes if box.text), tolerance)]
+
+
+class LayoutText:
+    """
+    Rows joined into text ("\\n" between rows, " " between boxes) with every character mapped back to its box
+    """
+
+    def __init__(self, rows: Sequence[Row]):
+        self.rows = list(rows)
+        self.lines = [row.text for row in self.rows]
+        self.text = "\n".join(self.lines)
+
+        # Start offsets of the boxes in `text`, in reading order
+        self._starts: list[int] = []
+        self._boxes: list[TextBox] = []
+        self._rows: list[int] = []
+        offset = 0
+        for index, row in enumerate(self.rows):
+            for box in row.boxes:
+                self._starts.append(offset)
+                self._boxes.append(box)
+                self._rows.append(index)
+                offset += len(box.text) + 1  # The separator after the box (space or newline)
+
+    def boxes_in(self, start: int, end: int) -> list[TextBox]:
+        """
+        Boxes overlapping text[start:end]
+        """
+        if end <= start:
+            return []
+        first = max(bisect_right(self._starts, start) - 1, 0)
+        last = bisect_right(self._starts, end - 1)
+        return [
+            box for box, box_start in zip(self._boxes[first:last], self._starts[first:last])
+            if box_start + len(box.text) > start
+        ]
+
+    def confidence(self, start: int, end: int) -> Optional[float]:
+        """
+        Confidence of text[start:end]: the lowest confidence of its boxes
+        """
+        boxes = self.boxes_in(start, end)
+        return min(box.confidence for box in boxes) if boxes else None
+
+    def find_confidence(self, fragment: Optional[str], start: int = 0) -> Optional[float]:
+        """
+        Confidence of the first occurrence of a fragment (ex. an extracted date)
+        """
+        if not fragment:
+            return None
+        index = self.text.find(fragment, start)
+        return None if index < 0 else self.confidence(index, index + len(fragment))
+
+    def rows_in(self, start: int, end: int) -> list[Row]:
+        """
+        Rows of text[start:end], with the boxes whose middle lies in the range (sections found in the text
+        don't have to start or end exactly at a box boundary)
+        """
+        selected: dict[int, list[TextBox]] = {}
+        for box, box_start, row in zip(self._boxes, self._starts, self._rows):
+            if start <= box_start + len(box.text) / 2 < end:
+                selected.setdefault(row, []).append(box)
+        return [Row(tuple(boxes)) for _, boxes in sorted(selected.items())]
+
+
+def boxes_to_json(boxes: Iterable[TextBox]) -> list[list[Any]]:
+    return [box.to_json() for box in boxes]
+
+
+def boxes_from_json(data: Iterable[Sequence[Any]]) -> list[TextBox]:
+    return [TextBox.from_json(entry) for entry in data]
@@ -0,0 +1,44 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Mierzy czas i pamięć poszczególnych etapów OCR (wynik w formacie JSON)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--receipts", type=int, default=200, help="Liczba syntetycznych paragonów (etapy parsowania)")
+        parser.add_argument("--images", type=int, default=3, help="Liczba renderowanych zdjęć (etapy OCR)")
+        parser.add_argument("--seed", type=int, default=0, help="Ziarno generatora korpusu")
+        parser.add_argument("--repeat", type=int, default=1, help="Ile razy przetworzyć każde wejście")
+        parser.add_argument("--no-ocr", action="store_true", help="Pomiń etapy wymagające EasyOCR")
+        parser.add_argument("--trace-memory", action="store_true", help="Mierz też szczytowe alokacje Pythona (tracemalloc)")
+        parser.add_argument("--output", help="Zapisz wynik do pliku zamiast na standardowe wyjście")
+
+    def handle(self, *args, **options):
+        from receipts.benchmark import run_benchmark
+
+        for option in ("receipts", "images", "repeat"):
+            if options[option] < 1:
+                raise CommandError(f"--{option} musi być większe od zera")
+
+        report = run_benchmark(
+            receipts=options["receipts"],
+            images=options["images"],
+            seed=options["seed"],
+            repeat=options["repeat"],
+            ocr=not options["no_ocr"],
+            gpu=settings.OCR_USE_GPU,
+            trace_memory=options["trace_memory"],
+            progress=lambda stage: self.stderr.write(f"Etap: {stage}"),
+            decode_min_side=settings.OCR_DECODE_MIN_SIDE
+        )
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.write(output)
+            self.stderr.write(self.style.SUCCESS(f"Zapisano wynik do {options['output']}"))
+        else:
+            self.stdout.write(output)
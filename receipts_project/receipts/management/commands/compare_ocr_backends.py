@@ -0,0 +1,67 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Porównuje dokładność i szybkość backendów inferencji OCR (wynik w formacie JSON)"
+
+    def add_arguments(self, parser):
+        from receipts.ocr_backends import BACKEND_NAMES
+
+        parser.add_argument("--backends", nargs="+", choices=BACKEND_NAMES, default=list(BACKEND_NAMES),
+                            help="Porównywane backendy")
+        parser.add_argument("--reference", choices=BACKEND_NAMES, default="easyocr", help="Backend odniesienia (domyślnie EasyOCR)")
+        parser.add_argument("--threads", type=int, help="Liczba wątków obliczeń (domyślnie ustawienie biblioteki)")
+        parser.add_argument("--fixtures", help="Katalog zdjęć paragonów z plikami .txt o tej samej nazwie zawierającymi ich tekst")
+        parser.add_argument("--images", type=int, default=5, help="Liczba renderowanych paragonów (bez --fixtures)")
+        parser.add_argument("--seed", type=int, default=0, help="Ziarno generatora paragonów")
+        parser.add_argument("--repeat", type=int, default=1, help="Ile razy odczytać każde zdjęcie w pomiarze czasu")
+        parser.add_argument("--no-preprocess", action="store_true", help="Pomiń przetwarzanie wstępne zdjęć")
+        parser.add_argument("--output", help="Zapisz wynik do pliku zamiast na standardowe wyjście")
+
+    def handle(self, *args, **options):
+        from receipts.benchmark import compare_backends, fixture_samples
+        from receipts.ocr_backends import create_backend
+
+        # --images is only used without --fixtures
+        for option in ("repeat",) if options["fixtures"] else ("images", "repeat"):
+            if options[option] < 1:
+                raise CommandError(f"--{option} musi być większe od zera")
+
+        names = list(dict.fromkeys([options["reference"], *options["backends"]]))
+        configured = getattr(settings, "OCR_INFERENCE", None) or {}
+
+        pools = {}
+        for name in names:
+            # The configured backend keeps its options (ex. model_dir of ONNX exports)
+            backend_options = dict(configured.get("OPTIONS", {})) if configured.get("BACKEND", "easyocr") == name else {}
+            if options["threads"]:
+                backend_options["threads"] = options["threads"]
+            try:
+                pools[name] = create_backend({"BACKEND": name, "OPTIONS": backend_options}).reader_pool()
+            except (TypeError, ValueError) as e:
+                raise CommandError(f"Niepoprawny backend {name}: {e}")
+
+        try:
+            samples = fixture_samples(images=options["images"], seed=options["seed"], directory=options["fixtures"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        report = compare_backends(
+            pools,
+            samples,
+            reference=options["reference"],
+            repeat=options["repeat"],
+            preprocess=not options["no_preprocess"],
+            progress=lambda name: self.stderr.write(f"Backend: {name}")
+        )
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.write(output)
+            self.stderr.write(self.style.SUCCESS(f"Zapisano wynik do {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = "Przypisuje produktom kanoniczne nazwy (CanonicalProduct) - np. po włączeniu normalizacji lub zmianie progu"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Przelicz również produkty, które mają już kanoniczną nazwę")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Liczba produktów zapisywanych naraz")
+
+    def handle(self, *args, **options):
+        from receipts.models import Product
+        from receipts.normalization import assign_canonical, get_normalizer
+
+        if get_normalizer() is None:
+            raise CommandError("Normalizacja nazw produktów jest wyłączona (PRODUCT_NORMALIZATION = None)")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size musi być dodatnie")
+
+        products = Product.objects.order_by("pk").only("pk", "name", "canonical")
+        if not options["all"]:
+            products = products.filter(canonical__isnull=True)
+
+        updated, last_pk = 0, 0
+        while True:
+            chunk = list(products.filter(pk__gt=last_pk)[:options["chunk_size"]])
+            if not chunk:
+                break
+            assign_canonical(chunk)
+            with transaction.atomic():
+                Product.objects.bulk_update(chunk, ["canonical"])
+            updated += len(chunk)
+            last_pk = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Przypisano kanoniczne nazwy {updated} produktom"))
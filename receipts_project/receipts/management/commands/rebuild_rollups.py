@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Przelicza od nowa dzienne sumy transakcji (DailySpending) używane przez kalendarz"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Przelicz tylko dane użytkownika o podanej nazwie")
+
+    def handle(self, *args, **options):
+        from receipts.rollups import rebuild
+
+        user = None
+        if options["user"]:
+            user = get_user_model().objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"Nie znaleziono użytkownika {options['user']}")
+
+        created = rebuild(user=user)
+        self.stdout.write(self.style.SUCCESS(f"Zapisano {created} dziennych podsumowań"))
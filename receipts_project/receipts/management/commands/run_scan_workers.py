@@ -0,0 +1,55 @@
+import multiprocessing
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _worker(poll_interval: float, burst: bool, stale_after: timedelta) -> None:
+    import django
+    django.setup()
+
+    from receipts.jobs import work
+    from receipts.ocr_pool import get_configured_reader_pool
+
+    # Every worker process loads its own readers once, before claiming the first job
+    get_configured_reader_pool().warm_up()
+    work(poll_interval=poll_interval, burst=burst, stale_after=stale_after)
+
+
+class Command(BaseCommand):
+    help = "Uruchamia procesy OCR przetwarzające kolejkę skanów paragonów"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Liczba procesów OCR")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Odstęp (s) między sprawdzeniami pustej kolejki")
+        parser.add_argument("--stale-after", type=int, default=600, help="Po ilu sekundach przerwane zadania wracają do kolejki")
+        parser.add_argument("--burst", action="store_true", help="Zakończ, gdy kolejka będzie pusta")
+
+    def handle(self, *args, **options):
+        from receipts.jobs import requeue_stale_jobs
+
+        stale_after = timedelta(seconds=options["stale_after"])
+        requeued = requeue_stale_jobs(stale_after)
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Przywrócono do kolejki {requeued} przerwanych zadań"))
+
+        workers = max(options["workers"], 1)
+        self.stdout.write(self.style.SUCCESS(f"Uruchamiam {workers} proces(y) OCR..."))
+
+        # Child processes open their own database connections
+        connections.close_all()
+
+        processes = [
+            multiprocessing.Process(target=_worker, args=(options["poll_interval"], options["burst"], stale_after), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -1,17 +1,36 @@
-from datetime import datetime
-from django.core.management.base import BaseCommand
+import random
+import time
+from datetime import date, datetime, timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.utils import timezone
 from decimal import Decimal
-from receipts.models import Transaction, Product
+from receipts.models import DailySpending, Transaction, Product
+from receipts.normalization import assign_canonical
 
 
 class Command(BaseCommand):
-    help = "Dodaje przykładowe transakcje i produkty"
+    help = "Dodaje przykładowe transakcje i produkty (z --transactions: losowe dane do testów obciążeniowych)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Właściciel danych (domyślnie pierwszy superużytkownik)")
+        parser.add_argument("--users", type=int, help="Liczba użytkowników seed_user_<n> (tworzonych w razie potrzeby) zamiast --user")
+        parser.add_argument("--transactions", type=int, help="Liczba losowych transakcji na użytkownika")
+        parser.add_argument("--products-per-tx", type=int, default=3, help="Średnia liczba produktów w zakupie (0 = bez produktów)")
+        parser.add_argument("--years", type=float, default=2, help="Długość historii w latach")
+        parser.add_argument("--end", help="Ostatni dzień historii RRRR-MM-DD (domyślnie dzisiaj)")
+        parser.add_argument("--seed", type=int, default=0, help="Ziarno generatora (te same opcje = te same dane)")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Liczba transakcji zapisywanych w jednej transakcji bazy danych")
 
     def handle(self, *args, **kwargs):
+        users = self.get_users(kwargs)
+        if kwargs.get("users") is not None or kwargs.get("transactions") is not None:
+            return self.seed_synthetic(users, kwargs)
+        user = users[0]
 
-        self.stdout.write(self.style.ERROR("Usuwam stare dane..."))
-        Product.objects.all().delete()
-        Transaction.objects.all().delete()
+        self.stdout.write(self.style.ERROR(f"Usuwam stare dane użytkownika {user}..."))
+        Transaction.objects.filter(user=user).delete()
 
         self.stdout.write(self.style.WARNING("Dodaję nowe transakcje i produkty..."))
 
@@ -114,6 +133,7 @@ class Command(BaseCommand):
         for entry in data:
             dt = datetime.strptime(entry["date"], "%d:%m:%Y %H:%M")
             transaction = Transaction.objects.create(
+                user=user,
                 date=dt,
                 total_amount=entry["total_amount"],
                 description=entry["description"]
@@ -126,3 +146,92 @@ class Command(BaseCommand):
                 )
 
         self.stdout.write(self.style.SUCCESS("Przykładowe dane zostały dodane."))
+
+    @staticmethod
+    def get_users(options) -> list:
+        User = get_user_model()
+        if options.get("users") is not None:
+            if options["users"] < 1:
+                raise CommandError("--users musi być dodatnie")
+            users = []
+            for number in range(1, options["users"] + 1):
+                user, created = User.objects.get_or_create(username=f"seed_user_{number}")
+                if created:
+                    user.set_unusable_password()
+                    user.save(update_fields=["password"])
+                users.append(user)
+            return users
+
+        if options.get("user"):
+            user = User.objects.filter(username=options["user"]).first()
+        else:
+            user = User.objects.filter(is_superuser=True).order_by("pk").first() or User.objects.order_by("pk").first()
+        if user is None:
+            raise CommandError("Brak użytkownika – utwórz konto (np. python manage.py createsuperuser)")
+        return [user]
+
+    def seed_synthetic(self, users: list, options: dict):
+        from receipts import rollups, signals
+        from receipts.seeding import synthetic_transactions
+
+        count = options["transactions"] if options["transactions"] is not None else 1000
+        batch_size = max(1, options["batch_size"])
+        try:
+            last_day = date.fromisoformat(options["end"]) if options["end"] else timezone.localdate()
+        except ValueError:
+            raise CommandError(f"Nieprawidłowa data --end: {options['end']}")
+        first_day = last_day - timedelta(days=max(1, round(options["years"] * 365)) - 1)
+
+        rng = random.Random(options["seed"])
+        # The rollup is rebuilt at the end - the per-row signal handlers would only slow the inserts and deletes down
+        with signals.paused():
+            for user in users:
+                self.stdout.write(self.style.ERROR(f"Usuwam stare dane użytkownika {user}..."))
+                self.delete_transactions(user, batch_size)
+
+            for user in users:
+                self.stdout.write(self.style.WARNING(
+                    f"{user}: {count} transakcji od {first_day} do {last_day}..."
+                ))
+                rows, started = 0, time.perf_counter()
+                generated = synthetic_transactions(rng, user.pk, count, options["products_per_tx"], first_day, last_day)
+                for done in range(0, count, batch_size):
+                    rows += self.insert_batch([next(generated) for _ in range(min(batch_size, count - done))])
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"  {min(done + batch_size, count)}/{count} transakcji, {rows} wierszy, {rows / elapsed:.0f} wierszy/s")
+
+                started = time.perf_counter()
+                days = rollups.rebuild(user=user)
+                self.stdout.write(f"  Dzienne sumy: {days} dni w {time.perf_counter() - started:.1f} s")
+
+        self.stdout.write(self.style.SUCCESS("Losowe dane zostały dodane."))
+
+    @staticmethod
+    def delete_transactions(user, batch_size: int) -> None:
+        # Products first (a single DELETE), then transactions in chunks of primary keys to bound the memory used
+        Product.objects.filter(transaction__user=user).delete()
+        while True:
+            pks = list(Transaction.objects.filter(user=user).values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            Transaction.objects.filter(pk__in=pks).delete()
+        DailySpending.objects.filter(user=user).delete()
+
+    @staticmethod
+    def insert_batch(batch: list) -> int:
+        """
+        Save transactions with their products in one database transaction
+        :return: number of inserted rows
+        """
+        with db_transaction.atomic():
+            transactions = Transaction.objects.bulk_create([tx for tx, _ in batch])
+            if any(tx.pk is None for tx in transactions):
+                raise CommandError("Baza danych nie zwraca kluczy z bulk_create – generator wymaga SQLite lub PostgreSQL")
+            products = []
+            for tx, tx_products in batch:
+                for product in tx_products:
+                    product.transaction = tx
+                    products.append(product)
+            assign_canonical(products)
+            Product.objects.bulk_create(products)
+        return len(transactions) + len(products)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0003_receiptscan'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date', 'id'], name='receipts_tr_date_cbe6a8_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Nullable owner column - existing rows are assigned in 0006, the column becomes required in 0007.
+# Schema and data changes run in separate migrations (and transactions): PostgreSQL refuses to ALTER
+# a table with pending trigger events of an UPDATE made in the same transaction
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0004_transaction_date_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
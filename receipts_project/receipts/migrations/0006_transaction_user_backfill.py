@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def assign_owner(apps, schema_editor):
+    """
+    Existing transactions belong to the first superuser (or the first user).
+    A placeholder account without a usable password is created only if there are transactions but no users
+    """
+    Transaction = apps.get_model("receipts", "Transaction")
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+
+    orphans = Transaction.objects.filter(user__isnull=True)
+    if not orphans.exists():
+        return
+
+    owner = (
+        User.objects.filter(is_superuser=True).order_by("pk").first()
+        or User.objects.order_by("pk").first()
+        or User.objects.create(username="legacy", password="!")
+    )
+    orphans.update(user=owner)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0005_transaction_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_owner, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def build_rollup(apps, schema_editor):
+    Transaction = apps.get_model("receipts", "Transaction")
+    DailySpending = apps.get_model("receipts", "DailySpending")
+
+    zero = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
+    rows = (
+        Transaction.objects
+        .annotate(day=TruncDate("date", tzinfo=timezone.get_current_timezone()))
+        .values("user_id", "day")
+        .annotate(
+            income=Sum(Case(When(total_amount__gt=0, then=F("total_amount")), default=zero)),
+            expense=Sum(Case(When(total_amount__lt=0, then=F("total_amount")), default=zero)),
+            count=Count("id"),
+        )
+        .order_by()
+    )
+    DailySpending.objects.bulk_create((DailySpending(**row) for row in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0007_transaction_user_required'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySpending',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_spending', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='unique_daily_spending')],
+            },
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+
+SQLITE_CREATE = [
+    # Distinct product names - the index covers each spelling once, not every purchase
+    "CREATE TABLE receipts_product_name (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    # External content table: only the trigram index is stored, names are read from receipts_product_name
+    "CREATE VIRTUAL TABLE receipts_product_search USING fts5("
+    "name, content='receipts_product_name', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER receipts_product_name_insert AFTER INSERT ON receipts_product_name BEGIN "
+    "INSERT INTO receipts_product_search(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER receipts_product_name_delete AFTER DELETE ON receipts_product_name BEGIN "
+    "INSERT INTO receipts_product_search(receipts_product_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+    # Every product write (including bulk_create and QuerySet.update) registers its name
+    "CREATE TRIGGER receipts_product_search_insert AFTER INSERT ON receipts_product BEGIN "
+    "INSERT OR IGNORE INTO receipts_product_name(name) VALUES (new.name); END",
+    "CREATE TRIGGER receipts_product_search_update AFTER UPDATE OF name ON receipts_product BEGIN "
+    "INSERT OR IGNORE INTO receipts_product_name(name) VALUES (new.name); END",
+    "INSERT OR IGNORE INTO receipts_product_name(name) SELECT DISTINCT name FROM receipts_product",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS receipts_product_search_insert",
+    "DROP TRIGGER IF EXISTS receipts_product_search_update",
+    "DROP TABLE IF EXISTS receipts_product_search",
+    "DROP TABLE IF EXISTS receipts_product_name",
+]
+POSTGRESQL_CREATE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # icontains compiles to UPPER(name) LIKE UPPER(...), which can use this index
+    "CREATE INDEX receipts_product_name_trgm ON receipts_product USING gin (UPPER(name) gin_trgm_ops)",
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS receipts_product_name_trgm",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0008_dailyspending'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='receipts_pr_name_b4ec5c_idx'),
+        ),
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
@@ -1,14 +1,37 @@
+from django.conf import settings
 from django.db import models
 
 class Transaction(models.Model):
+    user: models.ForeignKey = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="transactions",
+        on_delete=models.CASCADE
+    )
     date: models.DateTimeField = models.DateTimeField()
     total_amount: models.DecimalField = models.DecimalField(max_digits=10, decimal_places=2)
     description: models.CharField = models.CharField(max_length=255, blank=True)
 
+    class Meta:
+        indexes = [
+            # Every query is scoped to a user: lists (keyset pagination on date, id), exports and calendar aggregations
+            models.Index(fields=["user", "date"]),
+        ]
+
     def __str__(self):
         return f"Transaction {self.id} - {self.total_amount} PLN" # type: ignore
 
 
+class CanonicalProduct(models.Model):
+    """
+    Single product behind many spellings of its name (see normalization.py)
+    """
+    key: models.CharField = models.CharField(max_length=100, unique=True)  # Normalized name used for matching
+    name: models.CharField = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.name
+
+
 class Product(models.Model):
     name: models.CharField = models.CharField(max_length=100)
     price: models.DecimalField = models.DecimalField(max_digits=8, decimal_places=2)
@@ -17,6 +40,110 @@ class Product(models.Model):
         related_name="products",
         on_delete=models.CASCADE
     )
+    canonical: models.ForeignKey = models.ForeignKey(
+        CanonicalProduct,
+        related_name="products",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["transaction", "name"]),
+            # Search results: purchases of the matched names
+            models.Index(fields=["name"]),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class DailySpending(models.Model):
+    """
+    Per-user, per-day totals of transactions (day in the local timezone), kept up to date by signals (see rollups.py)
+    """
+    user: models.ForeignKey = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="daily_spending",
+        on_delete=models.CASCADE
+    )
+    day: models.DateField = models.DateField()
+    income: models.DecimalField = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Sum of positive amounts
+    expense: models.DecimalField = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Sum of negative amounts (<= 0)
+    count: models.PositiveIntegerField = models.PositiveIntegerField(default=0)  # Number of transactions
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day"], name="unique_daily_spending"),
+        ]
+
+    @property
+    def total(self):
+        return self.income + self.expense
+
+    def __str__(self):
+        return f"DailySpending {self.day} - {self.total} PLN"
+
+
+class ScanJob(models.Model):
+    """
+    Receipt scan queued for the OCR workers (see jobs.py and the run_scan_workers command)
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    user: models.ForeignKey = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="scan_jobs",
+        on_delete=models.CASCADE
+    )
+    status: models.CharField = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    image: models.BinaryField = models.BinaryField(blank=True)  # Uploaded file, cleared once the job is finished
+    result: models.JSONField = models.JSONField(null=True, blank=True)
+    error: models.TextField = models.TextField(blank=True)
+    created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    started_at: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+    finished_at: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    def __str__(self):
+        return f"ScanJob {self.id} - {self.status}" # type: ignore
+
+
+class ReceiptScan(models.Model):
+    """
+    Raw OCR output of a scanned receipt, kept so the receipt can be parsed again
+    after the parsing rules change (see raw_scans.py and the reparse_scans command)
+    """
+    user: models.ForeignKey = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="receipt_scans",
+        on_delete=models.CASCADE
+    )
+    image_hash: models.CharField = models.CharField(max_length=80, db_index=True)  # scan_cache.content_hash of the decoded image
+    raw_output: models.JSONField = models.JSONField(default=list)  # Lines returned by the OCR
+    boxes: models.JSONField = models.JSONField(null=True, blank=True)  # Bounding boxes of the lines (if the engine returns them)
+    result: models.JSONField = models.JSONField(null=True, blank=True)  # ReceiptResult.to_json() of the latest parse
+    error: models.TextField = models.TextField(blank=True)  # Error of the latest parse
+    created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    parsed_at: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"ReceiptScan {self.id}" # type: ignore
@@ -0,0 +1,297 @@
+"""
+Product name normalization: OCR spellings ("MASLO EKSTRA", "MASŁO EKSTR", "MA5ŁO EKSTRA") are mapped
+to a single `CanonicalProduct`.
+
+1. A name is reduced to a key: lowercase, without diacritics and punctuation, digits read as letters inside words.
+2. Keys of known canonical products are kept in memory in a blocking index: buckets by prefix and by trigram.
+   A new key is compared (rapidfuzz) only with the keys sharing a bucket with it, never with the whole catalog.
+3. Recent name -> key mappings are kept in an LRU.
+
+The index and the LRU hold keys (strings), not database ids, so a rolled back transaction can't leave
+a dangling id behind - ids are resolved with one query per batch of names (`resolve`).
+Canonical products are created only when products are saved; scans merely look existing ones up (`lookup`).
+
+Canonical products are shared by all users, but `CanonicalProduct.name` (the first spelling anyone saved)
+is only used for matching - names shown to a user come from their own products (`user_canonical_names`).
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Iterable, Optional, Sequence
+
+from django.conf import settings
+from django.db.models import Count, Subquery
+from rapidfuzz import fuzz
+
+from .models import CanonicalProduct, Product
+
+
+# Characters NFKD doesn't decompose
+_TRANSLITERATION = str.maketrans({"ł": "l", "ø": "o", "đ": "d", "ß": "ss"})
+# Digits misread by OCR in place of letters
+_DIGIT_LETTERS = {"0": "o", "1": "l", "3": "e", "4": "a", "5": "s", "6": "g", "8": "b"}
+_DIGIT_IN_WORD = re.compile(r"(?<=[a-z])[0134568](?=[a-z])")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def name_key(name: str) -> str:
+    """
+    Comparison key of a product name
+    :param name: product name (as read by OCR or typed)
+    :return: key: lowercase ASCII words separated by single spaces
+    """
+    text = unicodedata.normalize("NFKD", name.lower().translate(_TRANSLITERATION))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = _DIGIT_IN_WORD.sub(lambda match: _DIGIT_LETTERS[match.group()], text)
+    return " ".join(_NON_WORD.sub(" ", text).split())[:100]
+
+
+def display_name(name: str) -> str:
+    return " ".join(name.split())[:100]
+
+
+def _digits(key: str) -> str:
+    # Numbers in names (sizes, percentages) must agree - "mleko 2" and "mleko 3 2" are different products
+    return "".join(char for char in key if char.isdigit())
+
+
+class BlockingIndex:
+    """
+    Canonical keys bucketed by prefix and trigrams. Candidates of a key are the keys sharing its prefix bucket
+    and the keys sharing the most trigram buckets with it
+    """
+
+    def __init__(self, prefix_length: int = 3, max_candidates: int = 50):
+        self.prefix_length = prefix_length
+        self.max_candidates = max_candidates
+        self.keys: set[str] = set()
+        self.prefixes: dict[str, set[str]] = {}
+        self.trigrams: dict[str, set[str]] = {}
+
+    @staticmethod
+    def _trigrams(key: str) -> set[str]:
+        padded = f" {key} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, key: str) -> None:
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        self.prefixes.setdefault(key[:self.prefix_length], set()).add(key)
+        for gram in self._trigrams(key):
+            self.trigrams.setdefault(gram, set()).add(key)
+
+    def candidates(self, key: str) -> set[str]:
+        shared: Counter[str] = Counter()
+        for gram in self._trigrams(key):
+            shared.update(self.trigrams.get(gram, ()))
+        candidates = {candidate for candidate, _ in shared.most_common(self.max_candidates)}
+        return candidates | self.prefixes.get(key[:self.prefix_length], set())
+
+    def best_match(self, key: str, threshold: float) -> Optional[tuple[str, float]]:
+        """
+        Most similar known key
+        :param key: key to match
+        :param threshold: minimal fuzz.ratio
+        :return: tuple: (key, score) or None
+        """
+        if key in self.keys:
+            return key, 100.0
+
+        digits = _digits(key)
+        best: Optional[tuple[str, float]] = None
+        for candidate in self.candidates(key):
+            if _digits(candidate) != digits:
+                continue
+            score = fuzz.ratio(key, candidate, score_cutoff=threshold)
+            if score and (best is None or score > best[1] or (score == best[1] and candidate < best[0])):
+                best = (candidate, score)
+        return best
+
+
+class ProductNormalizer:
+    """
+    Maps product names to canonical products (thread-safe, one per process - see `get_normalizer`)
+    """
+
+    def __init__(self, threshold: float = 85, cache_size: int = 4096, refresh_interval: float = 5.0):
+        """
+        :param threshold: minimal similarity (fuzz.ratio of the keys) to reuse a canonical product
+        :param cache_size: number of recent name -> key mappings kept in the LRU
+        :param refresh_interval: minimal time (seconds) between loads of canonical products created by other processes
+        """
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = 0.0
+        self.index = BlockingIndex()
+        self._names: dict[str, str] = {}  # key -> display name of canonical products created by this process
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded_id: Optional[int] = None
+
+    def refresh(self) -> None:
+        """
+        Load canonical products created since the last refresh (by any process)
+        """
+        rows = CanonicalProduct.objects.order_by("id")
+        if self._loaded_id is not None:
+            rows = rows.filter(id__gt=self._loaded_id)
+        last_id = self._loaded_id or 0
+        for pk, key in rows.values_list("id", "key").iterator(chunk_size=10000):
+            self.index.add(key)
+            last_id = pk
+        self._loaded_id = last_id
+        self._refreshed_at = time.monotonic()
+
+    def _match(self, name: str) -> tuple[str, Optional[str]]:
+        # Key of a name and the known key it matches (None if it's a new product) - called with the lock held
+        if self._loaded_id is None:
+            self.refresh()
+
+        key = name_key(name) or display_name(name).lower()
+        match = self.index.best_match(key, self.threshold)
+        if match is None and time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            # Maybe another process has created it in the meantime
+            self.refresh()
+            match = self.index.best_match(key, self.threshold)
+        return key, None if match is None else match[0]
+
+    def key(self, name: str) -> tuple[str, str]:
+        """
+        Canonical key of a name (known canonical products are matched, unknown names become new keys)
+        :param name: product name
+        :return: tuple: (canonical key, display name for a new canonical product)
+        """
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None:
+                self._cache.move_to_end(name)
+                return cached, self._names.get(cached, display_name(name))
+
+            key, canonical = self._match(name)
+            if canonical is None:
+                self.index.add(key)
+                self._names[key] = display_name(name)
+                canonical = key
+
+            self._cache[name] = canonical
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return canonical, self._names.get(canonical, display_name(name))
+
+    def resolve(self, names: Sequence[str]) -> list[CanonicalProduct]:
+        """
+        Canonical products of many names (created if needed) - at most three queries for the whole batch
+        :param names: product names
+        :return: canonical product of each name (in input order)
+        """
+        keys = [self.key(name) for name in names]
+        wanted = dict(keys)
+        existing = CanonicalProduct.objects.in_bulk(list(wanted), field_name="key")
+
+        missing = [CanonicalProduct(key=key, name=name) for key, name in wanted.items() if key not in existing]
+        if missing:
+            CanonicalProduct.objects.bulk_create(missing, ignore_conflicts=True)
+            existing = CanonicalProduct.objects.in_bulk(list(wanted), field_name="key")
+
+        return [existing[key] for key, _ in keys]
+
+    def lookup(self, names: Sequence[str]) -> list[Optional[CanonicalProduct]]:
+        """
+        Existing canonical products of many names - nothing is created or added to the index
+        (ex. scans, which may never be saved) - one query for the whole batch
+        :param names: product names
+        :return: canonical product of each name (in input order), None for names matching no product
+        """
+        with self._lock:
+            keys = [self._cache.get(name) or self._match(name)[1] for name in names]
+        # A key created by this process may have been rolled back - it's simply not found
+        existing = CanonicalProduct.objects.in_bulk({key for key in keys if key is not None}, field_name="key")
+        return [None if key is None else existing.get(key) for key in keys]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+def assign_canonical(products: Iterable[Product]) -> None:
+    """
+    Set `canonical` of products from their names (unsaved objects, ex. before bulk_create/bulk_update)
+    """
+    products = list(products)
+    if not products or get_normalizer() is None:
+        return
+    for product, canonical in zip(products, get_normalizer().resolve([product.name for product in products])):
+        product.canonical = canonical
+
+
+def user_canonical_names(user: Any, canonical_ids: Iterable[int]) -> dict[int, str]:
+    """
+    Names of canonical products as the user spells them: the most frequent name among the user's products
+    :param user: owner (None = no names)
+    :param canonical_ids: canonical product ids
+    :return: dict: canonical id -> name, only products the user has bought
+    """
+    canonical_ids = set(canonical_ids)
+    if user is None or not canonical_ids:
+        return {}
+
+    rows = (
+        Product.objects
+        .filter(transaction__user=user, canonical__in=canonical_ids)
+        .values("canonical", "name")
+        .annotate(count=Count("id"))
+        .order_by("canonical", "-count", "name")
+    )
+    names: dict[int, str] = {}
+    for row in rows:
+        names.setdefault(row["canonical"], row["name"])
+    return names
+
+
+def user_spelling(user: Any, canonical: Any) -> Subquery:
+    """
+    Subquery of the user's most frequent name of a canonical product (see `user_canonical_names`)
+    :param user: owner
+    :param canonical: canonical product id or expression (ex. OuterRef("canonical"))
+    """
+    return Subquery(
+        Product.objects
+        .filter(transaction__user=user, canonical=canonical)
+        .values("name")
+        .annotate(count=Count("id"))
+        .order_by("-count", "name")
+        .values("name")[:1]
+    )
+
+
+_normalizer: Optional[ProductNormalizer] = None
+_normalizer_configured = False
+_normalizer_lock = threading.Lock()
+
+
+def get_normalizer() -> Optional[ProductNormalizer]:
+    """
+    Process-wide normalizer configured by `settings.PRODUCT_NORMALIZATION` (None = disabled)
+    """
+    global _normalizer, _normalizer_configured
+    if not _normalizer_configured:
+        with _normalizer_lock:
+            if not _normalizer_configured:
+                config = getattr(settings, "PRODUCT_NORMALIZATION", None)
+                _normalizer = ProductNormalizer(**config) if config is not None else None
+                _normalizer_configured = True
+    return _normalizer
+
+
+def set_normalizer(normalizer: Optional[ProductNormalizer]) -> None:
+    """
+    Replace the process-wide normalizer (tests, custom configuration)
+    """
+    global _normalizer, _normalizer_configured
+    with _normalizer_lock:
+        _normalizer = normalizer
+        _normalizer_configured = True
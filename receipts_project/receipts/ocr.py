@@ -1,17 +1,359 @@
+from dataclasses import dataclass, field
 from json import dump
 from os import path
-from re import search, split, compile, VERBOSE, IGNORECASE
+from re import search, split, compile, Match, VERBOSE, IGNORECASE
 from datetime import datetime, date, time
 from pathlib import Path
-from typing import Optional, Union, Any
+from statistics import median
+from typing import Optional, Union, Any, Sequence
 from numpy import ndarray
-from rapidfuzz import fuzz
-from easyocr import Reader
 
 import cv2
 
+from .fuzzy import KeywordMatcher, compile_keywords, fuzzy_find_substring
+from .layout import LayoutText, Row, TextBox, group_rows
+from .ocr_backends import InferenceBackend
+from .ocr_pool import ReaderPool, get_reader_pool
+from .preprocessing import ReceiptPreprocessor
+from .roi import read_regions, recognize_rows
+from .segmentation import ProjectionSegmenter
+
+
+@dataclass(frozen=True, slots=True)
+class ReceiptSections:
+    """
+    Sections of a receipt's raw text (see `ReceiptParser.split_sections`)
+    """
+    header: str
+    items: str
+    summary: str
+    identifier: str
+    footer: str
+    total: float  # Extracted while splitting, as the total closes the summary section
+
+    def as_dict(self) -> dict[str, str]:
+        return {
+            'header': self.header,
+            'items': self.items,
+            'summary': self.summary,
+            'identifier': self.identifier,
+            'footer': self.footer
+        }
+
+
+def _lowest(*confidences: Optional[float]) -> Optional[float]:
+    # Confidence of a field read from many boxes (unknown confidences are skipped)
+    known = [confidence for confidence in confidences if confidence is not None]
+    return round(min(known), 4) if known else None
+
+
+@dataclass(frozen=True, slots=True)
+class SectionBounds:
+    """
+    Offsets of the sections in the joined raw output (see `ReceiptParser.section_bounds`)
+    """
+    title_start: int  # "PARAGON FISKALNY" - end of the header
+    title_end: int  # Start of the items
+    summary_start: int  # End of the items
+    total_start: int  # Total amount (closes the summary)
+    summary_end: int
+    identifier_end: int  # Start of the footer
+    total: float
+
+    def sections(self, text: str) -> ReceiptSections:
+        return ReceiptSections(
+            header=text[:self.title_start].strip(),
+            items=text[self.title_end:self.summary_start].strip(),
+            summary=text[self.summary_start:self.summary_end].strip(),
+            identifier=text[self.summary_end:self.identifier_end].strip(),
+            footer=text[self.identifier_end:].strip(),
+            total=self.total
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ReceiptResult:
+    """
+    Immutable result of a single scan. Returned by `ReceiptEngine.scan` and `ReceiptParser.parse`
+    """
+    raw_output: tuple[str, ...]
+    sections: ReceiptSections
+    date: Optional[date] = None
+    time: Optional[time] = None
+    total: Optional[float] = None
+    payment_method: Optional[str] = None
+    items: tuple[dict[str, Any], ...] = field(default_factory=tuple)
+    discounts: tuple[dict[str, Any], ...] = field(default_factory=tuple)
+    confidence: Optional[dict[str, Optional[float]]] = None  # OCR confidence of the fields (detail mode only)
+
+    def to_json(self) -> dict[str, Any]:
+        """
+        Convert result to JSON (items and discounts are copied, so the result stays unchanged)
+        :return: JSON representation of the result
+        """
+        result = {
+            "date": None if self.date is None else self.date.isoformat(),
+            "time": None if self.time is None else self.time.strftime("%H:%M:%S"),
+            "total": self.total,
+            "payment_method": self.payment_method,
+            "items": [dict(item) for item in self.items],
+            "discounts": [dict(discount) for discount in self.discounts]
+        }
+        if self.confidence is not None:
+            result["confidence"] = dict(self.confidence)
+        return result
+
+
+class ReceiptEngine:
+    """
+    Reentrant OCR engine: `engine.scan(image) -> ReceiptResult`.
+
+    No per-receipt state is stored on the engine - readers are borrowed from the pool for the OCR call only
+    and parsing is done by stateless static methods, so a single engine can serve a whole thread pool.
+    """
+
+    # EasyOCR readtext options
+    readtext_options = {
+        'detail': 0,
+        'paragraph': True,
+        'contrast_ths': 0.3,
+        'adjust_contrast': 0.5,
+        'canvas_size': 5000
+    }
+    # Detail mode: every fragment with its box and confidence (paragraph mode drops the confidences)
+    detail_options = {**readtext_options, 'detail': 1, 'paragraph': False}
+    # Region-of-interest mode (`receipts.roi.read_regions` arguments)
+    roi_options = {
+        'scale': 0.5,
+        'chunk_rows': 8,
+        'tail_rows': 12
+    }
+    # Text detectors: the reader's CRAFT network or projection profiles (see receipts/segmentation.py)
+    detectors = ('craft', 'projection')
+    # Line crops passed to the recognizer at once (projection detector and region-of-interest mode)
+    recognize_batch_size = 16
+
+    def __init__(self, gpu: bool = True, reader_pool: Optional[ReaderPool] = None, threshold: int = 75,
+                 preprocessor: Optional[ReceiptPreprocessor] = None, segmenter: Optional[ProjectionSegmenter] = None,
+                 backend: Optional[InferenceBackend] = None):
+        """
+        :param gpu: whether to use GPU (ignored if reader_pool or backend is provided)
+        :param reader_pool: pool of readers to borrow from (defaults to the process-wide pool)
+        :param threshold: global threshold for the fuzzy search
+        :param preprocessor: preprocessing stage (crop, deskew, downscale) run before OCR. None = raw images
+        :param segmenter: line segmentation of the 'projection' detector (defaults to `ProjectionSegmenter()`)
+        :param backend: inference backend of the OCR models (see receipts/ocr_backends.py), used with its own pool
+                        when no reader_pool is provided
+        """
+        if reader_pool is None and backend is not None:
+            reader_pool = backend.reader_pool()
+        self.reader_pool = reader_pool or get_reader_pool(gpu=gpu)
+        self.threshold = threshold
+        self.preprocessor = preprocessor
+        self.segmenter = segmenter or ProjectionSegmenter()
+
+    def prepare(self, image: ndarray, detail: bool = False) -> tuple[ndarray, dict[str, Any]]:
+        """
+        Run the preprocessing stage (if enabled)
+        :param image: image of a receipt
+        :param detail: whether the reader returns boxes with confidences (detail mode)
+        :return: tuple: (image passed to the reader, readtext options with canvas_size adapted to the image)
+        """
+        options = self.detail_options if detail else self.readtext_options
+        if self.preprocessor is None:
+            return image, options
+
+        prepared = self.preprocessor(image)
+        return prepared.image, {**options, 'canvas_size': prepared.canvas_size}
+
+    def read_text(self, image: ndarray, roi: bool = False, detector: str = 'craft') -> tuple[str, ...]:
+        """
+        Read text from an image
+        :param image: image of a receipt
+        :param roi: whether to recognize only the region the parser reads (see receipts/roi.py)
+        :param detector: text detector, one of `detectors`
+        :return: raw output
+        """
+        if roi or detector != 'craft':
+            return tuple(row.text for row in group_rows(self.read_boxes(image, roi=roi, detector=detector)))
+
+        if image is None or image.size == 0:
+            raise ValueError('Invalid numpy array')
+
+        image, options = self.prepare(image)
+
+        with self.reader_pool.reader() as reader:
+            result = reader.readtext(image, **options)
+
+        return self.convert_output(result)
+
+    def read_boxes(self, image: ndarray, roi: bool = False, detector: str = 'craft') -> tuple[TextBox, ...]:
+        """
+        Read text from an image with the bounding boxes and confidences of the fragments (detail mode)
+        :param image: image of a receipt
+        :param roi: whether to recognize only the region the parser reads (see receipts/roi.py)
+        :param detector: text detector, one of `detectors`
+        :return: recognized boxes
+        """
+        if detector not in self.detectors:
+            raise ValueError(f"Unknown detector: {detector!r} (available: {', '.join(self.detectors)})")
+        if image is None or image.size == 0:
+            raise ValueError('Invalid numpy array')
+
+        image, options = self.prepare(image, detail=True)
+        # Segmentation runs on the CPU before a reader is checked out of the pool
+        rows = self.segmenter(image) if detector == 'projection' else None
+
+        with self.reader_pool.reader() as reader:
+            if roi:
+                result = read_regions(reader, image, options, threshold=self.threshold, rows=rows,
+                                      batch_size=self.recognize_batch_size, **self.roi_options).output
+            elif rows is not None:
+                result = recognize_rows(reader, image, rows, options, batch_size=self.recognize_batch_size)
+            else:
+                result = reader.readtext(image, **options)
+
+        return self.convert_output(result, detail=True)
+
+    @staticmethod
+    def convert_output(output: Sequence[Any], detail: bool = False) -> Union[tuple[str, ...], tuple[TextBox, ...]]:
+        """
+        Convert the output of `readtext` to raw output (lines) or boxes (detail mode), skipping empty fragments
+        """
+        if detail:
+            return tuple(box for box in map(TextBox.from_readtext, output) if box.text)
+        return tuple(line.strip() for line in output if line.strip())
+
+    def parse(self, raw_output: Sequence[str]) -> ReceiptResult:
+        """
+        Parse raw output (no OCR involved)
+        :param raw_output: raw output
+        :return: ReceiptResult
+        """
+        return ReceiptParser.parse(raw_output, threshold=self.threshold)
+
+    def parse_boxes(self, boxes: Sequence[TextBox]) -> ReceiptResult:
+        """
+        Parse recognized boxes (no OCR involved)
+        :param boxes: output of `read_boxes`
+        :return: ReceiptResult with confidences
+        """
+        return ReceiptParser.parse_layout(boxes, threshold=self.threshold)
+
+    def scan(self, image: ndarray, detail: bool = False, roi: bool = False, detector: str = 'craft') -> ReceiptResult:
+        """
+        Read and parse a receipt
+        :param image: image of a receipt
+        :param detail: whether to use the detail mode (boxes, row layout and confidences)
+        :param roi: whether to recognize only the region the parser reads (see receipts/roi.py)
+        :param detector: text detector, one of `detectors`
+        :return: ReceiptResult
+        """
+        if detail:
+            return self.parse_boxes(self.read_boxes(image, roi=roi, detector=detector))
+        return self.parse(self.read_text(image, roi=roi, detector=detector))
+
+    def read_text_batch(self, images: Sequence[ndarray], batch_size: int = 4, detail: bool = False,
+                        detector: str = 'craft') -> list[Union[tuple[str, ...], tuple[TextBox, ...], Exception]]:
+        """
+        Read text from many images with batched detection (`Reader.readtext_batched`)
+        :param images: images of receipts
+        :param batch_size: number of images passed to the detector at once
+        :param detail: whether to return boxes with confidences (detail mode) instead of lines
+        :param detector: text detector, one of `detectors`
+        :return: raw output (or boxes) or the raised exception, for each image (in input order)
+        """
+        results: list[Union[tuple[str, ...], tuple[TextBox, ...], Exception]] = [ValueError('Invalid numpy array')] * len(images)
+
+        if detector != 'craft':
+            # No detector network to batch - every image is segmented and its line crops are recognized in batches
+            for i, image in enumerate(images):
+                try:
+                    results[i] = self.read_boxes(image, detector=detector) if detail else self.read_text(image, detector=detector)
+                except Exception as e:
+                    results[i] = e
+            return results
+
+        prepared: dict[int, tuple[ndarray, dict[str, Any]]] = {}
+        for i, image in enumerate(images):
+            if image is None or image.size == 0:
+                continue
+            try:
+                prepared[i] = self.prepare(image, detail=detail)
+            except Exception as e:
+                results[i] = e
+
+        # Group images of similar size, so padding them to a common size (required by the detector) is cheap
+        valid = sorted(prepared, key=lambda i: prepared[i][0].shape[:2])
+
+        for start in range(0, len(valid), batch_size):
+            group = valid[start:start + batch_size]
+            # The padded batch gets the largest canvas of its images
+            options = max((prepared[i][1] for i in group), key=lambda o: o['canvas_size'])
+
+            with self.reader_pool.reader() as reader:
+                try:
+                    outputs = reader.readtext_batched(self.pad_to_common_size([prepared[i][0] for i in group]), **options)
+                except Exception:
+                    outputs = None
+
+                # If the whole batch failed, read images one by one to find out which of them is the culprit
+                if outputs is None:
+                    outputs = []
+                    for i in group:
+                        try:
+                            outputs.append(reader.readtext(prepared[i][0], **prepared[i][1]))
+                        except Exception as e:
+                            outputs.append(e)
+
+            for i, output in zip(group, outputs):
+                results[i] = output if isinstance(output, Exception) else self.convert_output(output, detail=detail)
+
+        return results
+
+    def scan_batch(self, images: Sequence[ndarray], batch_size: int = 4, detail: bool = False,
+                   detector: str = 'craft') -> list[Union[ReceiptResult, Exception]]:
+        """
+        Read and parse many receipts at once
+        :param images: images of receipts
+        :param batch_size: number of images passed to the detector at once
+        :param detail: whether to use the detail mode (boxes, row layout and confidences)
+        :param detector: text detector, one of `detectors`
+        :return: ReceiptResult or the raised exception, for each image (in input order)
+        """
+        results: list[Union[ReceiptResult, Exception]] = []
+        for raw_output in self.read_text_batch(images, batch_size=batch_size, detail=detail, detector=detector):
+            if isinstance(raw_output, Exception):
+                results.append(raw_output)
+                continue
+            try:
+                results.append(self.parse_boxes(raw_output) if detail else self.parse(raw_output))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    @staticmethod
+    def pad_to_common_size(images: Sequence[ndarray]) -> list[ndarray]:
+        """
+        Pad images with white background (bottom/right) to the size of the largest one, without rescaling the text
+        :param images: BGR or grayscale images
+        :return: padded 3-channel images
+        """
+        images = [cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image for image in images]
+        height = max(image.shape[0] for image in images)
+        width = max(image.shape[1] for image in images)
+
+        return [
+            cv2.copyMakeBorder(image, 0, height - image.shape[0], 0, width - image.shape[1], cv2.BORDER_CONSTANT, value=(255, 255, 255))
+            for image in images
+        ]
+
 
 class ReceiptParser:
+    """
+    Stateful, single-receipt wrapper around `ReceiptEngine` and the static parsing pipeline.
+    Use `ReceiptEngine` directly to share one engine between threads.
+    """
 
     # Recognized payment methods (keyword: type)
     supported_payment_methods_patterns = {
@@ -24,7 +366,17 @@ class ReceiptParser:
         'Rabat', 'Zniżka', 'Opust', 'Obniżka'
     ]
 
-    def __init__(self, gpu: bool = True):
+    # Keywords starting the summary section (ex. "SPRZED. OPOD" or "SPRZEDAŻ. OPODATKOWANA")
+    summary_patterns = [
+        'Sprzedaż opodatkowana', 'Sprzedaz opodatkowana', 'Sprzedaż opodatk.', 'Sprzedaz opodatk.', 'Sprzed. opod.', 'Sprzed_ opod_'
+    ]
+
+    # Fuzzy search thresholds
+    summary_threshold = 85
+    discount_threshold = 65
+    payment_method_threshold = 70
+
+    def __init__(self, gpu: bool = True, reader_pool: Optional[ReaderPool] = None, backend: Optional[InferenceBackend] = None):
 
         # Settings
         self.threshold = 75 # Global threshold
@@ -43,7 +395,12 @@ class ReceiptParser:
         self.items = None
         self.discounts = None
 
-        self.reader = Reader(lang_list=['pl', 'en'], gpu=self.gpu)
+        # Readers are loaded once per process and borrowed for each scan (see ocr_pool.py)
+        self.engine = ReceiptEngine(gpu=self.gpu, reader_pool=reader_pool, threshold=self.threshold, backend=backend)
+
+    @property
+    def reader_pool(self) -> ReaderPool:
+        return self.engine.reader_pool
 
     def load_image_from_path(self, image_path: Path) -> None:
         # Check whether provided path is correct
@@ -66,9 +423,10 @@ class ReceiptParser:
 
         self.image = image
 
-    def extract_text(self) -> list[str]:
+    def extract_text(self, detector: str = 'craft') -> list[str]:
         """
         Read text from an image
+        :param detector: text detector: 'craft' (EasyOCR) or 'projection' (line segmentation, clean scans only)
         :return: raw output
         """
         # Check whether the receipt has been loaded correctly
@@ -76,16 +434,7 @@ class ReceiptParser:
             raise ValueError(f'Image not loaded. Use load_image_from_XXX to load an image of a receipt first')
 
         # Process image
-        result = self.reader.readtext(
-            self.image,
-            detail=0,
-            paragraph=True,
-            contrast_ths=0.3,
-            adjust_contrast=0.5,
-            canvas_size=5000
-        )
-
-        self.raw_output = [line.strip() for line in result if line.strip()] # type: ignore
+        self.raw_output = list(self.engine.read_text(self.image, detector=detector))
 
         return self.raw_output
 
@@ -94,14 +443,147 @@ class ReceiptParser:
         Split raw image output into sections
         :return: dictionary of sections (header, items, summary, identifier, footer)
         """
+        sections = self.split_sections(self.raw_output, threshold=self.threshold)
+
+        self.total = sections.total
+        self.sections = sections.as_dict()
+
+        return self.sections
+
+    def extract_data_from_sections(self) -> None:
+        """
+        Extract data from extracted sections and save it
+        """
+        data = self.extract_data(self.sections)
+
+        self.date = data['date']
+        self.time = data['time']
+        self.payment_method = data['payment_method']
+        self.items = data['items']
+        self.discounts = data['discounts']
+
+    def to_json(self) -> dict[str, Any]:
+        """
+        Convert parsed sections to JSON
+        :return: JSON representation of sections
+        """
+        return {
+            "date": None if self.date is None else self.date.isoformat(),
+            "time": None if self.time is None else self.time.strftime("%H:%M:%S"),
+            "total": self.total,
+            "payment_method": self.payment_method,
+            "items": self.items,
+            "discounts": self.discounts
+        }
+
+    def save_to_json_file(self, filepath: Path) -> None:
+        """
+        Generate JSON file from sections. If the file doesn't exist, create a new one.
+        :param filepath: path to a JSON file
+        """
+        with open(filepath, "w", encoding="utf-8") as f:
+            dump(self.to_json(), f, indent=4, ensure_ascii=False)
+
+    def run(self, detector: str = 'craft') -> dict[str, Any]:
+        """
+        MAIN FUNCTION\n
+        1. Extract text from an image
+        2. Split raw image output into sections
+        3. Extract data from sections
+        :param detector: text detector: 'craft' (EasyOCR) or 'projection' (line segmentation, clean scans only)
+        :return: JSON representation of sections
+        """
+        self.extract_text(detector=detector)
+        self.split_receipt_sections()
+        self.extract_data_from_sections()
+
+        return self.to_json()
+
+
+    # Stateless parsing pipeline ---------------------------------------------------------------------------------------
+
+    @staticmethod
+    def parse(raw_output: Sequence[str], threshold: int = 75) -> ReceiptResult:
+        """
+        Parse raw output without touching any parser state (safe to call from many threads)
+        1. Split raw image output into sections
+        2. Extract data from sections
+        :param raw_output: raw output
+        :param threshold: global threshold for the fuzzy search
+        :return: ReceiptResult
+        """
+        sections = ReceiptParser.split_sections(raw_output, threshold=threshold)
+        data = ReceiptParser.extract_data(sections.as_dict())
+
+        return ReceiptResult(
+            raw_output=tuple(raw_output),
+            sections=sections,
+            date=data['date'],
+            time=data['time'],
+            total=sections.total,
+            payment_method=data['payment_method'],
+            items=tuple(data['items']),
+            discounts=tuple(data['discounts'])
+        )
 
-        text = "\n".join(self.raw_output)
+    @staticmethod
+    def parse_layout(boxes: Sequence[TextBox], threshold: int = 75) -> ReceiptResult:
+        """
+        Parse OCR boxes (detail mode): boxes are grouped into rows, sections are found in the text of the rows
+        and items are extracted from the rows of the items section (see `extract_item_rows`)
+        :param boxes: recognized boxes with confidences
+        :param threshold: global threshold for the fuzzy search
+        :return: ReceiptResult with confidences (items, discounts and `confidence` of date, time and total)
+        """
+        layout = LayoutText(group_rows(boxes))
+        bounds = ReceiptParser.section_bounds(layout.text, threshold=threshold)
+        sections = bounds.sections(layout.text)
+        data = ReceiptParser.extract_data(sections.as_dict(), with_items=False)
+        items, discounts = ReceiptParser.extract_item_rows(layout.rows_in(bounds.title_end, bounds.summary_start))
+
+        return ReceiptResult(
+            raw_output=tuple(layout.lines),
+            sections=sections,
+            date=data['date'],
+            time=data['time'],
+            total=sections.total,
+            payment_method=data['payment_method'],
+            items=tuple(items),
+            discounts=tuple(discounts),
+            confidence={
+                'date': _lowest(layout.find_confidence(data['raw_date'])),
+                'time': _lowest(layout.find_confidence(data['raw_time'], bounds.summary_end)),
+                'total': _lowest(layout.confidence(bounds.total_start, bounds.summary_end)),
+            }
+        )
+
+    @staticmethod
+    def split_sections(raw_output: Sequence[str], threshold: int = 75) -> ReceiptSections:
+        """
+        Split raw image output into sections
+        :param raw_output: raw output
+        :param threshold: global threshold for the fuzzy search
+        :return: ReceiptSections (header, items, summary, identifier, footer and total)
+        """
+        text = "\n".join(raw_output)
+        return ReceiptParser.section_bounds(text, threshold=threshold).sections(text)
 
+    @staticmethod
+    def section_bounds(text: str, threshold: int = 75) -> SectionBounds:
+        """
+        Find where the sections start and end
+        :param text: raw output joined with newlines
+        :param threshold: global threshold for the fuzzy search
+        :return: SectionBounds (offsets in the text and the total)
+        """
         # Normalize case
         text_lower = text.lower()
 
+        # All section keywords are found in a single pass over the text
+        matches = ReceiptParser.section_matcher(threshold).scan(text_lower)
+
         # Section 1 (header) - until "PARAGON FISKALNY"
-        match = self.fuzzy_find_substring(text_lower, pattern="paragon fiskalny", threshold=self.threshold)
+        match = matches.find('paragon fiskalny', threshold)
 
         if not match:
             raise ValueError("Couldn't find keyword: 'paragon fiskalny'")
@@ -109,27 +591,19 @@ class ReceiptParser:
         idx_title_start, idx_title_end = match
 
         # Section 3 (summary) - from "SPRZED. OPOD" or "SPRZEDAŻ. OPODATKOWANA"
-        summary_matches = ['Sprzedaż opodatkowana', 'Sprzedaz opodatkowana', 'Sprzedaż opodatk.', 'Sprzedaz opodatk.', 'Sprzed. opod.', 'Sprzed_ opod_']
-        summary_match = None
-
-        for match in summary_matches:
-            summary_match = self.fuzzy_find_substring(text_lower[idx_title_end:], pattern=match, threshold=85)
-            if summary_match:
-                break
+        summary_match = matches.first(ReceiptParser.summary_patterns, ReceiptParser.summary_threshold, start=idx_title_end)
 
         if not summary_match:
             raise ValueError("Couldn't find keyword: 'Sprzedaż opodatkowana'")
 
-        idx_summary_start, _ = summary_match
-        idx_summary_start += idx_title_end
+        _, (idx_summary_start, _) = summary_match
 
         # Section 3 ends with "SUMA PLN <float>"
-        total_match = self.fuzzy_find_substring(text_lower[idx_summary_start:], pattern="SUMA PLN", threshold=self.threshold)
-        if not match:
+        total_match = matches.find('SUMA PLN', threshold, start=idx_summary_start)
+        if not total_match:
             raise ValueError("Couldn't find keyword: 'SUMA PLN'")
 
-        _, idx_summary_end = total_match # type: ignore
-        idx_summary_end += idx_summary_start
+        _, idx_summary_end = total_match
 
         # Convert next digits to total
         amount_match = search(r'(\d{1,5})[,.\s](\d{2})', text_lower[idx_summary_end:])
@@ -141,10 +615,11 @@ class ReceiptParser:
         amount_str = f"{whole}.{decimal}"
 
         try:
-            self.total = float(amount_str)
+            total = float(amount_str)
         except ValueError:
             raise ValueError("Error while converting the total to float (likely distorted data)")
 
+        idx_total_start = idx_summary_end + amount_match.start()
         idx_summary_end += amount_match.end()
 
         # Section 4 (identifier) – 40 digits code + fiscal logo + identifier: 3 letters + 10 digits
@@ -163,69 +638,64 @@ class ReceiptParser:
         #     idx_identifier_end = idx_summary_end
         # IF IDENTIFIER SHOULD BE IGNORED ----------------------------
 
-        # Create dictionary to return
-        self.sections['header'] = text[:idx_title_start].strip()
-        self.sections['items'] = text[idx_title_end:idx_summary_start].strip()
-        self.sections['summary'] = text[idx_summary_start:idx_summary_end].strip()
-        self.sections['identifier'] = text[idx_summary_end:idx_identifier_end].strip()
-        self.sections['footer'] = text[idx_identifier_end:].strip()
-
-        return self.sections
+        return SectionBounds(
+            title_start=idx_title_start,
+            title_end=idx_title_end,
+            summary_start=idx_summary_start,
+            total_start=idx_total_start,
+            summary_end=idx_summary_end,
+            identifier_end=idx_identifier_end,
+            total=total
+        )
 
-    def extract_data_from_sections(self) -> None:
+    @staticmethod
+    def extract_data(sections: dict[str, str], with_items: bool = True) -> dict[str, Any]:
         """
-        Extract data from extracted sections and save it
+        Extract data from sections
+        :param sections: dictionary of sections (header, items, summary, identifier, footer)
+        :param with_items: whether to extract items from the items section (detail mode extracts them from rows)
+        :return: dictionary of: date, time, payment_method, items, discounts (and raw_date, raw_time - the matched text)
         """
         # Date can be found in the header, identifier or footer section
-        raw_date = self.extract_date(self.sections['header']) or self.extract_date(self.sections['identifier']) or self.extract_date(self.sections['footer'])
+        raw_date = ReceiptParser.extract_date(sections['header']) or ReceiptParser.extract_date(sections['identifier']) or ReceiptParser.extract_date(sections['footer'])
         # Time can be found in the identifier section or footer section
-        raw_time = self.extract_time(self.sections['identifier']) or self.extract_time(self.sections['footer'])
-
-        self.date = self.parse_date(raw_date) if raw_date else None
-        self.time = self.parse_time(raw_time) if raw_time else None
+        raw_time = ReceiptParser.extract_time(sections['identifier']) or ReceiptParser.extract_time(sections['footer'])
 
         # Payment method can be found in the identifier or footer section
-        self.payment_method = self.extract_payment_method(self.sections['identifier']) or self.extract_payment_method(self.sections['footer'])
+        payment_method = ReceiptParser.extract_payment_method(sections['identifier']) or ReceiptParser.extract_payment_method(sections['footer'])
 
         # Items can be found in the items section (well who would have expected)
-        self.items, self.discounts = self.extract_items(self.sections['items'])
-
+        items, discounts = ReceiptParser.extract_items(sections['items']) if with_items else ([], [])
 
-    def to_json(self) -> dict[str, Any]:
-        """
-        Convert parsed sections to JSON
-        :return: JSON representation of sections
-        """
         return {
-            "date": None if self.date is None else self.date.isoformat(),
-            "time": None if self.time is None else self.time.strftime("%H:%M:%S"),
-            "total": self.total,
-            "payment_method": self.payment_method,
-            "items": self.items,
-            "discounts": self.discounts
+            'date': ReceiptParser.parse_date(raw_date) if raw_date else None,
+            'time': ReceiptParser.parse_time(raw_time) if raw_time else None,
+            'payment_method': payment_method,
+            'items': items,
+            'discounts': discounts,
+            'raw_date': raw_date,
+            'raw_time': raw_time
         }
 
-    def save_to_json_file(self, filepath: Path) -> None:
-        """
-        Generate JSON file from sections. If the file doesn't exist, create a new one.
-        :param filepath: path to a JSON file
-        """
-        with open(filepath, "w", encoding="utf-8") as f:
-            dump(self.to_json(), f, indent=4, ensure_ascii=False)
 
-    def run(self) -> dict[str, Any]:
+    # Keyword matchers (compiled once and cached, see fuzzy.py) ---------------------------------------------------------
+
+    @staticmethod
+    def section_matcher(threshold: int = 75) -> KeywordMatcher:
         """
-        MAIN FUNCTION\n
-        1. Extract text from an image
-        2. Split raw image output into sections
-        3. Extract data from sections
-        :return: JSON representation of sections
+        Matcher of all keywords used to split sections
+        :param threshold: global threshold for the fuzzy search
         """
-        self.extract_text()
-        self.split_receipt_sections()
-        self.extract_data_from_sections()
+        keywords = ('paragon fiskalny', *ReceiptParser.summary_patterns, 'SUMA PLN')
+        return compile_keywords(keywords, min(threshold, ReceiptParser.summary_threshold))
 
-        return self.to_json()
+    @staticmethod
+    def discount_matcher() -> KeywordMatcher:
+        return compile_keywords(tuple(ReceiptParser.supported_discount_patterns), ReceiptParser.discount_threshold)
+
+    @staticmethod
+    def payment_method_matcher() -> KeywordMatcher:
+        return compile_keywords(tuple(ReceiptParser.supported_payment_methods_patterns), ReceiptParser.payment_method_threshold)
 
 
     # Static methods used for various data conversions or extractions --------------------------------------------------
@@ -233,7 +703,7 @@ class ReceiptParser:
     @staticmethod
     def fuzzy_find_substring(text: str, pattern: str, threshold: int = 85, offset: int = 2, ignore_case: bool = True) -> Optional[tuple[int, int]]:
         """
-        Perform fuzzy search
+        Perform fuzzy search (see fuzzy.py)
 
         :param text: search section
         :param pattern: keyword
@@ -242,20 +712,30 @@ class ReceiptParser:
         :param ignore_case: ignore case. If set to True, converts search section and keyword to lowercase before performing fuzzy search
         :return: tuple: (index_start, index_end) or None
         """
-        text = text.lower()
-        pattern = pattern.lower() if ignore_case else pattern
-        best_score = 0
-        best_match = None
+        return fuzzy_find_substring(text, pattern, threshold=threshold, offset=offset, ignore_case=ignore_case)
 
-        window_size = len(pattern)
-        for i in range(len(text) - window_size + 1):
-            window = text[i:i + window_size + offset]  # offset in case of poor quality raw data. Higher values = less accuracy but higher chance of matching
-            score = fuzz.ratio(window, pattern)
-            if score > best_score and score >= threshold:
-                best_score = score
-                best_match = (i, i + len(window))
+    # Amounts closing an item: "[*x] unit price [=] total [PTU group]"
+    item_amounts_pattern = compile(
+        r"""[*x]?\s* (\d+\s*[.,\s]\s*\d{2}) \s*[=/\\]?\s* ([~-]?\s*\d+\s*[.,\s]\s*\d{2}) \s*[A-Za-z]?\d*""", VERBOSE
+    )
 
-        return best_match
+    @staticmethod
+    def replace_characters(text: str) -> str:
+        """
+        Replace letters OCR confuses with digits (only used for matching amounts, names are taken from the original text)
+        """
+        char_to_digit = {
+            'O': '0', 'Q': '0',
+            'I': '1', 'L': '1', '|': '1',
+            'Z': '2',
+            'E': '3',
+            'A': '4',
+            'S': '5',
+            # 'G': '6',
+            '/': '7',
+            'B': '8',
+        }
+        return ''.join(char_to_digit.get(c.upper(), c) for c in text)
 
     @staticmethod
     def extract_items(items_section: str, estimate_items_count: bool = True, estimation_threshold: float = 0.05) -> \
@@ -266,33 +746,9 @@ class ReceiptParser:
         :param estimate_items_count: whether to estimate items count based on total amount and price of an item
         :param estimation_threshold: threshold for count estimation (if estimation failed count is set to 1)
         """
-
-        # Try to replace some characters before parsing for better results
-        def _replace_characters(text: str) -> str:
-            char_to_digit = {
-                'O': '0', 'Q': '0',
-                'I': '1', 'L': '1', '|': '1',
-                'Z': '2',
-                'E': '3',
-                'A': '4',
-                'S': '5',
-                # 'G': '6',
-                '/': '7',
-                'B': '8',
-            }
-            return ''.join(char_to_digit.get(c.upper(), c) for c in text)
-
-        # Helper to add discount
-        def _append_discount(name: str, amount: Optional[float]):
-            if amount is not None:
-                amount = abs(amount)
-            discounts.append({
-                'name': name,
-                'amount': amount
-            })
-
-        # Prepare items_section
-        normalized_items_section = _replace_characters(items_section)
+        # Prepare items_section (try to replace some characters before parsing for better results)
+        normalized_items_section = ReceiptParser.replace_characters(items_section)
+        discount_matcher = ReceiptParser.discount_matcher()
 
         # Items list
         # Structure:
@@ -308,108 +764,208 @@ class ReceiptParser:
         #   'amount': discount amount
         discounts = []
 
-        pattern = compile(
-            r"""[*x]?\s* (\d+\s*[.,\s]\s*\d{2}) \s*[=/\\]?\s* ([~-]?\s*\d+\s*[.,\s]\s*\d{2}) \s*[A-Za-z]?\d*""", VERBOSE
-        )
-
-        matches = pattern.finditer(normalized_items_section)
+        matches = ReceiptParser.item_amounts_pattern.finditer(normalized_items_section)
         idx_current = 0
 
         # Main 'for' loop - parsing found items
         for match in matches:
-            item_raw = items_section[idx_current:match.start()]
-            normalized_item_raw = normalized_items_section[idx_current:match.start()]
-            price_raw = match.group(1)
-            total_raw = match.group(2)
-
-            price = ReceiptParser.parse_price(price_raw)
-            total = ReceiptParser.parse_price(total_raw)
-
-            is_item_actually_discount = False
-
-            # Check for discounts - approach 1: try to find keywords
-            for discount_pattern in ReceiptParser.supported_discount_patterns:
-                discount_match = ReceiptParser.fuzzy_find_substring(item_raw, pattern=discount_pattern, threshold=65)
-
-                if discount_match:
-                    # Potential discount found (keyword match successful)
-                    search_start = discount_match[1]
-                    discount_amount_match = search(r'([~-]?\s*\d+\s*[.,\s]\s*\d{2})', item_raw[search_start:])
-
-                    if discount_amount_match:
-                        # This item is probably a combination of a normal product and a discount. Extract discount from it and parse product as usual
-                        start = discount_match[0]
-                        end = search_start + discount_amount_match.end()
-
-                        discount_name = item_raw[start:search_start + discount_amount_match.start()]
-                        discount_amount = ReceiptParser.parse_price(discount_amount_match.group(1))
-                        item_raw = item_raw[:start] + item_raw[end:]  # Exclude found discount from item name
-                        _append_discount(discount_name, discount_amount)
-                    else:
-                        # This whole item is probably a discount. Do not add it to the items list
-                        is_item_actually_discount = True
-                        _append_discount(item_raw, price)
-
-            # Check for discounts - approach 2: try to find negative total
-            if not is_item_actually_discount and total is not None and total < 0:
-                is_item_actually_discount = True
-                _append_discount(item_raw, price)
-
-            # If the current item is in fact a discount do not add it to the items list and skip the rest of this main 'for' loop
-            if is_item_actually_discount:
-                idx_current = match.end()
+            item = ReceiptParser.parse_item(
+                items_section[idx_current:match.start()], match, discount_matcher, discounts,
+                estimate_items_count, estimation_threshold
+            )
+            if item is not None:
+                items.append(item)
+            idx_current = match.end()
+
+        # Final leftover check (to capture last discount or ignored line)
+        ReceiptParser.parse_leftover(items_section[idx_current:].strip(), discount_matcher, discounts)
+
+        return items, discounts
+
+    @staticmethod
+    def extract_item_rows(rows: Sequence[Row], estimate_items_count: bool = True, estimation_threshold: float = 0.05,
+                          column_tolerance: float = 2.0) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """
+        Extract items from the rows of the items section (detail mode) in a single pass.
+        A row closes an item if it ends with amounts in the price column (right edge shared by the amount rows);
+        rows without amounts are the beginning of the next item's name (wrapped names, discount lines).
+        Items and discounts get the confidence of their fields
+        :param rows: rows of the items section (see layout.py)
+        :param estimate_items_count: whether to estimate items count based on total amount and price of an item
+        :param estimation_threshold: threshold for count estimation (if estimation failed count is set to 1)
+        :param column_tolerance: maximum distance of the amounts from the price column, relative to the text height
+        :return: tuple: (items, discounts)
+        """
+        discount_matcher = ReceiptParser.discount_matcher()
+        items: list[dict[str, Any]] = []
+        discounts: list[dict[str, Any]] = []
+
+        # Amounts at the end of every row
+        amounts = []
+        for row in rows:
+            normalized = ReceiptParser.replace_characters(row.text)
+            match = None
+            for match in ReceiptParser.item_amounts_pattern.finditer(normalized):
+                pass
+            amounts.append(match if match is not None and not normalized[match.end():].strip() else None)
+
+        # Price column: median right edge of the rows with amounts
+        closing = [row for row, match in zip(rows, amounts) if match is not None]
+        if closing:
+            edge = median(row.right for row in closing)
+            tolerance = column_tolerance * median(row.height for row in closing)
+            amounts = [
+                match if match is not None and abs(row.right - edge) <= tolerance else None
+                for row, match in zip(rows, amounts)
+            ]
+
+        pending: list[str] = []
+        pending_confidence: list[Optional[float]] = []
+        for row, match in zip(rows, amounts):
+            if match is None:
+                pending.append(row.text)
+                pending_confidence.append(row.confidence(0, len(row.text)))
                 continue
 
-            # Try to extract count from text
-            count, item_raw = ReceiptParser.parse_count(item_raw)  # Get count and trim item if necessary
-            is_count_estimated = False
+            # The count ("1*", "2szt x") is usually read in the same box as the amounts - it's not a part of the name
+            name_end = len(ReceiptParser.parse_count(row.text[:match.start()])[1])
+            name_confidence = _lowest(*pending_confidence, row.confidence(0, name_end))
+            price_confidence = row.confidence(match.start(), match.end())
+            found = len(discounts)
+            item = ReceiptParser.parse_item(
+                " ".join([*pending, row.text[:match.start()]]), match, discount_matcher, discounts,
+                estimate_items_count, estimation_threshold
+            )
+            if item is not None:
+                item["confidence"] = {"name": name_confidence, "price": price_confidence}
+                items.append(item)
+            for discount in discounts[found:]:
+                discount["confidence"] = {"name": name_confidence, "amount": _lowest(name_confidence, price_confidence)}
+            pending, pending_confidence = [], []
+
+        found = len(discounts)
+        ReceiptParser.parse_leftover(" ".join(pending).strip(), discount_matcher, discounts)
+        for discount in discounts[found:]:
+            confidence = _lowest(*pending_confidence)
+            discount["confidence"] = {"name": confidence, "amount": confidence}
+
+        return items, discounts
+
+    @staticmethod
+    def parse_item(item_raw: str, match: Match, discount_matcher: KeywordMatcher, discounts: list[dict[str, Any]],
+                   estimate_items_count: bool = True, estimation_threshold: float = 0.05) -> Optional[dict[str, Any]]:
+        """
+        Parse the text preceding a match of `item_amounts_pattern` into an item.
+        Discounts found in the text (or the whole text being a discount) are appended to `discounts`
+        :param item_raw: text of the item before its amounts
+        :param match: match of `item_amounts_pattern` (price and total)
+        :param discount_matcher: `discount_matcher()`
+        :param discounts: list of discounts to extend
+        :param estimate_items_count: whether to estimate items count based on total amount and price of an item
+        :param estimation_threshold: threshold for count estimation (if estimation failed count is set to 1)
+        :return: item or None if the text is a discount
+        """
+        price = ReceiptParser.parse_price(match.group(1))
+        total = ReceiptParser.parse_price(match.group(2))
+
+        is_item_actually_discount = False
+
+        # Check for discounts - approach 1: try to find keywords (all keywords are found in a single pass)
+        discount_matches = discount_matcher.scan(item_raw)
+
+        for discount_pattern in ReceiptParser.supported_discount_patterns:
+            discount_match = discount_matches.find(discount_pattern, ReceiptParser.discount_threshold)
 
-            # Try to calculate the count based on extracted price and total (if count couldn't be parsed)
-            if total is not None and price is not None and estimate_items_count and not count:
-                count_estimation = total / price  # type: ignore
-                is_count_estimated = True
+            if discount_match:
+                # Potential discount found (keyword match successful)
+                search_start = discount_match[1]
+                discount_amount_match = search(r'([~-]?\s*\d+\s*[.,\s]\s*\d{2})', item_raw[search_start:])
 
-                if abs(count_estimation - round(count_estimation)) <= estimation_threshold and int(
-                        count_estimation) > 0:
-                    count = int(count_estimation)
+                if discount_amount_match:
+                    # This item is probably a combination of a normal product and a discount. Extract discount from it and parse product as usual
+                    start = discount_match[0]
+                    end = search_start + discount_amount_match.end()
+
+                    discount_name = item_raw[start:search_start + discount_amount_match.start()]
+                    discount_amount = ReceiptParser.parse_price(discount_amount_match.group(1))
+                    item_raw = item_raw[:start] + item_raw[end:]  # Exclude found discount from item name
+                    ReceiptParser._append_discount(discounts, discount_name, discount_amount)
+
+                    # Item name changed - search the remaining keywords in the new one
+                    discount_matches = discount_matcher.scan(item_raw)
                 else:
-                    count = 1  # Default count = 1
+                    # This whole item is probably a discount. Do not add it to the items list
+                    is_item_actually_discount = True
+                    ReceiptParser._append_discount(discounts, item_raw, price)
 
-            # Create a dictionary
-            items.append({
-                "name": item_raw,
-                "price": price,
-                "count": count,
-                "count_estimated": is_count_estimated
-            })
+        # Check for discounts - approach 2: try to find negative total
+        if not is_item_actually_discount and total is not None and total < 0:
+            is_item_actually_discount = True
+            ReceiptParser._append_discount(discounts, item_raw, price)
 
-            idx_current = match.end()
+        # If the current item is in fact a discount do not add it to the items list
+        if is_item_actually_discount:
+            return None
 
-        # Final leftover check (to capture last discount or ignored line)
-        leftover = items_section[idx_current:].strip()
+        # Try to extract count from text
+        count, item_raw = ReceiptParser.parse_count(item_raw)  # Get count and trim item if necessary
+        is_count_estimated = False
 
-        if leftover:
+        # Try to calculate the count based on extracted price and total (if count couldn't be parsed)
+        if total is not None and price is not None and estimate_items_count and not count:
+            count_estimation = total / price  # type: ignore
+            is_count_estimated = True
 
-            for discount_pattern in ReceiptParser.supported_discount_patterns:
-                discount_match = ReceiptParser.fuzzy_find_substring(leftover, pattern=discount_pattern, threshold=65)
+            if abs(count_estimation - round(count_estimation)) <= estimation_threshold and int(
+                    count_estimation) > 0:
+                count = int(count_estimation)
+            else:
+                count = 1  # Default count = 1
 
-                if discount_match:
-                    discount_amount_match = search(r'([~-]?\s*\d+\s*[.,\s]\s*\d{2})', leftover[discount_match[1]:])
+        return {
+            "name": item_raw,
+            "price": price,
+            "count": count,
+            "count_estimated": is_count_estimated
+        }
 
-                    if discount_amount_match:
-                        discount_name = leftover[discount_match[0]:discount_match[1] + discount_amount_match.start()]
-                        discount_amount = ReceiptParser.parse_price(discount_amount_match.group(1))
-                        _append_discount(discount_name, discount_amount)
+    @staticmethod
+    def parse_leftover(leftover: str, discount_matcher: KeywordMatcher, discounts: list[dict[str, Any]]) -> None:
+        """
+        Check the text after the last item (to capture the last discount)
+        :param leftover: text after the last item
+        :param discount_matcher: `discount_matcher()`
+        :param discounts: list of discounts to extend
+        """
+        if not leftover:
+            return
 
-                    else:
-                        # No price found – still register it if price is present before
-                        discount_amount = ReceiptParser.parse_price(leftover)
+        found = discount_matcher.scan(leftover).first(ReceiptParser.supported_discount_patterns, ReceiptParser.discount_threshold)
 
-                        if discount_amount is not None:
-                            _append_discount(leftover, discount_amount)
-                    break
+        if found:
+            _, discount_match = found
+            discount_amount_match = search(r'([~-]?\s*\d+\s*[.,\s]\s*\d{2})', leftover[discount_match[1]:])
 
-        return items, discounts
+            if discount_amount_match:
+                discount_name = leftover[discount_match[0]:discount_match[1] + discount_amount_match.start()]
+                discount_amount = ReceiptParser.parse_price(discount_amount_match.group(1))
+                ReceiptParser._append_discount(discounts, discount_name, discount_amount)
+
+            else:
+                # No price found – still register it if price is present before
+                discount_amount = ReceiptParser.parse_price(leftover)
+
+                if discount_amount is not None:
+                    ReceiptParser._append_discount(discounts, leftover, discount_amount)
+
+    @staticmethod
+    def _append_discount(discounts: list[dict[str, Any]], name: str, amount: Optional[float]) -> None:
+        if amount is not None:
+            amount = abs(amount)
+        discounts.append({
+            'name': name,
+            'amount': amount
+        })
 
     @staticmethod
     def extract_date(text: str) -> Optional[str]:
@@ -467,11 +1023,10 @@ class ReceiptParser:
         :return: payment_method name (if supported) or None
         """
 
-        for payment_method_pattern, payment_method_name in ReceiptParser.supported_payment_methods_patterns.items():
-            match = ReceiptParser.fuzzy_find_substring(payment_method_search_section, pattern=payment_method_pattern, threshold=70)
-            if match is not None:
-                return payment_method_name
-        return None
+        patterns = ReceiptParser.supported_payment_methods_patterns
+        found = ReceiptParser.payment_method_matcher().scan(payment_method_search_section).first(list(patterns), ReceiptParser.payment_method_threshold)
+
+        return patterns[found[0]] if found else None
 
     # Parsing methods --------------------------------------------------------------------------------------------------
 
@@ -554,6 +1109,12 @@ class ReceiptParser:
         except ValueError:
             return None
 
+
+# Compile the default keyword matchers at import time
+ReceiptParser.section_matcher()
+ReceiptParser.discount_matcher()
+ReceiptParser.payment_method_matcher()
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 """
@@ -576,4 +1137,10 @@ Examples:
     parser.load_image_from_np_ndarray(image_as_np_ndarray)
     parser.run()
 
+# 3 (reentrant - one engine shared by many threads)
+
+    engine = ReceiptEngine(reader_pool=ReaderPool(size=2))
+    result = engine.scan(image_as_np_ndarray)
+    result.to_json()
+
 """
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""
+Inference backends of the EasyOCR models (CRAFT detector and CRNN recognizer) for CPU-only workers.
+
+A backend loads a regular `easyocr.Reader` and swaps its `detector` and `recognizer` for models run by another
+runtime - everything around them (resizing, box grouping, CTC decoding) stays EasyOCR's, so the output format
+doesn't change. `backend.create_reader` is a `ReaderPool` factory.
+
+- 'easyocr': models as EasyOCR loads them (default). On CPU EasyOCR already quantizes dynamically the layers
+  dynamic quantization supports (LSTM and Linear), on GPU the models run in fp32.
+- 'torch': fp32 models on CPU - the reference for accuracy comparisons.
+- 'quantized': dynamic int8 quantization (`torch.ao.quantization.quantize_dynamic`) of the LSTM and Linear layers.
+  Dynamic quantization doesn't cover convolutions, so the CRAFT detector (VGG16 convolutions) stays fp32.
+- 'onnx': both models exported to ONNX once (cached in `model_dir`) and run by ONNX Runtime sessions.
+  Optional dependencies: `onnxruntime`, and `onnx` for the export.
+
+`threads` sets the intra-op thread count: per session for ONNX Runtime, per process for PyTorch
+(`torch.set_num_threads` is global). Compare the backends on the fixture set with `manage.py compare_ocr_backends`.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import torch
+from torch import nn
+
+from .ocr_pool import ReaderPool, create_reader
+
+
+class InferenceBackend:
+    """
+    Models as EasyOCR loads them
+    """
+    name = 'easyocr'
+
+    def __init__(self, threads: Optional[int] = None):
+        """
+        :param threads: intra-op threads (None = library default)
+        """
+        self.threads = threads
+        self._pool: Optional[ReaderPool] = None
+        self._pool_lock = threading.Lock()
+
+    def create_reader(self, gpu: bool) -> Any:
+        """
+        Build a reader running its models with this backend (`ReaderPool` factory)
+        :param gpu: whether to use GPU (only the 'easyocr' backend uses it)
+        :return: easyocr.Reader
+        """
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        reader = self.load(gpu)
+        self.convert(reader)
+        return reader
+
+    def load(self, gpu: bool) -> Any:
+        return create_reader(gpu)
+
+    def convert(self, reader: Any) -> None:
+        """
+        Replace `reader.detector` and `reader.recognizer` (in place)
+        """
+
+    def reader_pool(self, size: int = 1) -> ReaderPool:
+        """
+        Pool of readers of this backend (created on first use, shared by every caller of this backend instance)
+        :param size: pool size (only used when the pool is created)
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ReaderPool(size=size, gpu=False, factory=self.create_reader)
+            return self._pool
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(threads={self.threads})"
+
+
+class TorchBackend(InferenceBackend):
+    """
+    fp32 PyTorch models on CPU
+    """
+    name = 'torch'
+
+    def load(self, gpu: bool) -> Any:
+        return create_reader(False, quantize=False)
+
+
+class QuantizedBackend(TorchBackend):
+    """
+    Dynamically int8-quantized PyTorch models on CPU (weights quantized ahead, activations at run time)
+    """
+    name = 'quantized'
+
+    def __init__(self, threads: Optional[int] = None, engine: Optional[str] = None):
+        """
+        :param threads: intra-op threads (None = library default)
+        :param engine: quantized kernels: 'x86', 'fbgemm', 'onednn' or 'qnnpack' (ARM). None = PyTorch default
+        """
+        super().__init__(threads=threads)
+        self.engine = engine
+
+    def convert(self, reader: Any) -> None:
+        if self.engine:
+            torch.backends.quantized.engine = self.engine
+        # The detector has no layer dynamic quantization supports - only the recognizer is converted
+        reader.recognizer = torch.ao.quantization.quantize_dynamic(reader.recognizer, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+class _LastAxisMean(nn.Module):
+    # AdaptiveAvgPool2d((None, 1)) with a fixed output size, which the ONNX exporter supports
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x.mean(dim=3, keepdim=True)
+
+
+class _RecognizerExport(nn.Module):
+    # The recognizer without the `text` argument (unused by CTC models)
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        return self.model(image, None)
+
+
+class OnnxModel:
+    """
+    ONNX Runtime session standing in for a torch model inside EasyOCR
+    """
+
+    def __init__(self, session: Any, outputs: int = 1):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.outputs = outputs
+
+    def eval(self) -> "OnnxModel":
+        return self
+
+    def to(self, *args: Any, **kwargs: Any) -> "OnnxModel":
+        return self
+
+    def __call__(self, image: torch.Tensor, *args: Any) -> Union[torch.Tensor, tuple[torch.Tensor, ...]]:
+        results = self.session.run(None, {self.input_name: image.detach().cpu().numpy()})
+        tensors = tuple(torch.from_numpy(result) for result in results[:self.outputs])
+        return tensors if self.outputs > 1 else tensors[0]
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Models exported to ONNX and run by ONNX Runtime
+    """
+    name = 'onnx'
+
+    def __init__(self, threads: Optional[int] = None, model_dir: Union[str, Path, None] = None,
+                 providers: tuple[str, ...] = ('CPUExecutionProvider',), opset: int = 17):
+        """
+        :param threads: intra-op threads of every session (None = ONNX Runtime default: one per physical core)
+        :param model_dir: directory of the exported models (defaults to EasyOCR's model directory)
+        :param providers: ONNX Runtime execution providers
+        :param opset: ONNX opset of the export
+        """
+        super().__init__(threads=threads)
+        self.model_dir = Path(model_dir) if model_dir else Path(os.environ.get('EASYOCR_MODULE_PATH', Path.home() / '.EasyOCR')) / 'onnx'
+        self.providers = providers
+        self.opset = opset
+        self._export_lock = threading.Lock()
+
+    def load(self, gpu: bool) -> Any:
+        # Exported from the fp32 weights
+        return create_reader(False, quantize=False)
+
+    def convert(self, reader: Any) -> None:
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The 'onnx' OCR backend requires onnxruntime (pip install onnxruntime onnx)")
+
+        detector = self.export(reader.detector, 'detector', torch.zeros(1, 3, 64, 64),
+                               output_names=['y', 'feature'],
+                               dynamic_axes={'image': {0: 'batch', 2: 'height', 3: 'width'},
+                                             'y': {0: 'batch', 1: 'map_height', 2: 'map_width'},
+                                             'feature': {0: 'batch', 2: 'map_height', 3: 'map_width'}})
+        recognizer = self.export(self.exportable_recognizer(reader.recognizer), 'recognizer', torch.zeros(1, 1, 64, 256),
+                                 output_names=['preds'],
+                                 dynamic_axes={'image': {0: 'batch', 3: 'width'}, 'preds': {0: 'batch', 1: 'steps'}})
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.threads or 0
+        options.inter_op_num_threads = 1
+        providers = list(self.providers)
+        # EasyOCR calls `detector(x)` expecting (score maps, features), `recognizer(image, text)` expecting predictions
+        reader.detector = OnnxModel(onnxruntime.InferenceSession(str(detector), options, providers=providers), outputs=2)
+        reader.recognizer = OnnxModel(onnxruntime.InferenceSession(str(recognizer), options, providers=providers))
+
+    @staticmethod
+    def exportable_recognizer(model: nn.Module) -> nn.Module:
+        """
+        Recognizer with the layers the ONNX exporter can't handle replaced by equivalents
+        """
+        for name, module in list(model.named_modules()):
+            if isinstance(module, nn.AdaptiveAvgPool2d) and tuple(module.output_size) == (None, 1):
+                parent = model.get_submodule(name.rpartition('.')[0]) if '.' in name else model
+                setattr(parent, name.rpartition('.')[2], _LastAxisMean())
+        return _RecognizerExport(model)
+
+    def export(self, model: nn.Module, name: str, example: torch.Tensor, output_names: list[str],
+               dynamic_axes: dict[str, dict[int, str]]) -> Path:
+        """
+        Export a model to ONNX, unless it has been exported already
+        :return: path of the .onnx file (named after a fingerprint of the weights)
+        """
+        fingerprint = hashlib.sha1()
+        for key, tensor in model.state_dict().items():
+            fingerprint.update(key.encode())
+            fingerprint.update(tensor.detach().cpu().numpy().tobytes())
+        path = self.model_dir / f"{name}-{fingerprint.hexdigest()[:12]}-opset{self.opset}.onnx"
+
+        with self._export_lock:
+            if not path.exists():
+                self.model_dir.mkdir(parents=True, exist_ok=True)
+                # Written under a temporary name - other workers may be exporting the same model
+                temporary = path.with_suffix(f".{os.getpid()}.tmp")
+                with torch.no_grad():
+                    torch.onnx.export(model.eval(), (example,), str(temporary), input_names=['image'], output_names=output_names,
+                                      dynamic_axes=dynamic_axes, opset_version=self.opset, dynamo=False)
+                os.replace(temporary, path)
+        return path
+
+
+_BACKENDS: dict[str, type[InferenceBackend]] = {
+    'easyocr': InferenceBackend,
+    'torch': TorchBackend,
+    'quantized': QuantizedBackend,
+    'onnx': OnnxBackend,
+}
+BACKEND_NAMES = tuple(_BACKENDS)
+
+
+def create_backend(config: Optional[dict[str, Any]]) -> InferenceBackend:
+    """
+    Build a backend from a configuration dict:
+    {'BACKEND': 'easyocr' | 'torch' | 'quantized' | 'onnx', 'OPTIONS': {...backend arguments...}}
+    :param config: configuration (None = 'easyocr')
+    :return: InferenceBackend
+    """
+    config = config or {}
+    name = config.get('BACKEND') or 'easyocr'
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown OCR inference backend: {name} (available: {', '.join(_BACKENDS)})")
+    return _BACKENDS[name](**config.get('OPTIONS', {}))
+
+
+_configured: dict[str, InferenceBackend] = {}
+_configured_lock = threading.Lock()
+
+
+def get_backend(config: Optional[dict[str, Any]]) -> InferenceBackend:
+    """
+    Process-wide backend of a configuration (`create_backend` called once per distinct configuration)
+    :param config: configuration (None = 'easyocr')
+    :return: InferenceBackend
+    """
+    key = json.dumps(config or {}, sort_keys=True, default=str)
+    with _configured_lock:
+        backend = _configured.get(key)
+        if backend is None:
+            backend = _configured[key] = create_backend(config)
+        return backend
@@ -0,0 +1,177 @@
+from contextlib import contextmanager
+from queue import Queue, Empty
+from threading import Lock
+from typing import Any, Callable, Iterator, Optional
+
+from easyocr import Reader
+
+
+class ReaderPoolTimeout(TimeoutError):
+    """
+    Raised when no reader could be checked out of the pool in time
+    """
+
+
+def create_reader(gpu: bool, **options: Any) -> Reader:
+    """
+    Build a new EasyOCR reader (loads detection and recognition weights)
+    :param gpu: whether to use GPU
+    :param options: other `easyocr.Reader` arguments (ex. quantize=False)
+    :return: easyocr.Reader
+    """
+    return Reader(lang_list=['pl', 'en'], gpu=gpu, **options)
+
+
+class ReaderPool:
+    """
+    Pool of warm EasyOCR readers shared by every parser in the process.
+
+    Loading a reader takes seconds and hundreds of MB, so readers are created once (lazily or with `warm_up`)
+    and then checked out and returned for every scan. Each reader is used by a single thread at a time.
+    """
+
+    def __init__(self, size: int = 1, gpu: bool = True, factory: Optional[Callable[[bool], Any]] = None):
+        """
+        :param size: maximum number of readers kept in the pool
+        :param gpu: whether readers should use GPU
+        :param factory: callable building a reader (defaults to `create_reader`)
+        """
+        if size < 1:
+            raise ValueError('Reader pool size must be at least 1')
+
+        self.size = size
+        self.gpu = gpu
+        self.factory = factory or create_reader
+
+        self._idle: Queue = Queue()
+        self._created = 0
+        self._lock = Lock()
+
+    @property
+    def created(self) -> int:
+        """
+        Number of readers loaded so far
+        """
+        return self._created
+
+    def warm_up(self) -> None:
+        """
+        Load all readers up front (used at worker startup, so the first scan doesn't pay for model loading)
+        """
+        while True:
+            reader = self._create_if_allowed()
+            if reader is None:
+                break
+            self._idle.put(reader)
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """
+        Check out a reader. Creates a new one if the pool is not full yet, otherwise waits for a free one
+        :param timeout: seconds to wait for a free reader (None = wait forever)
+        :return: reader
+        """
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        reader = self._create_if_allowed()
+        if reader is not None:
+            return reader
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except Empty:
+            raise ReaderPoolTimeout(f'No OCR reader available after {timeout}s')
+
+    def release(self, reader: Any) -> None:
+        """
+        Return a reader checked out with `acquire`
+        :param reader: reader
+        """
+        self._idle.put(reader)
+
+    @contextmanager
+    def reader(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Borrow a reader for the duration of the `with` block
+        :param timeout: seconds to wait for a free reader (None = wait forever)
+        """
+        reader = self.acquire(timeout=timeout)
+        try:
+            yield reader
+        finally:
+            self.release(reader)
+
+    def _create_if_allowed(self) -> Optional[Any]:
+        # Reserve a slot under the lock, but load the model outside of it (it takes seconds)
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+
+        try:
+            return self.factory(self.gpu)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+
+# Process-wide pools (one per device type, size and factory) -----------------------------------------------------------
+
+_pools: dict[tuple[bool, int, Callable[[bool], Any]], ReaderPool] = {}
+_overrides: dict[bool, ReaderPool] = {}
+_pools_lock = Lock()
+
+
+def get_reader_pool(gpu: bool = True, size: int = 1, factory: Optional[Callable[[bool], Any]] = None) -> ReaderPool:
+    """
+    Get the process-wide reader pool for the given arguments, creating it on first use.
+    Every (gpu, size, factory) combination has its own pool - pass a stable factory (ex. a bound method of a cached
+    object, not a new lambda on every call), otherwise every call creates a new pool
+    :param gpu: whether readers should use GPU
+    :param size: pool size
+    :param factory: callable building a reader (defaults to `create_reader`)
+    :return: ReaderPool
+    """
+    factory = factory or create_reader
+    with _pools_lock:
+        override = _overrides.get(gpu)
+        if override is not None:
+            return override
+
+        key = (gpu, size, factory)
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ReaderPool(size=size, gpu=gpu, factory=factory)
+        return pool
+
+
+def set_reader_pool(pool: ReaderPool) -> None:
+    """
+    Override the process-wide pool for `pool.gpu`: it's returned whatever size and factory are requested
+    (ex. a pool of fake readers in tests)
+    :param pool: ReaderPool
+    """
+    with _pools_lock:
+        _overrides[pool.gpu] = pool
+
+
+def get_configured_reader_pool() -> ReaderPool:
+    """
+    Get the process-wide reader pool configured by Django settings (OCR_USE_GPU, OCR_READER_POOL_SIZE, OCR_INFERENCE)
+    :return: ReaderPool
+    """
+    from django.conf import settings
+
+    from .ocr_backends import get_backend
+
+    # The backend is cached per configuration, so its factory (and the pool) stay the same between calls
+    backend = get_backend(getattr(settings, 'OCR_INFERENCE', None))
+    return get_reader_pool(
+        # Only the default backend runs on GPU - the others are CPU inference paths
+        gpu=getattr(settings, 'OCR_USE_GPU', True) and backend.name == 'easyocr',
+        size=getattr(settings, 'OCR_READER_POOL_SIZE', 1),
+        factory=backend.create_reader
+    )
@@ -0,0 +1,141 @@
+import base64
+import json
+from typing import Any, Optional, Sequence
+
+from django.conf import settings
+from django.db.models import Model, Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on (date, id), newest first.
+
+    The cursor is the (date, id) of the last row of a page, the next page is fetched with
+    `WHERE date < :date OR (date = :date AND id < :id)` - the cost of a page doesn't depend on its position,
+    unlike OFFSET, and rows added in the meantime don't shift the pages.
+    """
+    date_field = "date"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def __init__(self, page_size: Optional[int] = None, max_page_size: Optional[int] = None):
+        self.page_size = page_size or settings.PAGINATION_PAGE_SIZE
+        self.max_page_size = max_page_size or settings.PAGINATION_MAX_PAGE_SIZE
+        self.request: Optional[Request] = None
+        self.next_position: Optional[tuple[str, int]] = None
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view: Any = None) -> list[Model]:
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            date, pk = position
+            queryset = queryset.filter(Q(**{f"{self.date_field}__lt": date}) | Q(**{self.date_field: date, "id__lt": pk}))
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset.order_by(f"-{self.date_field}", "-id")[:page_size + 1])
+        page = rows[:page_size]
+
+        self.next_position = None
+        if len(rows) > page_size:
+            last = page[-1]
+            self.next_position = (getattr(last, self.date_field).isoformat(), last.pk)
+
+        return page
+
+    def get_paginated_response(self, data: Sequence[Any]) -> Response:
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_position is None or self.request is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    @staticmethod
+    def encode_cursor(position: tuple[str, int]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, request: Request) -> Optional[tuple[Any, int]]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            date, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            parsed = parse_datetime(date)
+            if parsed is None:
+                raise ValueError(date)
+            return parsed, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound("Nieprawidłowy kursor")
+
+
+class RankedPagination(BasePagination):
+    """
+    Offset pages of ranked results (search): `?offset=` and `?page_size=`.
+    The order is by relevance, so there is no stable key for keyset pagination. There is no total count either -
+    counting every match costs more than the page itself
+    """
+    offset_query_param = "offset"
+    page_size_query_param = "page_size"
+
+    def __init__(self, page_size: Optional[int] = None, max_page_size: Optional[int] = None):
+        self.page_size = page_size or settings.PRODUCT_SEARCH_PAGE_SIZE
+        self.max_page_size = max_page_size or settings.PAGINATION_MAX_PAGE_SIZE
+        self.request: Optional[Request] = None
+        self.next_offset: Optional[int] = None
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view: Any = None) -> list[Model]:
+        self.request = request
+        try:
+            page_size = min(max(int(request.query_params[self.page_size_query_param]), 1), self.max_page_size)
+        except (KeyError, ValueError):
+            page_size = self.page_size
+        try:
+            offset = max(int(request.query_params.get(self.offset_query_param, 0)), 0)
+        except ValueError:
+            offset = 0
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.next_offset = offset + page_size if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_paginated_response(self, data: Sequence[Any]) -> Response:
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_offset is None or self.request is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.offset_query_param, self.next_offset)
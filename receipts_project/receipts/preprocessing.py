@@ -0,0 +1,210 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+
+@dataclass(frozen=True, slots=True)
+class PreprocessedImage:
+    """
+    Image prepared for OCR (see `ReceiptPreprocessor`)
+    """
+    image: ndarray  # Grayscale
+    canvas_size: int  # EasyOCR canvas_size matching the prepared image (no further resizing in the detector)
+    crop: tuple[int, int, int, int]  # Receipt region in the original image: x, y, width, height
+    angle: float  # Deskew rotation (degrees)
+    scale: float  # Resize factor applied after cropping
+
+
+class ReceiptPreprocessor:
+    """
+    Preprocessing stage run before OCR:
+    1. Grayscale conversion
+    2. Receipt region crop (largest bright contour, background painted white)
+    3. Deskew (rotation maximizing the variance of the horizontal projection profile)
+    4. Resize, so text lines are about `target_text_height` pixels high
+
+    Phone photos are often 12+ MP while receipt text needs far fewer pixels - the detector then runs on much smaller tensors.
+    """
+
+    def __init__(self, target_text_height: int = 32, min_canvas_size: int = 1280, max_canvas_size: int = 5000,
+                 crop: bool = True, deskew: bool = True, max_skew: float = 10.0):
+        """
+        :param target_text_height: desired height (px) of a text line
+        :param min_canvas_size: lower bound of the adaptive canvas_size
+        :param max_canvas_size: upper bound of the adaptive canvas_size (longer images are downscaled)
+        :param crop: whether to crop the receipt region
+        :param deskew: whether to straighten the image
+        :param max_skew: maximum detected rotation (degrees)
+        """
+        self.target_text_height = target_text_height
+        self.min_canvas_size = min_canvas_size
+        self.max_canvas_size = max_canvas_size
+        self.crop = crop
+        self.deskew = deskew
+        self.max_skew = max_skew
+
+    def __call__(self, image: ndarray) -> PreprocessedImage:
+        """
+        Prepare an image for OCR
+        :param image: BGR or grayscale image
+        :return: PreprocessedImage
+        """
+        if image is None or image.size == 0:
+            raise ValueError('Invalid numpy array')
+
+        gray = self.to_grayscale(image)
+
+        contour = self.find_receipt_contour(gray) if self.crop else None
+        if contour is not None:
+            gray, region = self.crop_to_contour(gray, contour)
+        else:
+            region = (0, 0, gray.shape[1], gray.shape[0])
+
+        angle = self.estimate_skew(gray, self.max_skew) if self.deskew else 0.0
+        if angle:
+            gray = self.rotate(gray, angle)
+
+        # Only downscale - upscaling doesn't add any detail
+        scale = 1.0
+        text_height = self.estimate_text_height(gray)
+        if text_height and text_height > self.target_text_height:
+            scale = self.target_text_height / text_height
+        scale = min(scale, self.max_canvas_size / max(gray.shape[:2]))
+
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+
+        canvas_size = int(min(max(max(gray.shape[:2]), self.min_canvas_size), self.max_canvas_size))
+
+        return PreprocessedImage(image=gray, canvas_size=canvas_size, crop=region, angle=angle, scale=scale)
+
+    @staticmethod
+    def to_grayscale(image: ndarray) -> ndarray:
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    @staticmethod
+    def find_receipt_contour(gray: ndarray, min_area_ratio: float = 0.15, work_size: int = 800) -> Optional[ndarray]:
+        """
+        Find the outline of the receipt (the largest bright contour)
+        :param gray: grayscale image
+        :param min_area_ratio: minimum area of the receipt relative to the whole image
+        :param work_size: longer side of the downscaled copy used for detection
+        :return: contour (in the original image coordinates) or None if the receipt fills the image or wasn't found
+        """
+        factor = min(1.0, work_size / max(gray.shape[:2]))
+        small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1.0 else gray
+
+        blurred = cv2.GaussianBlur(small, (5, 5), 0)
+        _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # Close the gaps left by the printed text
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+
+        contour = max(contours, key=cv2.contourArea)
+        area_ratio = cv2.contourArea(contour) / (small.shape[0] * small.shape[1])
+        if area_ratio < min_area_ratio or area_ratio > 0.95:
+            return None
+
+        return (contour / factor).astype(np.int32)
+
+    @staticmethod
+    def crop_to_contour(gray: ndarray, contour: ndarray) -> tuple[ndarray, tuple[int, int, int, int]]:
+        """
+        Crop the bounding box of a contour and paint everything outside of it white,
+        so the background doesn't count as ink in the later steps
+        :param gray: grayscale image
+        :param contour: receipt contour
+        :return: tuple: (cropped image, (x, y, width, height))
+        """
+        x, y, w, h = cv2.boundingRect(contour)
+        x, y = max(x, 0), max(y, 0)
+        w, h = min(w, gray.shape[1] - x), min(h, gray.shape[0] - y)
+
+        mask = np.zeros((h, w), np.uint8)
+        cv2.drawContours(mask, [contour - np.array([x, y], dtype=np.int32)], -1, 255, thickness=cv2.FILLED)
+
+        cropped = gray[y:y + h, x:x + w].copy()
+        cropped[mask == 0] = 255
+        return cropped, (x, y, w, h)
+
+    @staticmethod
+    def binarize(gray: ndarray) -> ndarray:
+        """
+        Text = 255, background = 0
+        """
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        return binary
+
+    @staticmethod
+    def estimate_skew(gray: ndarray, max_skew: float = 10.0, step: float = 0.5, work_size: int = 600) -> float:
+        """
+        Estimate the rotation that makes text lines horizontal - horizontal lines give the most "peaky"
+        projection profile (highest variance of row sums)
+        :param gray: grayscale image
+        :param max_skew: maximum checked rotation (degrees)
+        :param step: angle step (degrees)
+        :param work_size: longer side of the downscaled copy used for the estimation
+        :return: angle (degrees) to pass to `rotate`
+        """
+        factor = min(1.0, work_size / max(gray.shape[:2]))
+        small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1.0 else gray
+        binary = ReceiptPreprocessor.binarize(small)
+
+        h, w = binary.shape
+        center = (w / 2, h / 2)
+        best_angle, best_score = 0.0, -1.0
+        # Smallest rotations first, so they win ties
+        for angle in sorted(np.arange(-max_skew, max_skew + step / 2, step), key=abs):
+            matrix = cv2.getRotationMatrix2D(center, float(angle), 1.0)
+            rotated = cv2.warpAffine(binary, matrix, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+            score = float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+            if score > best_score:
+                best_angle, best_score = float(angle), score
+
+        return best_angle
+
+    @staticmethod
+    def rotate(gray: ndarray, angle: float) -> ndarray:
+        """
+        Rotate around the center, keeping the whole image (new corners are filled with white)
+        """
+        h, w = gray.shape[:2]
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        new_w, new_h = int(h * sin + w * cos), int(h * cos + w * sin)
+        matrix[0, 2] += new_w / 2 - w / 2
+        matrix[1, 2] += new_h / 2 - h / 2
+        return cv2.warpAffine(gray, matrix, (new_w, new_h), flags=cv2.INTER_LINEAR, borderValue=255)
+
+    @staticmethod
+    def estimate_text_height(gray: ndarray, min_ink_ratio: float = 0.01) -> Optional[float]:
+        """
+        Estimate the height of a text line: median height of the row runs containing ink (horizontal projection profile)
+        :param gray: grayscale image (deskewed)
+        :param min_ink_ratio: minimum share of ink pixels for a row to count as text
+        :return: text height (px) or None if no text lines were found
+        """
+        binary = ReceiptPreprocessor.binarize(gray)
+        has_ink = (binary > 0).mean(axis=1) >= min_ink_ratio
+
+        # Run lengths of consecutive text rows
+        padded = np.concatenate(([False], has_ink, [False])).astype(np.int8)
+        edges = np.flatnonzero(np.diff(padded))
+        heights = edges[1::2] - edges[::2]
+        heights = heights[heights >= 3]  # Ignore noise
+
+        if not len(heights):
+            return None
+        return float(np.median(heights))
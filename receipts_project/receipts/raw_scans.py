@@ -0,0 +1,171 @@
+"""
+Stored raw OCR output.
+
+OCR is by far the most expensive step of a scan, parsing the recognized lines takes milliseconds.
+Every scan stores its raw output as a `ReceiptScan` row, so after a change of the parsing rules
+(discount keywords, item regexes, ...) historic receipts are parsed again without running OCR
+(`python manage.py reparse_scans`).
+"""
+import logging
+import multiprocessing
+from itertools import islice
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from numpy import ndarray
+
+from .layout import boxes_from_json
+from .models import ReceiptScan
+from .ocr import ReceiptParser
+from .scan_cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+def store_raw_output(user: Any, image: ndarray, raw_output: Sequence[str], boxes: Optional[list] = None) -> Optional[ReceiptScan]:
+    """
+    Store the raw output of a scan (if OCR_STORE_RAW_OUTPUT is enabled)
+    :param user: owner of the scan
+    :param image: decoded image
+    :param raw_output: lines returned by the OCR
+    :param boxes: bounding boxes of the lines
+    :return: ReceiptScan or None if storing is disabled
+    """
+    if user is None or not getattr(settings, 'OCR_STORE_RAW_OUTPUT', True):
+        return None
+    return ReceiptScan.objects.create(user=user, image_hash=content_hash(image), raw_output=list(raw_output), boxes=boxes)
+
+
+def copy_raw_output(user: Any, image: ndarray, parsed: dict[str, Any], source_hash: Optional[str] = None) -> Optional[ReceiptScan]:
+    """
+    Store a scan answered from the scan cache - the raw output is copied from the scan the cached result came from
+    :param user: owner of the scan
+    :param image: decoded image
+    :param parsed: cached `ReceiptResult.to_json()` output
+    :param source_hash: `content_hash` of the image the cached result was computed from (`CacheHit.image_hash`,
+                        differs from the hash of `image` on a perceptual hit). None = the hash of `image`
+    :return: ReceiptScan or None if there is no earlier scan of the image (or storing is disabled)
+    """
+    if user is None or not getattr(settings, 'OCR_STORE_RAW_OUTPUT', True):
+        return None
+
+    image_hash = content_hash(image)
+    source_hash = source_hash or image_hash
+    source = ReceiptScan.objects.filter(image_hash=source_hash).only('raw_output', 'boxes').order_by('-id').first()
+    if source is None:
+        # Ex. the result was cached while OCR_STORE_RAW_OUTPUT was disabled - reparse_scans won't reach this scan
+        logger.warning('No stored raw output of image %s (served from the scan cache as %s), scan not stored', source_hash, image_hash)
+        return None
+
+    return ReceiptScan.objects.create(
+        user=user,
+        image_hash=image_hash,
+        raw_output=source.raw_output,
+        boxes=source.boxes,
+        result=parsed,
+        parsed_at=timezone.now()
+    )
+
+
+def format_error(error: Exception) -> str:
+    """
+    Error message stored with a failed parse (same as the API error details)
+    :param error: raised exception
+    :return: message
+    """
+    if isinstance(error, ValueError):
+        return f"Błąd danych: {str(error)}"
+    return f"Błąd parsowania: {str(error)}"
+
+
+def parse_raw_output(raw_output: Sequence[str], boxes: Optional[list] = None) -> tuple[Optional[dict[str, Any]], str]:
+    """
+    Parse raw output, catching the errors
+    :param raw_output: lines returned by the OCR
+    :param boxes: stored boxes (detail mode) - parsed instead of the lines if present
+    :return: tuple: (`ReceiptResult.to_json()` output or None, error message)
+    """
+    try:
+        if boxes:
+            return ReceiptParser.parse_layout(boxes_from_json(boxes)).to_json(), ''
+        return ReceiptParser.parse(raw_output).to_json(), ''
+    except Exception as e:
+        return None, format_error(e)
+
+
+def record_parse(scan: Optional[ReceiptScan], result: Optional[dict[str, Any]], error: str = '') -> None:
+    """
+    Store the outcome of parsing a scan
+    :param scan: ReceiptScan (None is ignored)
+    :param result: `ReceiptResult.to_json()` output
+    :param error: error message
+    """
+    if scan is None:
+        return
+
+    scan.result = result
+    scan.error = error
+    scan.parsed_at = timezone.now()
+    scan.save(update_fields=['result', 'error', 'parsed_at'])
+
+
+def _parse_chunk(rows: list[tuple[int, list[str], Optional[list]]]) -> list[tuple[int, Optional[dict[str, Any]], str]]:
+    # Runs in the worker processes - pure Python, no database access
+    return [(pk, *parse_raw_output(raw_output, boxes)) for pk, raw_output, boxes in rows]
+
+
+def _chunks(queryset: QuerySet, chunk_size: int) -> Iterator[list[tuple[int, list[str], Optional[list]]]]:
+    # Keyset pagination on id - every chunk is a separate short query, so the rows can be updated in between
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', 'raw_output', 'boxes')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def reparse_scans(queryset: Optional[QuerySet] = None, chunk_size: int = 1000, workers: int = 1,
+                  progress: Optional[Callable[[int, int], None]] = None) -> dict[str, int]:
+    """
+    Parse stored raw output again and update the results in bulk
+    :param queryset: scans to parse (defaults to all)
+    :param chunk_size: rows fetched, parsed and updated at once
+    :param workers: number of parsing processes (1 = parse in this process)
+    :param progress: called after every chunk with (processed, failed)
+    :return: {'processed': ..., 'failed': ...}
+    """
+    if queryset is None:
+        queryset = ReceiptScan.objects.all()
+
+    chunks = _chunks(queryset, chunk_size)
+    processed = failed = 0
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        while True:
+            # Database access stays in this process: read a chunk per worker, parse them in parallel, update
+            window = list(islice(chunks, max(workers, 1)))
+            if not window:
+                break
+            parsed_chunks = pool.map(_parse_chunk, window) if pool is not None else map(_parse_chunk, window)
+
+            for parsed in parsed_chunks:
+                now = timezone.now()
+                scans = [
+                    ReceiptScan(id=pk, result=result, error=error, parsed_at=now)
+                    for pk, result, error in parsed
+                ]
+                ReceiptScan.objects.bulk_update(scans, ['result', 'error', 'parsed_at'], batch_size=chunk_size)
+
+                processed += len(scans)
+                failed += sum(1 for scan in scans if scan.error)
+                if progress is not None:
+                    progress(processed, failed)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return {'processed': processed, 'failed': failed}
@@ -0,0 +1,153 @@
+"""
+Region-of-interest OCR: the full-resolution recognizer reads only the part of the receipt the parser uses.
+
+1. Text is detected on a downscaled copy of the image (`Reader.detect`). Detection cost grows with the number
+   of pixels - at half resolution it's about a quarter. The boxes are scaled back to full resolution.
+2. Detected boxes are grouped into rows and recognized at full resolution (`Reader.recognize`) from the top,
+   a chunk of rows at a time, until the "PARAGON FISKALNY" and "SUMA PLN" anchors are found. After the total
+   only `tail_rows` rows are read: payment, identifier, date and time.
+3. The footer below them (ads, loyalty programs, return policy) is never recognized. The header above the title
+   is - it has to be read to find the title, and the purchase date is usually printed there.
+
+If an anchor isn't found, every row is recognized - the output is the same as a full pass.
+"""
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+import cv2
+from numpy import ndarray
+
+from .fuzzy import KeywordMatcher, compile_keywords
+from .layout import DetectedBox, LayoutText, TextBox, group_rows, sweep_rows
+
+TITLE_ANCHOR = 'paragon fiskalny'
+TOTAL_ANCHOR = 'SUMA PLN'
+
+
+@dataclass(frozen=True, slots=True)
+class RegionScan:
+    """
+    Output of `read_regions`
+    """
+    output: list[Any]  # `readtext(detail=1)` entries of the recognized rows, top to bottom
+    detected_rows: int
+    recognized_rows: int
+    anchors_found: bool
+
+
+def detect_rows(reader: Any, image: ndarray, scale: float = 0.5, canvas_size: int = 5000) -> list[list[DetectedBox]]:
+    """
+    Detect text on a downscaled copy of the image
+    :param reader: EasyOCR reader
+    :param image: image passed to the recognizer (full resolution)
+    :param scale: scale of the detection pass
+    :param canvas_size: canvas_size of the full-resolution image
+    :return: rows of boxes in full-resolution pixels, top to bottom
+    """
+    height, width = image.shape[:2]
+    small = image if scale >= 1 else cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                                interpolation=cv2.INTER_AREA)
+    horizontal, free = reader.detect(small, canvas_size=max(1, round(canvas_size * scale)), min_size=max(1, round(20 * scale)))
+
+    boxes = []
+    # Rotated boxes are recognized as their bounding rectangles (the preprocessor deskews the receipt anyway)
+    rectangles = [tuple(box) for box in horizontal[0]] + [
+        (min(x for x, _ in points), max(x for x, _ in points), min(y for _, y in points), max(y for _, y in points))
+        for points in free[0]
+    ]
+    for x_min, x_max, y_min, y_max in rectangles:
+        x0, x1 = max(0, int(x_min / scale)), min(width, int(round(x_max / scale)))
+        y0, y1 = max(0, int(y_min / scale)), min(height, int(round(y_max / scale)))
+        if x1 > x0 and y1 > y0:
+            boxes.append(DetectedBox(x0, x1, y0, y1))
+    return sweep_rows(boxes)
+
+
+def anchor_matcher(threshold: int = 75) -> KeywordMatcher:
+    return compile_keywords((TITLE_ANCHOR, TOTAL_ANCHOR), threshold)
+
+
+def rows_after_total(layout: LayoutText, matcher: KeywordMatcher, threshold: int = 75) -> int:
+    """
+    Number of rows below the "SUMA PLN" row (the first one after the title)
+    :param layout: rows recognized so far
+    :param matcher: `anchor_matcher()`
+    :param threshold: threshold for the fuzzy search
+    :return: number of rows, -1 if an anchor hasn't been found yet
+    """
+    matches = matcher.scan(layout.text.lower())
+    title = matches.find(TITLE_ANCHOR, threshold)
+    if not title:
+        return -1
+    total = matches.find(TOTAL_ANCHOR, threshold, start=title[1])
+    if not total:
+        return -1
+    # Windows can start at the newline before the keyword - the row is the one holding the middle of the match
+    return len(layout.rows) - 1 - layout.text.count("\n", 0, (total[0] + total[1]) // 2)
+
+
+def recognize_options(options: dict[str, Any], batch_size: int = 16) -> dict[str, Any]:
+    """
+    `Reader.recognize` options matching readtext options (detail mode)
+    :param options: readtext options
+    :param batch_size: line crops passed to the recognizer at once
+    """
+    return {
+        'detail': 1,
+        'paragraph': False,
+        'batch_size': batch_size,
+        'contrast_ths': options.get('contrast_ths', 0.1),
+        'adjust_contrast': options.get('adjust_contrast', 0.5),
+    }
+
+
+def recognize_rows(reader: Any, image: ndarray, rows: Sequence[list[DetectedBox]], options: dict[str, Any],
+                   batch_size: int = 16) -> list[Any]:
+    """
+    Recognize every detected row (a detector other than the reader's own, ex. `ProjectionSegmenter`)
+    :param reader: EasyOCR reader
+    :param image: image the boxes were detected on
+    :param rows: detected rows
+    :param options: readtext options
+    :param batch_size: line crops passed to the recognizer at once
+    :return: `readtext(detail=1)` entries, top to bottom
+    """
+    horizontal = [box.to_horizontal() for row in rows for box in row]
+    if not horizontal:
+        return []
+    return reader.recognize(image, horizontal_list=horizontal, free_list=[], **recognize_options(options, batch_size))
+
+
+def read_regions(reader: Any, image: ndarray, options: dict[str, Any], threshold: int = 75, scale: float = 0.5,
+                 chunk_rows: int = 8, tail_rows: int = 12, rows: Optional[Sequence[list[DetectedBox]]] = None,
+                 batch_size: int = 16) -> RegionScan:
+    """
+    Two-pass OCR: low-resolution detection, full-resolution recognition down to `tail_rows` rows after the total
+    :param reader: EasyOCR reader
+    :param image: image of a receipt (after preprocessing)
+    :param options: readtext options (canvas_size, contrast_ths, adjust_contrast)
+    :param threshold: threshold for the fuzzy search of the anchors
+    :param scale: scale of the detection pass
+    :param chunk_rows: rows recognized per `recognize` call before looking for the anchors again
+    :param tail_rows: rows recognized after the "SUMA PLN" row
+    :param rows: rows found by another detector (the low-resolution detection pass is skipped)
+    :param batch_size: line crops passed to the recognizer at once
+    :return: RegionScan
+    """
+    if rows is None:
+        rows = detect_rows(reader, image, scale=scale, canvas_size=options.get('canvas_size', 5000))
+    matcher = anchor_matcher(threshold)
+
+    output: list[Any] = []
+    position, stop, after = 0, len(rows), -1
+    while position < stop:
+        chunk = rows[position:min(position + chunk_rows, stop)]
+        output.extend(recognize_rows(reader, image, chunk, options, batch_size=batch_size))
+        position += len(chunk)
+
+        # The best "SUMA PLN" window can still move down (ex. "SUMA PTU" matched until the real total is read)
+        layout = LayoutText(group_rows(TextBox.from_readtext(entry) for entry in output))
+        after = rows_after_total(layout, matcher, threshold)
+        stop = len(rows) if after < 0 else min(len(rows), position + max(0, tail_rows - after))
+
+    return RegionScan(output=output, detected_rows=len(rows), recognized_rows=position, anchors_found=after >= 0)
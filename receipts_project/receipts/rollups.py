@@ -0,0 +1,146 @@
+"""
+Daily spending rollup (`DailySpending`).
+
+Totals are updated incrementally by the Transaction signals (signals.py), so the calendar reads
+at most one row per day instead of aggregating raw transactions. Bulk operations (`bulk_create`,
+`QuerySet.update`) don't send signals - call `refresh_days` for the affected days afterwards,
+or rebuild everything with `python manage.py rebuild_rollups`.
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySpending, Transaction
+
+
+def local_day(value: datetime) -> date:
+    """
+    Day of a transaction in the local timezone (the same day as TruncDay('date') used by the calendar)
+    """
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def split_amount(amount: Any) -> tuple[Decimal, Decimal]:
+    """
+    :param amount: transaction amount
+    :return: tuple: (income, expense)
+    """
+    amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+    return (amount, Decimal(0)) if amount > 0 else (Decimal(0), amount)
+
+
+def add_transaction(user_id: int, value: datetime, amount: Any) -> None:
+    """
+    Add a transaction to its day
+    :param user_id: owner
+    :param value: date of the transaction
+    :param amount: transaction amount
+    """
+    day = local_day(value)
+    income, expense = split_amount(amount)
+    changes = {"income": F("income") + income, "expense": F("expense") + expense, "count": F("count") + 1}
+
+    with transaction.atomic():
+        if DailySpending.objects.filter(user_id=user_id, day=day).update(**changes):
+            return
+        try:
+            # Savepoint, so a concurrent insert of the same day doesn't break the outer transaction
+            with transaction.atomic():
+                DailySpending.objects.create(user_id=user_id, day=day, income=income, expense=expense, count=1)
+        except IntegrityError:
+            DailySpending.objects.filter(user_id=user_id, day=day).update(**changes)
+
+
+def remove_transaction(user_id: int, value: datetime, amount: Any) -> None:
+    """
+    Remove a transaction from its day (days without transactions are deleted)
+    :param user_id: owner
+    :param value: date of the transaction
+    :param amount: transaction amount
+    """
+    day = local_day(value)
+    income, expense = split_amount(amount)
+
+    with transaction.atomic():
+        rows = DailySpending.objects.filter(user_id=user_id, day=day)
+        rows.update(income=F("income") - income, expense=F("expense") - expense, count=F("count") - 1)
+        rows.filter(count=0).delete()
+
+
+def aggregate_days(queryset) -> Any:
+    """
+    Aggregate transactions to (user, local day) rows
+    :param queryset: transactions
+    :return: queryset of dicts: user_id, day, income, expense, count
+    """
+    zero = Value(Decimal(0), output_field=DecimalField(max_digits=14, decimal_places=2))
+    return (
+        queryset
+        .annotate(day=TruncDate("date", tzinfo=timezone.get_current_timezone()))
+        .values("user_id", "day")
+        .annotate(
+            income=Sum(Case(When(total_amount__gt=0, then=F("total_amount")), default=zero)),
+            expense=Sum(Case(When(total_amount__lt=0, then=F("total_amount")), default=zero)),
+            count=Count("id"),
+        )
+        .order_by()
+    )
+
+
+def day_range(first: date, last: date) -> Q:
+    """
+    Transactions dated from the start of `first` to the end of `last` (local timezone) - an index range on (user, date)
+    """
+    start = timezone.make_aware(datetime.combine(first, time.min))
+    end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min))
+    return Q(date__gte=start, date__lt=end)
+
+
+def refresh_days(user_id: int, days: Iterable[date]) -> None:
+    """
+    Recompute the given days of a user from the transactions (ex. after bulk_create)
+    :param user_id: owner
+    :param days: local days to recompute
+    """
+    days = set(days)
+    if not days:
+        return
+
+    rows = aggregate_days(Transaction.objects.filter(day_range(min(days), max(days)), user_id=user_id))
+    fresh = [DailySpending(**row) for row in rows if row["day"] in days]
+
+    with transaction.atomic():
+        DailySpending.objects.filter(user_id=user_id, day__in=days).delete()
+        DailySpending.objects.bulk_create(fresh)
+
+
+def rebuild(user: Optional[Any] = None, batch_size: int = 1000) -> int:
+    """
+    Recompute the whole rollup (of a single user or of everyone)
+    :param user: user or None for all users
+    :param batch_size: rows inserted at once
+    :return: number of rollup rows
+    """
+    transactions = Transaction.objects.all()
+    rollups = DailySpending.objects.all()
+    if user is not None:
+        transactions = transactions.filter(user=user)
+        rollups = rollups.filter(user=user)
+
+    with transaction.atomic():
+        rollups.delete()
+        created = 0
+        batch = []
+        for row in aggregate_days(transactions).iterator(chunk_size=batch_size):
+            batch.append(DailySpending(**row))
+            if len(batch) >= batch_size:
+                created += len(DailySpending.objects.bulk_create(batch))
+                batch = []
+        created += len(DailySpending.objects.bulk_create(batch))
+
+    return created
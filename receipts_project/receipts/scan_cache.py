@@ -0,0 +1,369 @@
+"""
+Cache of scan results keyed by the content of the decoded image.
+
+Mobile clients retry uploads and send the same photo more than once - a repeated image is answered
+from the cache instead of running OCR again. Keys are the SHA-256 of the decoded pixels
+(optionally also a perceptual dHash, which survives re-encoding of the same photo),
+values are `ReceiptResult.to_json()` outputs stored as JSON, together with the exact hash of the image
+they were computed from (a perceptual hit comes from a different image - its stored raw output is found by that hash).
+
+Perceptual keys are scoped to the owner of the scan: a 64-bit dHash also matches similar-looking photos
+of a different receipt, which must never return another user's result. Exact keys are shared - only
+the same pixels match them.
+"""
+import hashlib
+from abc import ABC, abstractmethod
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock, local
+from typing import Any, Optional, Sequence, Union
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+
+def content_hash(image: ndarray) -> str:
+    """
+    Exact hash of the decoded pixels (shape and dtype included)
+    :param image: decoded image
+    :return: key
+    """
+    digest = hashlib.sha256(f'{image.shape}|{image.dtype}|'.encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return f'sha256:{digest.hexdigest()}'
+
+
+def perceptual_hash(image: ndarray, hash_size: int = 8) -> str:
+    """
+    Difference hash (dHash): sign of the horizontal gradient of a tiny grayscale thumbnail.
+    The same photo re-encoded or slightly rescaled gets the same hash
+    :param image: decoded image
+    :param hash_size: hash is hash_size * hash_size bits
+    :return: key
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return f'dhash:{int("".join("1" if bit else "0" for bit in bits), 2):0{hash_size * hash_size // 4}x}'
+
+
+@dataclass(frozen=True, slots=True)
+class CacheHit:
+    """
+    Result found in the scan cache
+    """
+    result: dict[str, Any]  # `to_json()` output
+    image_hash: str  # `content_hash` of the image the result was computed from
+
+
+class ScanCache(ABC):
+    """
+    Base class of the scan cache backends. Subclasses implement `clear`, and `_get` and `_set` for single keys
+    """
+
+    def __init__(self, perceptual: bool = False, prefix: str = 'receipt-scan-v2'):
+        """
+        :param perceptual: also look results up by the perceptual hash of the image
+        :param prefix: key prefix (change it to invalidate results made by an older parser)
+        """
+        self.perceptual = perceptual
+        self.prefix = prefix
+
+    def keys(self, image: ndarray, owner: Any = None) -> list[str]:
+        """
+        Cache keys of an image, in lookup order
+        :param image: decoded image
+        :param owner: primary key of the user scanning the image (None = no perceptual lookup)
+        :return: list of keys
+        """
+        keys = [content_hash(image)]
+        if self.perceptual and owner is not None:
+            keys.append(f'user:{owner}:{perceptual_hash(image)}')
+        return [f'{self.prefix}:{key}' for key in keys]
+
+    def get(self, image: ndarray, owner: Any = None) -> Optional[dict[str, Any]]:
+        """
+        Cached result of an image
+        :param image: decoded image
+        :param owner: primary key of the user scanning the image
+        :return: `to_json()` output or None
+        """
+        hit = self.lookup(image, owner)
+        return None if hit is None else hit.result
+
+    def lookup(self, image: ndarray, owner: Any = None) -> Optional[CacheHit]:
+        """
+        Cached result of an image with the hash of the image it was computed from
+        :param image: decoded image
+        :param owner: primary key of the user scanning the image
+        :return: CacheHit or None
+        """
+        return self.get_many(self.keys(image, owner))
+
+    def set(self, image: ndarray, result: dict[str, Any], owner: Any = None) -> None:
+        """
+        Store the result of an image
+        :param image: decoded image
+        :param result: `to_json()` output
+        :param owner: primary key of the user scanning the image
+        """
+        self.set_many(self.keys(image, owner), result, content_hash(image))
+
+    def get_many(self, keys: Sequence[str]) -> Optional[CacheHit]:
+        for key in keys:
+            value = self._get(key)
+            if value is not None:
+                entry = json.loads(value)
+                return CacheHit(result=entry['result'], image_hash=entry['image_hash'])
+        return None
+
+    def set_many(self, keys: Sequence[str], result: dict[str, Any], image_hash: str) -> None:
+        value = json.dumps({'image_hash': image_hash, 'result': result})
+        for key in keys:
+            self._set(key, value)
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Drop every scan result - and nothing else stored by the same backend
+        """
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: str) -> None:
+        ...
+
+
+class MemoryScanCache(ScanCache):
+    """
+    In-process LRU cache with TTL (one per worker process)
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: Optional[float] = 3600, **kwargs):
+        """
+        :param max_entries: maximum number of stored keys (least recently used are evicted)
+        :param ttl: seconds after which an entry expires (None = never)
+        """
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DjangoScanCache(ScanCache):
+    """
+    Backend storing results in a Django cache (ex. Redis/Memcached shared by all workers).
+    Eviction is done by the cache itself.
+
+    The cache alias is usually shared with the rest of the project, so `clear` doesn't flush it: keys carry
+    a generation number stored in the cache, and clearing moves to the next generation - entries of older
+    generations are never read again and expire by their TTL
+    """
+
+    def __init__(self, alias: str = 'default', ttl: Optional[float] = 3600, **kwargs):
+        """
+        :param alias: name of the cache in settings.CACHES
+        :param ttl: seconds after which an entry expires (None = never)
+        """
+        super().__init__(**kwargs)
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    @property
+    def generation_key(self) -> str:
+        return f'{self.prefix}:generation'
+
+    def generation(self) -> int:
+        """
+        Current generation of the keys (0 until the cache is cleared for the first time)
+        """
+        return self.cache.get(self.generation_key, 0)
+
+    def get_many(self, keys: Sequence[str]) -> Optional[CacheHit]:
+        generation = self.generation()
+        return super().get_many([f'{key}:g{generation}' for key in keys])
+
+    def set_many(self, keys: Sequence[str], result: dict[str, Any], image_hash: str) -> None:
+        generation = self.generation()
+        super().set_many([f'{key}:g{generation}' for key in keys], result, image_hash)
+
+    def clear(self) -> None:
+        # `incr` is atomic on the shared backends, but needs an existing key
+        self.cache.add(self.generation_key, 0, timeout=None)
+        self.cache.incr(self.generation_key)
+
+    def _get(self, key: str) -> Optional[str]:
+        return self.cache.get(key)
+
+    def _set(self, key: str, value: str) -> None:
+        self.cache.set(key, value, timeout=self.ttl)
+
+
+class SQLiteScanCache(ScanCache):
+    """
+    On-disk LRU cache with TTL in a SQLite file - survives restarts and is shared by the worker processes of a host
+    """
+
+    def __init__(self, path: Union[str, Path], max_entries: int = 10000, ttl: Optional[float] = 7 * 24 * 3600, **kwargs):
+        """
+        :param path: database file
+        :param max_entries: maximum number of stored keys (least recently used are evicted)
+        :param ttl: seconds after which an entry expires (None = never)
+        """
+        super().__init__(**kwargs)
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = local()
+
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS scan_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS scan_cache_accessed ON scan_cache (accessed)')
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, WAL lets readers work while another process writes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM scan_cache').fetchone()[0]
+
+    def clear(self) -> None:
+        with self._connection() as connection:
+            connection.execute('DELETE FROM scan_cache')
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute('SELECT value, expires FROM scan_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, expires = row
+            if expires < now:
+                connection.execute('DELETE FROM scan_cache WHERE key = ?', (key,))
+                return None
+
+            connection.execute('UPDATE scan_cache SET accessed = ? WHERE key = ?', (now, key))
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else float('inf')
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO scan_cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                (key, value, expires, now)
+            )
+            connection.execute('DELETE FROM scan_cache WHERE expires < ?', (now,))
+            connection.execute(
+                'DELETE FROM scan_cache WHERE key IN ('
+                'SELECT key FROM scan_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+
+# Process-wide cache -----------------------------------------------------------------------------------------------------
+
+_BACKENDS = {
+    'memory': MemoryScanCache,
+    'django': DjangoScanCache,
+    'sqlite': SQLiteScanCache,
+}
+
+_cache: Optional[ScanCache] = None
+_cache_configured = False
+_cache_lock = Lock()
+
+
+def create_scan_cache(config: dict[str, Any]) -> Optional[ScanCache]:
+    """
+    Build a cache from a configuration dict:
+    {'BACKEND': 'memory' | 'django' | 'sqlite' | None, 'OPTIONS': {...backend arguments...}}
+    :param config: configuration
+    :return: ScanCache or None if caching is disabled
+    """
+    backend = config.get('BACKEND')
+    if not backend:
+        return None
+    if backend not in _BACKENDS:
+        raise ValueError(f'Unknown scan cache backend: {backend}')
+    return _BACKENDS[backend](**config.get('OPTIONS', {}))
+
+
+def get_scan_cache() -> Optional[ScanCache]:
+    """
+    Get the process-wide scan cache configured by Django settings (OCR_SCAN_CACHE), creating it on first use
+    :return: ScanCache or None if caching is disabled
+    """
+    global _cache, _cache_configured
+
+    with _cache_lock:
+        if not _cache_configured:
+            from django.conf import settings
+
+            _cache = create_scan_cache(getattr(settings, 'OCR_SCAN_CACHE', {}))
+            _cache_configured = True
+        return _cache
+
+
+def set_scan_cache(cache: Optional[ScanCache]) -> None:
+    """
+    Replace the process-wide scan cache (ex. in tests). None disables caching
+    :param cache: ScanCache or None
+    """
+    global _cache, _cache_configured
+
+    with _cache_lock:
+        _cache = cache
+        _cache_configured = True
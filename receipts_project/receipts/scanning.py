@@ -0,0 +1,226 @@
+import datetime
+from decimal import Decimal
+from typing import Any, Optional, Sequence, Union
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from numpy import ndarray
+
+from .layout import boxes_to_json, group_rows
+from .models import ReceiptScan
+from .normalization import display_name, get_normalizer, user_canonical_names
+from .ocr import ReceiptEngine, ReceiptResult
+from .ocr_pool import get_configured_reader_pool
+from .preprocessing import ReceiptPreprocessor
+from .raw_scans import copy_raw_output, format_error, record_parse, store_raw_output
+from .scan_cache import get_scan_cache
+from .uploads import Buffer, ImageInfo, decode_flag, validate_image
+
+
+def get_engine() -> ReceiptEngine:
+    """
+    Stateless engine borrowing warm readers from the process-wide pool
+    :return: ReceiptEngine
+    """
+    preprocessor = ReceiptPreprocessor(target_text_height=settings.OCR_TARGET_TEXT_HEIGHT) if settings.OCR_PREPROCESS else None
+    return ReceiptEngine(reader_pool=get_configured_reader_pool(), preprocessor=preprocessor)
+
+
+def validate_upload(data: Buffer) -> ImageInfo:
+    """
+    Check the size, format and dimensions of an uploaded image (OCR_MAX_UPLOAD_SIZE, OCR_MAX_IMAGE_PIXELS)
+    :param data: encoded image
+    :return: ImageInfo
+    :raises ValueError: with the reason
+    """
+    return validate_image(data, settings.OCR_MAX_UPLOAD_SIZE, settings.OCR_MAX_IMAGE_PIXELS)
+
+
+def decode_image(data: Buffer) -> ndarray:
+    """
+    Decode an uploaded image in grayscale, reduced 2x or 4x if it is much larger than OCR needs (OCR_DECODE_MIN_SIDE)
+    :param data: encoded image (JPEG, PNG, WebP, BMP), ex. a memory-mapped upload (see uploads.open_upload)
+    :return: grayscale image
+    """
+    info = validate_upload(data)
+    flag = decode_flag(info, settings.OCR_DECODE_MIN_SIDE)
+
+    # Zero-copy view of the data - released before returning, so a memory-mapped file can be closed
+    np_arr = np.frombuffer(data, np.uint8)
+    try:
+        img = cv2.imdecode(np_arr, flag)
+    except cv2.error:
+        img = None
+    finally:
+        del np_arr
+    if img is None:
+        raise ValueError("Nie udało się zdekodować obrazu")
+    return img
+
+
+def scan_image(img: ndarray, user: Any = None) -> dict[str, Any]:
+    """
+    Scan a receipt and convert the result to the API representation (expenses as negative amounts).
+    Repeated images are answered from the scan cache (OCR_SCAN_CACHE), the raw output is stored for re-parsing
+    :param img: decoded image
+    :param user: owner of the scan (None = don't store the raw output)
+    :return: JSON representation of the receipt
+    """
+    cache = get_scan_cache()
+    owner = getattr(user, 'pk', None)
+    hit = cache.lookup(img, owner) if cache is not None else None
+
+    if hit is not None:
+        copy_raw_output(user, img, hit.result, source_hash=hit.image_hash)
+        return annotate_canonical([to_api_representation(hit.result)], user)[0]
+
+    engine = get_engine()
+    detail, options = settings.OCR_DETAIL, {'roi': settings.OCR_ROI, 'detector': settings.OCR_DETECTOR}
+    raw_output = engine.read_boxes(img, **options) if detail else engine.read_text(img, **options)
+    scan = _store_output(user, img, raw_output, detail)
+
+    try:
+        parsed = _parse_output(engine, raw_output, detail).to_json()
+    except Exception as e:
+        record_parse(scan, None, format_error(e))
+        raise
+    record_parse(scan, parsed)
+
+    if cache is not None:
+        cache.set(img, parsed, owner)
+
+    return annotate_canonical([to_api_representation(parsed)], user)[0]
+
+
+def scan_images(images: Sequence[ndarray], user: Any = None) -> list[Union[dict[str, Any], Exception]]:
+    """
+    Scan many receipts with batched inference (only the images missing from the scan cache)
+    :param images: decoded images
+    :param user: owner of the scans (None = don't store the raw output)
+    :return: JSON representation of the receipt or the raised exception, for each image
+    """
+    cache = get_scan_cache()
+    owner = getattr(user, 'pk', None)
+    hits = [cache.lookup(img, owner) if cache is not None else None for img in images]
+    parsed: list[Union[dict[str, Any], Exception, None]] = [None if hit is None else hit.result for hit in hits]
+
+    for img, hit in zip(images, hits):
+        if hit is not None:
+            copy_raw_output(user, img, hit.result, source_hash=hit.image_hash)
+
+    missing = [i for i, result in enumerate(parsed) if result is None]
+    if missing:
+        engine = get_engine()
+        detail = settings.OCR_DETAIL
+        raw_outputs = engine.read_text_batch([images[i] for i in missing], batch_size=settings.OCR_BATCH_SIZE, detail=detail,
+                                             detector=settings.OCR_DETECTOR)
+        for i, raw_output in zip(missing, raw_outputs):
+            if isinstance(raw_output, Exception):
+                parsed[i] = raw_output
+                continue
+
+            scan = _store_output(user, images[i], raw_output, detail)
+            try:
+                parsed[i] = _parse_output(engine, raw_output, detail).to_json()
+            except Exception as e:
+                parsed[i] = e
+                record_parse(scan, None, format_error(e))
+                continue
+
+            record_parse(scan, parsed[i])
+            if cache is not None:
+                cache.set(images[i], parsed[i], owner)
+
+    return annotate_canonical([result if isinstance(result, Exception) else to_api_representation(result) for result in parsed], user)
+
+
+def _store_output(user: Any, img: ndarray, raw_output: Sequence[Any], detail: bool) -> Optional[ReceiptScan]:
+    # Detail mode: the lines are the rows of the boxes, the boxes are kept for re-parsing
+    if detail:
+        lines = [row.text for row in group_rows(raw_output)]
+        return store_raw_output(user, img, lines, boxes=boxes_to_json(raw_output))
+    return store_raw_output(user, img, raw_output)
+
+
+def _parse_output(engine: ReceiptEngine, raw_output: Sequence[Any], detail: bool) -> ReceiptResult:
+    return engine.parse_boxes(raw_output) if detail else engine.parse(raw_output)
+
+
+def to_api_representation(parsed: dict[str, Any]) -> dict[str, Any]:
+    """
+    Convert a scan result to JSON with expenses as negative amounts
+    :param parsed: `ReceiptResult.to_json()` output (modified in place)
+    :return: JSON representation of the receipt
+    """
+    if 'total' in parsed:
+        parsed['total'] = -abs(parsed['total'])
+
+    for item in parsed.get('items', []):
+        item['price'] = -abs(item.get('price', 0))
+
+    return parsed
+
+
+def annotate_canonical(results: list[Any], user: Any = None) -> list[Any]:
+    """
+    Add the canonical product (normalization.py) to every item: `canonical_id` and `canonical_name`.
+    Names of all receipts are looked up together. Only existing canonical products are used - a scan may never be saved,
+    new ones are created with the products. `canonical_id` is None for a product nobody has saved yet.
+    `canonical_name` is the user's own spelling of the product (canonical products are shared by all users),
+    or the first name read for it if the user hasn't bought it yet
+    :param results: API representations (modified in place), exceptions are skipped
+    :param user: owner of the scans
+    :return: results
+    """
+    normalizer = get_normalizer()
+    items = [item for result in results if isinstance(result, dict) for item in result.get('items', [])]
+    items = [item for item in items if item.get('name')]
+    if normalizer is None or not items:
+        return results
+
+    canonical_ids = [None if canonical is None else canonical.id for canonical in normalizer.lookup([item['name'] for item in items])]
+    names = user_canonical_names(user, [canonical_id for canonical_id in canonical_ids if canonical_id is not None])
+    for item, canonical_id in zip(items, canonical_ids):
+        item['canonical_id'] = canonical_id
+        if canonical_id is None:
+            item['canonical_name'] = display_name(item['name'])
+        else:
+            item['canonical_name'] = names.setdefault(canonical_id, display_name(item['name']))
+    return results
+
+
+def transaction_data(parsed: dict[str, Any]) -> dict[str, Any]:
+    """
+    Transaction with products (`TransactionWriteSerializer` input) from a scanned receipt
+    :param parsed: scan result in API representation (expenses as negative amounts)
+    :return: transaction data: date, total_amount, description, products
+    """
+    date = timezone.now()
+    if parsed.get('date'):
+        day = datetime.date.fromisoformat(parsed['date'])
+        time = datetime.time.fromisoformat(parsed['time']) if parsed.get('time') else datetime.time(12)
+        date = timezone.make_aware(datetime.datetime.combine(day, time))
+
+    # One product per line, the price is the line total (unit price * count).
+    # Lines the parser couldn't read a price of are left out, a missing count means a single unit
+    products = [
+        {'name': item['name'][:100], 'price': str((Decimal(str(item['price'])) * (item.get('count') or 1)).quantize(Decimal('0.01')))}
+        for item in parsed.get('items', []) if item.get('price') is not None
+    ]
+    products += [
+        {'name': discount['name'][:100], 'price': str(Decimal(str(discount['amount'])).quantize(Decimal('0.01')))}
+        for discount in parsed.get('discounts', []) if discount.get('amount') is not None
+    ]
+
+    total = parsed.get('total')
+    if total is None:
+        total = sum(Decimal(product['price']) for product in products)
+
+    return {
+        'date': date,
+        'total_amount': str(Decimal(str(total)).quantize(Decimal('0.01'))),
+        'description': f"Paragon ({parsed['payment_method']})" if parsed.get('payment_method') else "Paragon",
+        'products': products,
+    }
@@ -0,0 +1,131 @@
+"""
+Product search tolerant to OCR typos.
+
+1. Candidate names come from a trigram index (migration 0007). On SQLite it's an FTS5 `trigram` table over
+   the distinct product names (`receipts_product_name`, filled by triggers on every product write, so bulk_create
+   and QuerySet.update are covered too). On PostgreSQL a pg_trgm GIN index serves `icontains`.
+   The query is split into trigrams joined with OR, so names sharing only a part of the query ("MASLO" / "MASŁO")
+   are found as well. The index is shared by all users - only names of the user's own products are taken
+   as candidates, ranked by the trigrams they share with the query.
+2. Candidate names are reranked with the same windowed fuzz.ratio scoring the receipt parser uses for keywords
+   (fuzzy.py), so the index only has to return a few hundred distinct spellings, not every purchase.
+3. Purchases of the matched names are read with one query, ordered by score and date.
+
+Note: on SQLite, migrations rebuilding the `receipts_product` table drop its triggers - recreate them there.
+Names of deleted products stay in the index (they match no purchases) until `prune_names()`.
+"""
+from typing import Any
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, IntegerField, Q, QuerySet, Value, When
+from rapidfuzz import fuzz
+
+from .fuzzy import compile_keywords
+from .models import Product
+
+
+def trigrams(query: str) -> list[str]:
+    """
+    Unique trigrams of a lowercased query (in order of occurrence)
+    """
+    query = query.lower()
+    return list(dict.fromkeys(query[i:i + 3] for i in range(len(query) - 2)))
+
+
+def candidate_names(user: Any, query: str, limit: int) -> list[str]:
+    """
+    Distinct names of the user's products sharing the most trigrams with the query (at most `limit`)
+    :param user: owner
+    :param query: search query
+    :param limit: number of candidates
+    :return: list of names
+    """
+    products = Product.objects.filter(transaction__user=user)
+    grams = trigrams(query)
+    if not grams:
+        # Shorter than a trigram
+        return list(products.filter(name__icontains=query).order_by("name").values_list("name", flat=True).distinct()[:limit])
+
+    if connection.vendor == "sqlite":
+        # bm25 rank: names sharing more (and rarer) trigrams first. The user's names are filtered inside the query,
+        # so the limit never cuts off names of the user in favour of other users' names
+        match = " OR ".join('"{}"'.format(gram.replace('"', '""')) for gram in grams)
+        owned, params = products.values("name").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM receipts_product_search WHERE receipts_product_search MATCH %s "
+                f"AND name IN ({owned}) ORDER BY rank LIMIT %s",
+                [match, *params, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    condition = Q()
+    shared = Value(0, output_field=IntegerField())
+    for gram in grams:
+        condition |= Q(name__icontains=gram)
+        shared = shared + Case(When(name__icontains=gram, then=Value(1)), default=Value(0), output_field=IntegerField())
+    names = (
+        products.filter(condition)
+        .annotate(shared=shared)
+        .order_by(F("shared").desc(), "name")
+        .values_list("name", "shared")
+        .distinct()
+    )
+    return [name for name, _ in names[:limit]]
+
+
+def score_names(query: str, names: list[str], threshold: float) -> dict[str, float]:
+    """
+    Fuzzy score of every name: the best window of the name with the query as a keyword,
+    or the whole name if it's shorter than the query
+    :param query: search query
+    :param names: names to score
+    :param threshold: minimal score
+    :return: dict: name -> score, only names reaching the threshold
+    """
+    matcher = compile_keywords((query,), threshold)
+    scores = {}
+    for name in names:
+        score = max(matcher.scan(name).score(query), fuzz.ratio(query.lower(), name.lower()))
+        if score >= threshold:
+            scores[name] = score
+    return scores
+
+
+def search_products(user: Any, query: str, candidates: int = 500, threshold: float = 60) -> QuerySet:
+    """
+    Search the user's purchases by product name
+    :param user: owner
+    :param query: search query
+    :param candidates: number of candidate names taken from the index for reranking
+    :param threshold: minimal fuzzy score (0-100)
+    :return: products annotated with `score`, best matches first, then from the newest transaction
+    """
+    query = " ".join(query.split())
+    scores = score_names(query, candidate_names(user, query, candidates), threshold) if query else {}
+    if not scores:
+        return Product.objects.none()
+
+    score = Case(*(When(name=name, then=Value(value)) for name, value in scores.items()), output_field=FloatField())
+    return (
+        Product.objects
+        .filter(transaction__user=user, name__in=list(scores))
+        .select_related("transaction")
+        .annotate(score=score)
+        .order_by("-score", "-transaction__date", "-id")
+    )
+
+
+def prune_names() -> int:
+    """
+    Remove names without products from the SQLite index
+    :return: number of removed names
+    """
+    if connection.vendor != "sqlite":
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM receipts_product_name WHERE NOT EXISTS "
+            "(SELECT 1 FROM receipts_product p WHERE p.name = receipts_product_name.name)"
+        )
+        return cursor.rowcount
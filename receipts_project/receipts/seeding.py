@@ -0,0 +1,102 @@
+"""
+Synthetic transactions for load testing (`python manage.py seed_data --transactions ...`).
+
+Transactions look like Polish receipts: shopping (groceries, pharmacy, fuel, ...) with products from the shop's
+catalogue, plus regular income. Everything depends only on the seed and the date range, so the same options
+always produce the same dataset.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Iterator
+
+from django.utils import timezone
+
+from .models import Product, Transaction
+
+
+# Shop: products with price ranges (PLN)
+SHOPS: dict[str, list[tuple[str, float, float]]] = {
+    "Zakupy spożywcze": [
+        ("Chleb pszenny", 3.5, 7.0), ("Mleko 3,2%", 2.8, 4.5), ("Masło extra", 6.0, 9.5), ("Jaja L 10 szt.", 9.0, 15.0),
+        ("Ser gouda", 4.0, 8.0), ("Jogurt naturalny", 1.5, 3.5), ("Banany", 4.0, 7.0), ("Jabłka", 2.5, 6.0),
+        ("Pomidory", 6.0, 14.0), ("Woda mineralna 1,5 l", 1.5, 3.0), ("Kawa mielona", 15.0, 35.0),
+        ("Herbata", 5.0, 15.0), ("Cukier 1 kg", 3.5, 6.0), ("Makaron", 3.0, 8.0), ("Ryż", 3.5, 7.0),
+        ("Szynka", 5.0, 12.0), ("Kiełbasa", 8.0, 20.0), ("Czekolada", 3.5, 8.0), ("Sok pomarańczowy", 4.0, 9.0),
+        ("Torba", 0.5, 1.5),
+    ],
+    "Drogeria": [
+        ("Szampon", 9.0, 30.0), ("Pasta do zębów", 6.0, 18.0), ("Mydło", 3.0, 10.0), ("Papier toaletowy", 10.0, 25.0),
+        ("Płyn do naczyń", 5.0, 12.0), ("Proszek do prania", 25.0, 60.0), ("Dezodorant", 10.0, 25.0),
+    ],
+    "Apteka": [
+        ("Witamina C", 8.0, 25.0), ("Ibuprofen", 6.0, 20.0), ("Paracetamol", 4.0, 12.0), ("Maseczki", 5.0, 20.0),
+        ("Plastry", 5.0, 15.0), ("Syrop na kaszel", 12.0, 30.0),
+    ],
+    "Stacja paliw": [
+        ("Benzyna 95", 80.0, 350.0), ("Olej napędowy", 80.0, 400.0), ("Hot dog", 6.0, 12.0), ("Kawa", 7.0, 15.0),
+        ("Płyn do spryskiwaczy", 12.0, 25.0),
+    ],
+    "Restauracja": [
+        ("Obiad dnia", 25.0, 45.0), ("Pizza", 30.0, 60.0), ("Pierogi", 20.0, 35.0), ("Zupa", 12.0, 22.0),
+        ("Napój", 6.0, 14.0), ("Deser", 12.0, 25.0),
+    ],
+    "Zakupy odzieżowe": [
+        ("Koszula", 49.0, 149.0), ("Spodnie", 79.0, 249.0), ("Skarpety", 9.0, 29.0), ("Sweter", 79.0, 199.0),
+        ("Buty", 129.0, 399.0),
+    ],
+    "Elektronika": [
+        ("Słuchawki", 49.0, 599.0), ("Kabel USB-C", 19.0, 59.0), ("Ładowarka", 39.0, 149.0), ("Mysz", 39.0, 199.0),
+    ],
+}
+SHOP_WEIGHTS = [55, 10, 6, 10, 10, 5, 4]
+
+# Income: products (parts of the payment) with ranges
+INCOME: dict[str, list[tuple[str, float, float]]] = {
+    "Wypłata miesięczna": [("Pensja podstawowa", 4500.0, 9000.0), ("Premia", 200.0, 1500.0)],
+    "Zwrot": [("Zwrot towaru", 20.0, 300.0)],
+    "Przelew przychodzący": [("Przelew", 50.0, 1000.0)],
+}
+INCOME_RATIO = 0.05
+
+
+def _amount(rng: random.Random, low: float, high: float) -> Decimal:
+    return Decimal(rng.randint(round(low * 100), round(high * 100))) / 100
+
+
+def synthetic_transactions(rng: random.Random, user_id: int, count: int, products_per_tx: int,
+                           first_day: date, last_day: date) -> Iterator[tuple[Transaction, list[Product]]]:
+    """
+    Generate unsaved transactions with their products
+    :param rng: random generator (seeded)
+    :param user_id: owner
+    :param count: number of transactions
+    :param products_per_tx: average number of products of a purchase (0 = transactions without products)
+    :param first_day: first day of the history
+    :param last_day: last day of the history
+    :return: iterator of (transaction, products) - products get the transaction assigned after it is saved
+    """
+    days = (last_day - first_day).days + 1
+    shops = list(SHOPS)
+    tz = timezone.get_current_timezone()
+
+    for _ in range(count):
+        day = first_day + timedelta(days=rng.randrange(days))
+        moment = datetime.combine(day, time(rng.randint(7, 21), rng.randrange(60), rng.randrange(60)), tzinfo=tz)
+
+        if rng.random() < INCOME_RATIO:
+            description = rng.choice(list(INCOME))
+            products = [Product(name=name, price=_amount(rng, low, high)) for name, low, high in INCOME[description]]
+        else:
+            description = rng.choices(shops, weights=SHOP_WEIGHTS)[0]
+            catalogue = SHOPS[description]
+            number = rng.randint(1, max(1, 2 * products_per_tx - 1))
+            products = [
+                Product(name=name, price=-_amount(rng, low, high))
+                for name, low, high in (rng.choice(catalogue) for _ in range(number))
+            ]
+
+        total = sum((product.price for product in products), Decimal(0))
+        if products_per_tx <= 0:
+            products = []
+        yield Transaction(user_id=user_id, date=moment, total_amount=total, description=description), products
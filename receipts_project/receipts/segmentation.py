@@ -0,0 +1,150 @@
+"""
+Lightweight text detector for receipts: binarization and projection profiles instead of the CRAFT network.
+
+A receipt is a single column of horizontal text, left and right aligned, on plain paper:
+1. Text lines are runs of image rows containing ink (horizontal projection profile). Runs separated by a small gap
+   (diacritics above capitals) are merged, runs much taller than the median line (touching lines) are split
+   at the rows with the least ink.
+2. Fragments of a line (name, quantity, amounts) are runs of columns containing ink, separated by gaps wider
+   than the line height - spaces between words are narrower, so words of a fragment stay together.
+
+Everything is a handful of NumPy reductions over the binary image - milliseconds on a CPU, where CRAFT takes
+seconds at `canvas_size=5000`. It needs a clean, straight receipt (scans, or photos after `ReceiptPreprocessor`):
+a photo with background, shadows or folds should keep the CRAFT detector.
+"""
+from typing import Optional
+
+import numpy as np
+from numpy import ndarray
+
+from .layout import DetectedBox
+from .preprocessing import ReceiptPreprocessor
+
+
+def _runs(mask: ndarray) -> tuple[ndarray, ndarray]:
+    """
+    Starts and ends (exclusive) of the runs of True values
+    """
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return edges[::2], edges[1::2]
+
+
+class ProjectionSegmenter:
+    """
+    Finds text lines and their fragments with projection profiles: `segmenter(gray) -> rows of DetectedBox`
+    """
+
+    def __init__(self, min_ink_ratio: float = 0.002, min_height: int = 4, merge_gap: float = 0.35,
+                 split_height: float = 1.7, fragment_gap: float = 1.0, margin: float = 0.15):
+        """
+        :param min_ink_ratio: minimum share of ink pixels for an image row to count as text
+        :param min_height: minimum height (px) of a text line (shorter runs are noise)
+        :param merge_gap: runs closer than this (relative to the median line height) are one line
+        :param split_height: lines taller than this (relative to the median line height) are split
+        :param fragment_gap: column gaps wider than this (relative to the line height) split a line into fragments
+        :param margin: padding added around every fragment (relative to the line height)
+        """
+        self.min_ink_ratio = min_ink_ratio
+        self.min_height = min_height
+        self.merge_gap = merge_gap
+        self.split_height = split_height
+        self.fragment_gap = fragment_gap
+        self.margin = margin
+
+    def __call__(self, gray: ndarray) -> list[list[DetectedBox]]:
+        """
+        Segment an image into text lines
+        :param gray: grayscale image of a receipt (cropped and deskewed)
+        :return: rows of boxes top to bottom, boxes of a row left to right
+        """
+        if gray is None or gray.size == 0:
+            raise ValueError('Invalid numpy array')
+
+        ink = ReceiptPreprocessor.binarize(ReceiptPreprocessor.to_grayscale(gray)) > 0
+        profile = ink.sum(axis=1)
+        rows = []
+        for top, bottom in self.lines(profile, ink.shape[1]):
+            boxes = self.fragments(ink[top:bottom], top, ink.shape[0])
+            if boxes:
+                rows.append(boxes)
+        return rows
+
+    def lines(self, profile: ndarray, width: int) -> list[tuple[int, int]]:
+        """
+        Text lines from the horizontal projection profile
+        :param profile: number of ink pixels of every image row
+        :param width: image width
+        :return: list of (top, bottom) rows, bottom exclusive
+        """
+        starts, ends = _runs(profile >= max(1.0, self.min_ink_ratio * width))
+        if not len(starts):
+            return []
+
+        height = self._median_height(starts, ends)
+        if height is None:
+            return []
+
+        # Diacritics and thin strokes separated by a gap of a few rows belong to the line below/above
+        merged: list[list[int]] = [[int(starts[0]), int(ends[0])]]
+        for start, end in zip(starts[1:], ends[1:]):
+            if start - merged[-1][1] <= self.merge_gap * height:
+                merged[-1][1] = int(end)
+            else:
+                merged.append([int(start), int(end)])
+
+        lines = []
+        for top, bottom in merged:
+            if bottom - top < max(self.min_height, 0.4 * height):
+                continue
+            lines.extend(self._split(profile, top, bottom, height))
+        return lines
+
+    def _median_height(self, starts: ndarray, ends: ndarray) -> Optional[float]:
+        heights = ends - starts
+        heights = heights[heights >= self.min_height]
+        return float(np.median(heights)) if len(heights) else None
+
+    def _split(self, profile: ndarray, top: int, bottom: int, height: float) -> list[tuple[int, int]]:
+        # Touching lines: cut at the row with the least ink near every expected boundary
+        count = round((bottom - top) / height)
+        if bottom - top <= self.split_height * height or count < 2:
+            return [(top, bottom)]
+
+        cuts = [top]
+        step = (bottom - top) / count
+        for k in range(1, count):
+            expected = int(top + k * step)
+            lo, hi = max(cuts[-1] + 1, expected - int(step / 3)), min(bottom - 1, expected + int(step / 3) + 1)
+            cuts.append(lo + int(np.argmin(profile[lo:hi])) if hi > lo else expected)
+        cuts.append(bottom)
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def fragments(self, band: ndarray, top: int, image_height: int) -> list[DetectedBox]:
+        """
+        Fragments of a text line from its vertical projection profile
+        :param band: binary image rows of the line
+        :param top: first row of the line in the image
+        :param image_height: height of the image
+        :return: boxes left to right
+        """
+        height, width = band.shape
+        bottom = top + height
+        starts, ends = _runs(band.any(axis=0))
+        if not len(starts):
+            return []
+
+        # Join the words of a fragment: only gaps wider than `fragment_gap` line heights separate fragments
+        gaps = starts[1:] - ends[:-1]
+        breaks = np.flatnonzero(gaps > self.fragment_gap * height)
+        first = np.concatenate(([0], breaks + 1))
+        last = np.concatenate((breaks, [len(starts) - 1]))
+
+        pad = int(round(self.margin * height))
+        boxes = []
+        for i, j in zip(first, last):
+            x0, x1 = int(starts[i]), int(ends[j])
+            if band[:, x0:x1].sum() < self.min_height:
+                continue  # Speck of dirt
+            boxes.append(DetectedBox(max(0, x0 - pad), min(width, x1 + pad), max(0, top - pad), min(image_height, bottom + pad)))
+        return boxes
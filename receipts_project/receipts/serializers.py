@@ -1,10 +1,20 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import Transaction, Product
+from .models import Transaction, Product, ScanJob
+from .normalization import assign_canonical
 
 class ProductSerializer(serializers.ModelSerializer[Product]):
     class Meta:
         model = Product
-        fields: list[str] = ["id", "name", "price", "transaction"]
+        fields: list[str] = ["id", "name", "price", "transaction", "canonical"]
+        read_only_fields = ["canonical"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Products can only be attached to transactions of the requesting user
+        request = self.context.get("request")
+        if request is not None and "transaction" in self.fields:
+            self.fields["transaction"].queryset = Transaction.objects.filter(user=request.user)
 
 
 class TransactionSerializer(serializers.ModelSerializer[Transaction]):
@@ -12,4 +22,43 @@ class TransactionSerializer(serializers.ModelSerializer[Transaction]):
 
     class Meta:
         model = Transaction
-        fields = ["id", "date", "total_amount", "description", "products"]
\ No newline at end of file
+        fields = ["id", "date", "total_amount", "description", "products"]
+
+
+class TransactionProductSerializer(serializers.ModelSerializer[Product]):
+    """
+    Product nested in a transaction (the transaction is set by the parent serializer)
+    """
+    class Meta:
+        model = Product
+        fields = ["id", "name", "price"]
+
+
+class TransactionWriteSerializer(serializers.ModelSerializer[Transaction]):
+    """
+    Transaction created together with its products: one INSERT for the transaction and one bulk INSERT
+    for the products, in a single database transaction
+    """
+    products = TransactionProductSerializer(many=True, required=False)
+
+    class Meta:
+        model = Transaction
+        fields = ["id", "date", "total_amount", "description", "products"]
+
+    def create(self, validated_data):
+        products = validated_data.pop("products", [])
+        with transaction.atomic():
+            tx = Transaction.objects.create(**validated_data)
+            products = [Product(transaction=tx, **product) for product in products]
+            assign_canonical(products)
+            Product.objects.bulk_create(products)
+        return tx
+
+    def to_representation(self, instance):
+        return TransactionSerializer(instance).data
+
+
+class ScanJobSerializer(serializers.ModelSerializer[ScanJob]):
+    class Meta:
+        model = ScanJob
+        fields = ["id", "status", "result", "error", "created_at", "started_at", "finished_at"]
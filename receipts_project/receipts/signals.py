@@ -0,0 +1,70 @@
+"""
+Keeps the daily spending rollup (rollups.py) in sync with transactions and assigns canonical products (normalization.py)
+"""
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import rollups
+from .models import Product, Transaction
+from .normalization import assign_canonical
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_values(sender, instance: Transaction, raw: bool = False, **kwargs) -> None:
+    # Values before the update - the old day has to be decreased
+    instance._rollup_previous = None
+    if raw or instance.pk is None or instance._state.adding:
+        return
+    instance._rollup_previous = (
+        Transaction.objects.filter(pk=instance.pk).values_list("user_id", "date", "total_amount").first()
+    )
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollup_on_save(sender, instance: Transaction, raw: bool = False, **kwargs) -> None:
+    if raw:
+        return
+
+    previous = getattr(instance, "_rollup_previous", None)
+    current = (instance.user_id, instance.date, instance.total_amount)
+    if previous is not None:
+        if previous == current:
+            return
+        rollups.remove_transaction(*previous)
+    rollups.add_transaction(*current)
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollup_on_delete(sender, instance: Transaction, **kwargs) -> None:
+    rollups.remove_transaction(instance.user_id, instance.date, instance.total_amount)
+
+
+@receiver(pre_save, sender=Product)
+def normalize_product_name(sender, instance: Product, raw: bool = False, update_fields=None, **kwargs) -> None:
+    # Bulk writes (bulk_create/bulk_update) call assign_canonical themselves
+    if raw or (update_fields is not None and "name" not in update_fields):
+        return
+    assign_canonical([instance])
+
+
+@contextmanager
+def paused() -> Iterator[None]:
+    """
+    Disconnect the rollup handlers (process-wide) - for mass changes followed by `rollups.rebuild`
+    in management commands. Without a post_delete receiver Django doesn't send a signal per deleted transaction
+    """
+    handlers = [
+        (pre_save, remember_previous_values),
+        (post_save, update_rollup_on_save),
+        (post_delete, update_rollup_on_delete),
+    ]
+    for signal, handler in handlers:
+        signal.disconnect(handler, sender=Transaction)
+    try:
+        yield
+    finally:
+        for signal, handler in handlers:
+            signal.connect(handler, sender=Transaction)
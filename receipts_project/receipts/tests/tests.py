@@ -1,11 +1,14 @@
 from typing import Any
+from unittest import mock
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from django.urls import reverse
 from rest_framework import status
 from django.utils import timezone
-from datetime import timezone as dt_timezone
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
 
 class AuthenticatedAPITestCase(APITestCase):
     """
@@ -25,11 +28,53 @@ class AuthenticatedAPITestCase(APITestCase):
 
 
 class TransactionAPITests(AuthenticatedAPITestCase):
+    def create_transactions(self, count: int, products: int = 2) -> None:
+        from ..models import Product, Transaction
+
+        date = timezone.now()
+        transactions = Transaction.objects.bulk_create([
+            # Pairs of transactions share a date, so the pages have to break ties by id
+            Transaction(user=self.user, date=date - timedelta(hours=i // 2), total_amount=-10, description=f"Tx {i}")
+            for i in range(count)
+        ])
+        Product.objects.bulk_create([
+            Product(name=f"Produkt {j}", price=-5, transaction=tx)
+            for tx in transactions for j in range(products)
+        ])
+
     def test_list_transactions(self) -> None:
         url = reverse("tx-list")
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_transactions_pages(self) -> None:
+        from ..models import Transaction
+
+        self.create_transactions(7)
+        expected = list(Transaction.objects.order_by("-date", "-id").values_list("id", flat=True))
+
+        seen, url = [], reverse("tx-list") + "?page_size=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.json()["results"]), 3)
+            seen += [tx["id"] for tx in response.json()["results"]]
+            url = response.json()["next"]
+
+        self.assertEqual(seen, expected)
+
+    def test_list_transactions_constant_queries(self) -> None:
+        # Token lookup, page of transactions, products of the page
+        for count in (1, 40):
+            self.create_transactions(count)
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse("tx-list"), {"page_size": 100})
+            self.assertEqual(len(response.json()["results"][0]["products"]), 2)
+
+    def test_list_transactions_invalid_cursor(self) -> None:
+        response = self.client.get(reverse("tx-list"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_create_transaction(self) -> None:
         url = reverse("tx-list")
         payload: dict[str, Any] = {
@@ -40,12 +85,110 @@ class TransactionAPITests(AuthenticatedAPITestCase):
         response = self.client.post(url, payload, format="json")
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_create_transaction_with_products(self) -> None:
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from ..models import Transaction
+
+        # Products are inserted with one bulk INSERT - the number of queries doesn't depend on their number
+        queries = []
+        for days, count in ((1, 1), (2, 30)):
+            payload: dict[str, Any] = {
+                # Separate days, so both requests create their rollup row
+                "date": (timezone.now() - timedelta(days=days)).isoformat(),
+                "total_amount": "-15.00",
+                "products": [{"name": f"Produkt {i}", "price": "-0.50"} for i in range(count)],
+            }
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(reverse("tx-list"), payload, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.json()["products"]), count)
+            self.assertEqual(Transaction.objects.get(pk=response.json()["id"]).products.count(), count)
+            queries.append(len(context))
+
+        self.assertEqual(queries[0], queries[1])
+
+    def test_create_transaction_with_invalid_product(self) -> None:
+        from ..models import Product, Transaction
+
+        payload: dict[str, Any] = {
+            "date": timezone.now().isoformat(),
+            "total_amount": "-15.00",
+            "products": [{"name": "Mleko", "price": "-5.00"}, {"name": "Chleb", "price": "abc"}],
+        }
+        response = self.client.post(reverse("tx-list"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("products", response.json())
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Product.objects.exists())
+
+
+class TransactionExportAPITests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from ..models import Product, Transaction
+
+        self.transactions = [
+            Transaction.objects.create(user=self.user, date=timezone.datetime(2025, 6, day, 12, tzinfo=dt_timezone.utc), total_amount=-day, description=f"Tx {day}")
+            for day in (1, 2, 3, 4, 5)
+        ]
+        for tx in self.transactions[:4]:
+            Product.objects.create(name="Chleb", price=-1, transaction=tx)
+            Product.objects.create(name="Masło, extra", price=-2, transaction=tx)
+
+    def export(self, **params: str) -> Any:
+        response = self.client.get(reverse("tx-export"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_export(self) -> None:
+        import json
+
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response, content = self.export()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [tx.pk for tx in self.transactions])
+        self.assertEqual([p["name"] for p in rows[0]["products"]], ["Chleb", "Masło, extra"])
+        self.assertEqual(rows[4]["products"], [])
+        self.assertEqual(rows[0]["total_amount"], "-1.00")
+
+    def test_csv_export(self) -> None:
+        import csv
+        import io
+
+        with self.settings(EXPORT_CHUNK_SIZE=3):
+            response, content = self.export(type="csv")
+
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0][0], "transaction_id")
+        self.assertEqual(len(rows), 1 + 4 * 2 + 1)
+        self.assertEqual(rows[2][5], "Masło, extra")
+        self.assertEqual(rows[-1][4:], ["", "", ""])
+
+    def test_export_date_range(self) -> None:
+        import json
+
+        _, content = self.export(date_from="2025-06-02", date_to="2025-06-03")
+
+        ids = [json.loads(line)["id"] for line in content.splitlines()]
+        self.assertEqual(ids, [tx.pk for tx in self.transactions[1:3]])
+
+    def test_export_invalid_params(self) -> None:
+        for params in ({"type": "xml"}, {"date_from": "yesterday"}):
+            response = self.client.get(reverse("tx-export"), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class TransactionDetailAPITests(AuthenticatedAPITestCase):
     def setUp(self) -> None:
         super().setUp()
         from ..models import Transaction
         self.tx = Transaction.objects.create(
+            user=self.user,
             date=timezone.now(),
             total_amount=50.0,
             description="Init"
@@ -78,6 +221,7 @@ class ProductAPITests(AuthenticatedAPITestCase):
         super().setUp()
         from ..models import Transaction
         self.tx = Transaction.objects.create(
+            user=self.user,
             date=timezone.now(),
             total_amount=20.0,
             description="Init"
@@ -99,18 +243,600 @@ class ProductAPITests(AuthenticatedAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
 
+class ProductSearchAPITests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from ..models import Product, Transaction
+
+        self.old = Transaction.objects.create(user=self.user, date=timezone.now() - timedelta(days=3), total_amount=-30)
+        self.new = Transaction.objects.create(user=self.user, date=timezone.now(), total_amount=-30)
+        # bulk_create doesn't send signals - the index is filled by database triggers
+        Product.objects.bulk_create([
+            Product(transaction=self.old, name="MASŁO EXTRA", price=-8),
+            Product(transaction=self.new, name="MASLO EKSTRA", price=-8),
+            Product(transaction=self.new, name="Mleko 3,2%", price=-4),
+            Product(transaction=self.new, name="Chleb", price=-5),
+        ])
+
+    def search(self, **params: Any) -> dict[str, Any]:
+        response = self.client.get(reverse("prod-search"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_search_tolerates_ocr_typos(self) -> None:
+        results = self.search(q="MA5ŁO EXTRA")["results"]
+        self.assertEqual([item["name"] for item in results], ["MASŁO EXTRA", "MASLO EKSTRA"])
+        self.assertGreater(results[0]["score"], results[1]["score"])
+        self.assertEqual(results[0]["transaction"], self.old.pk)
+
+    def test_search_ranks_newest_first_on_equal_score(self) -> None:
+        from ..models import Product
+
+        Product.objects.create(transaction=self.old, name="Chleb", price=-4)
+        results = self.search(q="chleb")["results"]
+        self.assertEqual([item["transaction"] for item in results], [self.new.pk, self.old.pk])
+
+    def test_search_follows_product_writes(self) -> None:
+        from ..models import Product
+
+        self.assertEqual(self.search(q="ser gouda")["results"], [])
+        Product.objects.filter(name="Chleb").update(name="Ser gouda")
+        self.assertEqual([item["name"] for item in self.search(q="ser gouda")["results"]], ["Ser gouda"])
+
+    def test_search_is_scoped_to_user(self) -> None:
+        from ..models import Product, Transaction
+
+        other = get_user_model().objects.create_user(username="other", password="password123")
+        tx = Transaction.objects.create(user=other, date=timezone.now(), total_amount=-1)
+        Product.objects.create(transaction=tx, name="Kawa mielona", price=-1)
+        self.assertEqual(self.search(q="kawa")["results"], [])
+
+    def test_candidates_are_limited_to_user_names(self) -> None:
+        from ..models import Product, Transaction
+        from ..search import candidate_names
+
+        other = get_user_model().objects.create_user(username="other", password="password123")
+        tx = Transaction.objects.create(user=other, date=timezone.now(), total_amount=-1)
+        Product.objects.bulk_create([Product(transaction=tx, name=f"Kawa mielona {i}", price=-1) for i in range(5)])
+        Product.objects.create(transaction=self.new, name="Kawa ziarnista", price=-1)
+
+        for vendor in ("sqlite", "postgresql"):
+            # The ORM path (pg_trgm) runs on any database
+            with self.subTest(vendor=vendor), mock.patch("receipts.search.connection.vendor", vendor):
+                self.assertEqual(candidate_names(self.user, "kawa", 2), ["Kawa ziarnista"])
+                self.assertEqual(candidate_names(other, "kawa mielona 3", 1), ["Kawa mielona 3"])
+                self.assertEqual(candidate_names(self.user, "ka", 5), ["Kawa ziarnista"])
+
+        with self.settings(PRODUCT_SEARCH_CANDIDATES=2):
+            self.assertEqual([item["name"] for item in self.search(q="kawa")["results"]], ["Kawa ziarnista"])
+
+    def test_search_pages(self) -> None:
+        first = self.search(q="masło", page_size=1)
+        self.assertEqual(len(first["results"]), 1)
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(len(second["results"]), 1)
+        self.assertIsNone(second["next"])
+        self.assertNotEqual(first["results"][0]["id"], second["results"][0]["id"])
+
+    def test_search_requires_query(self) -> None:
+        response = self.client.get(reverse("prod-search"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkAPITests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from ..models import Product, Transaction
+        self.tx = Transaction.objects.create(
+            user=self.user,
+            date=timezone.datetime(2024, 1, 1, 10, 0, tzinfo=dt_timezone.utc),
+            total_amount=-20,
+        )
+        self.products = [
+            Product.objects.create(transaction=self.tx, name=name, price=-10) for name in ("Mleko", "Chleb")
+        ]
+
+    def test_bulk_products(self) -> None:
+        from ..models import Product
+
+        payload = {
+            "upsert": [
+                {"id": self.products[0].pk, "name": "Mleko 2%", "price": "-4.50", "transaction": self.tx.pk},
+                {"name": "Masło", "price": "-7.99", "transaction": self.tx.pk},
+            ],
+            "delete": [self.products[1].pk],
+        }
+        response = self.client.post(reverse("prod-bulk"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["name"] for item in response.json()["upsert"]], ["Mleko 2%", "Masło"])
+        self.assertEqual(response.json()["delete"], [self.products[1].pk])
+        self.assertEqual(
+            sorted(Product.objects.values_list("name", "price")),
+            [("Masło", Decimal("-7.99")), ("Mleko 2%", Decimal("-4.50"))]
+        )
+
+    def test_bulk_products_constant_queries(self) -> None:
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        queries = []
+        for count in (1, 50):
+            payload = {"upsert": [{"name": f"P{i}", "price": "-1.00", "transaction": self.tx.pk} for i in range(count)]}
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(reverse("prod-bulk"), payload, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_bulk_errors_per_item(self) -> None:
+        from ..models import Product, Transaction
+
+        other = get_user_model().objects.create_user(username="other", password="password123")
+        foreign = Transaction.objects.create(user=other, date=timezone.now(), total_amount=-1)
+        foreign_product = Product.objects.create(transaction=foreign, name="Obcy", price=-1)
+
+        payload = {
+            "upsert": [
+                {"name": "Masło", "price": "-7.99", "transaction": self.tx.pk},
+                {"name": "Ser", "price": "abc", "transaction": self.tx.pk},
+                {"id": foreign_product.pk, "name": "X", "price": "-1.00", "transaction": self.tx.pk},
+                {"name": "Y", "price": "-1.00", "transaction": foreign.pk},
+            ],
+            "delete": [self.products[0].pk, 999999],
+        }
+        response = self.client.post(reverse("prod-bulk"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        errors = response.json()
+        self.assertEqual(errors["upsert"][0], {})
+        self.assertEqual(list(errors["upsert"][1]), ["price"])
+        self.assertEqual(list(errors["upsert"][2]), ["id"])
+        self.assertEqual(list(errors["upsert"][3]), ["transaction"])
+        self.assertEqual(errors["delete"][0], {})
+        self.assertIn("id", errors["delete"][1])
+
+        # Nothing is applied when any item is invalid
+        self.assertEqual(Product.objects.filter(transaction=self.tx).count(), 2)
+        self.assertFalse(Product.objects.filter(name="Masło").exists())
+
+    def test_bulk_rejects_too_many_items(self) -> None:
+        with self.settings(BULK_MAX_ITEMS=2):
+            response = self.client.post(reverse("prod-bulk"), {"delete": [1, 2, 3]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_transactions_refresh_rollup(self) -> None:
+        from ..models import DailySpending, Transaction
+        from ..rollups import rebuild
+
+        second = Transaction.objects.create(
+            user=self.user, date=timezone.datetime(2024, 1, 2, 10, 0, tzinfo=dt_timezone.utc), total_amount=-5
+        )
+        payload = {
+            "upsert": [
+                {"id": self.tx.pk, "date": "2024-01-03T10:00:00Z", "total_amount": "-25.00", "description": ""},
+                {"date": "2024-01-03T12:00:00Z", "total_amount": "100.00", "description": "Wypłata"},
+            ],
+            "delete": [second.pk],
+        }
+        response = self.client.post(reverse("tx-bulk"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()["upsert"][0]["products"]), 2)
+
+        rollup = list(DailySpending.objects.order_by("day").values_list("day", "income", "expense", "count"))
+        self.assertEqual([(day.isoformat(), income, expense, count) for day, income, expense, count in rollup],
+                         [("2024-01-03", Decimal("100.00"), Decimal("-25.00"), 2)])
+        rebuild()
+        self.assertEqual(list(DailySpending.objects.order_by("day").values_list("day", "income", "expense", "count")), rollup)
+
+
+def make_image_upload(name: str = "receipt.png", size: tuple[int, int] = (30, 40)) -> SimpleUploadedFile:
+    import cv2
+    import numpy as np
+
+    extension = name[name.rindex("."):]
+    width, height = size
+    _, encoded = cv2.imencode(extension, np.full((height, width, 3), 255, dtype=np.uint8))
+    return SimpleUploadedFile(name, encoded.tobytes(), content_type=f"image/{extension[1:]}")
+
+
 class ReceiptScanAPITests(AuthenticatedAPITestCase):
     def test_receipt_scan_not_implemented(self) -> None:
         url = reverse("receipt-scan")
         response = self.client.post(url, {}, format="multipart")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_receipt_scan_invalid_image(self) -> None:
+        url = reverse("receipt-scan")
+        upload = SimpleUploadedFile("receipt.png", b"not an image", content_type="image/png")
+        response = self.client.post(url, {"image": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_repeated_scan_served_from_cache(self) -> None:
+        from ..ocr import ReceiptEngine
+        from ..ocr_pool import ReaderPool
+        from ..scan_cache import DjangoScanCache, set_scan_cache
+        from .tests_ocr import FakeReader, RECEIPT_RAW_OUTPUT
+
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+        cache = DjangoScanCache()
+        cache.clear()
+        set_scan_cache(cache)
+        self.addCleanup(set_scan_cache, None)
+
+        with mock.patch("receipts.scanning.get_engine", return_value=engine):
+            responses = [
+                self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+                for _ in range(2)
+            ]
+
+        self.assertEqual([r.status_code for r in responses], [status.HTTP_200_OK] * 2)
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(responses[1].json()["total"], -91.88)
+        self.assertEqual(reader.calls, 1)
+
+    def test_django_scan_cache_clear_keeps_other_entries(self) -> None:
+        import numpy as np
+        from django.core.cache import cache as default_cache
+        from ..scan_cache import DjangoScanCache
+
+        image = np.zeros((8, 8), dtype=np.uint8)
+        cache = DjangoScanCache()
+        cache.set(image, {"total": 1.0})
+        default_cache.set("unrelated", "kept")
+
+        cache.clear()
+
+        self.assertIsNone(cache.get(image))
+        self.assertEqual(default_cache.get("unrelated"), "kept")
+        cache.set(image, {"total": 2.0})
+        self.assertEqual(cache.get(image), {"total": 2.0})
+
+    def test_upload_is_streamed_to_disk_and_decoded_reduced(self) -> None:
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+        from django.test import override_settings
+        from ..uploads import open_upload
+
+        uploads = []
+
+        def spy(upload):
+            uploads.append(upload)
+            return open_upload(upload)
+
+        with override_settings(OCR_DECODE_MIN_SIDE=500), mock.patch("receipts.views.open_upload", side_effect=spy), \
+                mock.patch("receipts.views.scan_image", return_value={"items": []}) as scan:
+            response = self.client.post(
+                reverse("receipt-scan"), {"image": make_image_upload("receipt.jpg", size=(1700, 900))}, format="multipart"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(uploads[0], TemporaryUploadedFile)
+        # Grayscale, 1/4 of the resolution would make the longer side shorter than 500 px - 1/2 is used
+        self.assertEqual(scan.call_args.args[0].shape, (450, 850))
+
+    def test_oversized_upload_rejected_before_decoding(self) -> None:
+        from django.test import override_settings
+
+        with override_settings(OCR_MAX_UPLOAD_SIZE=100), mock.patch("receipts.scanning.cv2.imdecode") as imdecode:
+            response = self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("za duży", response.json()["detail"])
+        imdecode.assert_not_called()
+
+    def test_async_scan_rejects_non_images(self) -> None:
+        from ..models import ScanJob
+
+        upload = SimpleUploadedFile("receipt.png", b"not an image", content_type="image/png")
+        response = self.client.post(reverse("receipt-scan") + "?mode=async", {"image": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ScanJob.objects.exists())
+
+    def scan_engine(self):
+        from ..ocr import ReceiptEngine
+        from ..ocr_pool import ReaderPool
+        from .tests_ocr import FakeReader, RECEIPT_RAW_OUTPUT
+
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        return ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+
+    def test_scan_and_save(self) -> None:
+        from ..models import Transaction
+
+        with mock.patch("receipts.scanning.get_engine", return_value=self.scan_engine()):
+            response = self.client.post(
+                reverse("receipt-scan") + "?save=1", {"image": make_image_upload()}, format="multipart"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["scan"]["total"], -91.88)
+
+        tx = Transaction.objects.get(user=self.user)
+        self.assertEqual(response.json()["transaction"]["id"], tx.pk)
+        self.assertEqual(str(tx.total_amount), "-91.88")
+        self.assertEqual(timezone.localtime(tx.date).strftime("%Y-%m-%d %H:%M"), "2025-03-04 14:32")
+        self.assertEqual(
+            sorted(tx.products.values_list("name", "price")),
+            [("SVETER", Decimal("-79.90")), ("TORBA", Decimal("-11.98"))]
+        )
+
+    def test_scan_and_save_items_without_count_or_price(self) -> None:
+        from ..models import Transaction
+
+        parsed = {
+            "date": "2025-03-04", "time": "14:32", "total": None, "payment_method": None, "discounts": [],
+            "items": [{"name": "CHLEB", "price": -4.5, "count": None}, {"name": "???", "price": None, "count": 1}],
+        }
+        with mock.patch("receipts.views.scan_image", return_value=parsed):
+            response = self.client.post(
+                reverse("receipt-scan") + "?save=1", {"image": make_image_upload()}, format="multipart"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        tx = Transaction.objects.get(user=self.user)
+        self.assertEqual(list(tx.products.values_list("name", "price")), [("CHLEB", Decimal("-4.50"))])
+        self.assertEqual(tx.total_amount, Decimal("-4.50"))
+
+    def test_scan_and_save_rejected_in_async_mode(self) -> None:
+        from ..models import ScanJob
+
+        response = self.client.post(
+            reverse("receipt-scan") + "?mode=async&save=1", {"image": make_image_upload()}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ScanJob.objects.exists())
+
+
+class ReceiptBatchScanAPITests(AuthenticatedAPITestCase):
+    def test_batch_scan_reports_per_image_results(self) -> None:
+        from ..ocr import ReceiptEngine
+        from ..ocr_pool import ReaderPool
+        from .tests_ocr import FakeReader, RECEIPT_RAW_OUTPUT
+
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT))
+        images = [
+            make_image_upload("a.png"),
+            SimpleUploadedFile("b.png", b"not an image", content_type="image/png"),
+            make_image_upload("c.png"),
+        ]
+
+        with mock.patch("receipts.scanning.get_engine", return_value=ReceiptEngine(reader_pool=pool)):
+            response = self.client.post(reverse("receipt-scan-batch"), {"images": images}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["status"] for r in response.json()], ["ok", "error", "ok"])
+        self.assertEqual(response.json()[0]["result"]["total"], -91.88)
+        self.assertEqual(response.json()[1]["filename"], "b.png")
+
+    def test_batch_scan_rejects_unsupported_and_oversized_files(self) -> None:
+        from django.test import override_settings
+
+        images = [
+            SimpleUploadedFile("a.gif", b"GIF89a" + bytes(100), content_type="image/gif"),
+            make_image_upload("b.png", size=(300, 200)),
+        ]
+        with override_settings(OCR_MAX_IMAGE_PIXELS=50_000), mock.patch("receipts.views.scan_images", return_value=[]) as scan:
+            response = self.client.post(reverse("receipt-scan-batch"), {"images": images}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("nieobsługiwany format", response.json()[0]["detail"])
+        self.assertIn("pikseli", response.json()[1]["detail"])
+        scan.assert_called_once_with([], user=self.user)
+
+    def test_batch_scan_without_images(self) -> None:
+        response = self.client.post(reverse("receipt-scan-batch"), {}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReceiptScanJobAPITests(AuthenticatedAPITestCase):
+    parsed = {"date": None, "time": None, "total": -1.0, "payment_method": None, "items": [], "discounts": []}
+
+    def test_async_scan_returns_job(self) -> None:
+        from ..models import ScanJob
+
+        url = reverse("receipt-scan") + "?mode=async"
+        response = self.client.post(url, {"image": make_image_upload()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()["status"], ScanJob.Status.PENDING)
+
+        job = ScanJob.objects.get(pk=response.json()["id"])
+        self.assertEqual(job.user, self.user)
+        self.assertTrue(bytes(job.image))
+
+    def test_worker_processes_job(self) -> None:
+        from ..jobs import work
+
+        url = reverse("receipt-scan") + "?mode=async"
+        job_id = self.client.post(url, {"image": make_image_upload()}, format="multipart").json()["id"]
+
+        with mock.patch("receipts.jobs.scan_image", return_value=self.parsed):
+            self.assertEqual(work(burst=True), 1)
+
+        response = self.client.get(reverse("receipt-scan-job", args=[job_id]), {"wait": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], "done")
+        self.assertEqual(response.json()["result"], self.parsed)
+
+    def test_worker_records_errors(self) -> None:
+        from ..jobs import enqueue_scan, work
+
+        job = enqueue_scan(self.user, b"not an image")
+        work(burst=True)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, "failed")
+        self.assertIn("zdekodować", job.error)
+        self.assertEqual(bytes(job.image), b"")
+
+    def test_job_claimed_once(self) -> None:
+        from ..jobs import enqueue_scan, claim_next_job
+
+        enqueue_scan(self.user, b"x")
+        self.assertIsNotNone(claim_next_job())
+        self.assertIsNone(claim_next_job())
+
+    def test_worker_requeues_stale_jobs(self) -> None:
+        from ..jobs import enqueue_scan, claim_next_job, work
+        from ..models import ScanJob
+
+        job = enqueue_scan(self.user, b"x")
+        claim_next_job()
+        ScanJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+
+        with mock.patch("receipts.jobs.scan_image", return_value=self.parsed), \
+                mock.patch("receipts.jobs.decode_image"):
+            self.assertEqual(work(burst=True, stale_after=timedelta(minutes=10)), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScanJob.Status.DONE)
+
+    def test_other_users_job_not_found(self) -> None:
+        from ..jobs import enqueue_scan
+
+        other = get_user_model().objects.create_user(username="other", password="password123")
+        job = enqueue_scan(other, b"x")
+        response = self.client.get(reverse("receipt-scan-job", args=[job.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ReceiptScanStorageTests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        from ..ocr import ReceiptEngine
+        from ..ocr_pool import ReaderPool
+        from ..scan_cache import set_scan_cache
+        from .tests_ocr import FakeReader, RECEIPT_RAW_OUTPUT
+
+        super().setUp()
+        set_scan_cache(None)
+        self.addCleanup(set_scan_cache, None)
+        self.reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        self.engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: self.reader))
+
+    def scan(self, lines: list[str]) -> Any:
+        self.reader.lines = lines
+        with mock.patch("receipts.scanning.get_engine", return_value=self.engine):
+            return self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+
+    def test_scan_stores_raw_output(self) -> None:
+        from ..models import ReceiptScan
+        from .tests_ocr import RECEIPT_RAW_OUTPUT
+
+        response = self.scan(RECEIPT_RAW_OUTPUT)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        scan = ReceiptScan.objects.get()
+        self.assertEqual(scan.user, self.user)
+        self.assertEqual(scan.raw_output, RECEIPT_RAW_OUTPUT)
+        self.assertEqual(scan.result["total"], 91.88)
+        self.assertTrue(scan.image_hash.startswith("sha256:"))
+
+    def test_perceptual_cache_hit_copies_raw_output_of_source_scan(self) -> None:
+        import cv2
+        from ..models import ReceiptScan
+        from ..scan_cache import MemoryScanCache, content_hash, set_scan_cache
+        from ..scanning import scan_image
+        from .tests_ocr import RECEIPT_RAW_OUTPUT, synthetic_receipt_photo
+
+        set_scan_cache(MemoryScanCache(perceptual=True))
+        image = synthetic_receipt_photo()
+        reencoded = cv2.imdecode(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], cv2.IMREAD_COLOR)
+
+        with mock.patch("receipts.scanning.get_engine", return_value=self.engine):
+            first = scan_image(image, user=self.user)
+            second = scan_image(reencoded, user=self.user)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.reader.calls, 1)
+        copied = ReceiptScan.objects.order_by("-id").first()
+        self.assertEqual(ReceiptScan.objects.count(), 2)
+        self.assertEqual(copied.image_hash, content_hash(reencoded))
+        self.assertEqual(copied.raw_output, RECEIPT_RAW_OUTPUT)
+        self.assertEqual(copied.result["total"], 91.88)
+
+    def test_failed_parse_keeps_raw_output(self) -> None:
+        from ..models import ReceiptScan
+
+        response = self.scan(["PARAGON FISKALNY", "no summary"])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        scan = ReceiptScan.objects.get()
+        self.assertEqual(scan.raw_output, ["PARAGON FISKALNY", "no summary"])
+        self.assertIsNone(scan.result)
+        self.assertTrue(scan.error.startswith("Błąd danych"))
+
+    def test_detail_mode_stores_boxes(self) -> None:
+        from django.core.management import call_command
+        from django.test import override_settings
+        from io import StringIO
+        from ..models import ReceiptScan
+        from .tests_ocr import RECEIPT_RAW_OUTPUT, receipt_boxes
+
+        with override_settings(OCR_DETAIL=True):
+            response = self.scan(receipt_boxes(low_confidence=("TORBA 2szt",)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.reader.kwargs["detail"], 1)
+        self.assertEqual(response.json()["confidence"]["total"], 0.9)
+        self.assertEqual([item["confidence"]["name"] for item in response.json()["items"]], [0.9, 0.3])
+
+        scan = ReceiptScan.objects.get()
+        self.assertEqual(scan.raw_output, RECEIPT_RAW_OUTPUT)
+        self.assertEqual(len(scan.boxes), len(receipt_boxes()))
+
+        # Re-parsing uses the boxes, not the joined lines
+        scan.result = None
+        scan.save()
+        call_command("reparse_scans", stdout=StringIO())
+        scan.refresh_from_db()
+        self.assertEqual([item["confidence"]["name"] for item in scan.result["items"]], [0.9, 0.3])
+
+    def test_reparse_scans(self) -> None:
+        from django.core.management import call_command
+        from io import StringIO
+        from ..models import ReceiptScan
+        from ..ocr import ReceiptParser
+        from .tests_ocr import RECEIPT_RAW_OUTPUT
+
+        ok = ReceiptScan.objects.create(user=self.user, image_hash="a", raw_output=RECEIPT_RAW_OUTPUT, error="Błąd danych: old")
+        broken = ReceiptScan.objects.create(user=self.user, image_hash="b", raw_output=["nothing"], result={"total": 1})
+
+        for workers in (1, 2):
+            call_command("reparse_scans", workers=workers, chunk_size=1, stdout=StringIO())
+
+            ok.refresh_from_db()
+            broken.refresh_from_db()
+            self.assertEqual(ok.result, ReceiptParser.parse(RECEIPT_RAW_OUTPUT).to_json())
+            self.assertEqual(ok.error, "")
+            self.assertIsNotNone(ok.parsed_at)
+            self.assertIsNone(broken.result)
+            self.assertTrue(broken.error)
+
+    def test_reparse_scans_clears_only_scan_results(self) -> None:
+        import numpy as np
+        from django.core.cache import cache as default_cache
+        from django.core.management import call_command
+        from io import StringIO
+        from ..scan_cache import DjangoScanCache, set_scan_cache
+
+        image = np.zeros((8, 8), dtype=np.uint8)
+        cache = DjangoScanCache()
+        set_scan_cache(cache)
+        self.addCleanup(set_scan_cache, None)
+        cache.set(image, {"total": 1.0})
+        default_cache.set("session", "kept")
+
+        call_command("reparse_scans", stdout=StringIO())
+        self.assertIsNone(cache.get(image))
+        self.assertEqual(default_cache.get("session"), "kept")
+
+        cache.set(image, {"total": 1.0})
+        call_command("reparse_scans", keep_cache=True, stdout=StringIO())
+        self.assertEqual(cache.get(image), {"total": 1.0})
+
 
 class ProductDetailAPITests(AuthenticatedAPITestCase):
     def setUp(self) -> None:
         super().setUp()
         from ..models import Transaction, Product
         self.tx = Transaction.objects.create(
+            user=self.user,
             date=timezone.now(),
             total_amount=10.0,
             description="Init",
@@ -142,6 +868,57 @@ class ProductDetailAPITests(AuthenticatedAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
 
+class DataScopingTests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from ..models import Product, Transaction
+
+        self.other = get_user_model().objects.create_user(username="other", password="password123")
+        date = timezone.datetime(2024, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        self.own_tx = Transaction.objects.create(user=self.user, date=date, total_amount=-1, description="Own")
+        self.other_tx = Transaction.objects.create(user=self.other, date=date, total_amount=-100, description="Other")
+        self.other_product = Product.objects.create(name="Other", price=-100, transaction=self.other_tx)
+
+    def test_lists_only_own_data(self) -> None:
+        transactions = self.client.get(reverse("tx-list")).json()["results"]
+        self.assertEqual([tx["id"] for tx in transactions], [self.own_tx.pk])
+        self.assertEqual(self.client.get(reverse("prod-list")).json(), [])
+
+        export = b"".join(self.client.get(reverse("tx-export")).streaming_content)
+        self.assertEqual(len(export.splitlines()), 1)
+
+    def test_other_users_objects_not_found(self) -> None:
+        for url in (reverse("tx-detail", args=[self.other_tx.pk]), reverse("prod-detail", args=[self.other_product.pk])):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cannot_add_product_to_other_users_transaction(self) -> None:
+        payload = {"name": "A", "price": "5.00", "transaction": self.other_tx.pk}
+        response = self.client.post(reverse("prod-list"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_created_transaction_is_owned(self) -> None:
+        from ..models import Transaction
+
+        payload = {"date": timezone.now().isoformat(), "total_amount": "1.00", "description": "New"}
+        response = self.client.post(reverse("tx-list"), payload, format="json")
+        self.assertEqual(Transaction.objects.get(pk=response.json()["id"]).user, self.user)
+
+    def test_calendar_only_own_data(self) -> None:
+        response = self.client.get("/api/calendar/monthly/", {"year": 2024})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"1": -1.0})
+
+    def test_user_queries_use_index(self) -> None:
+        from django.db import connection
+        from ..models import Transaction
+
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite query plan")
+        plan = Transaction.objects.filter(user=self.user, date__year=2024).order_by("-date", "-id").explain()
+        self.assertIn("receipts_tr_user_id_562ad6_idx", plan)
+
+
 class UserUpdateAPITests(AuthenticatedAPITestCase):
     def test_update_username_success(self) -> None:
         url = reverse("user-update")
@@ -175,21 +952,380 @@ class CalendarAPITests(AuthenticatedAPITestCase):
         from ..models import Transaction
 
         Transaction.objects.create(
+            user=self.user,
             date=timezone.datetime(2024, 1, 1, 10, 0, tzinfo=dt_timezone.utc),
             total_amount=10.0,
             description="Jan1",
         )
         Transaction.objects.create(
+            user=self.user,
             date=timezone.datetime(2024, 1, 2, 10, 0, tzinfo=dt_timezone.utc),
             total_amount=20.0,
             description="Jan2",
         )
         Transaction.objects.create(
+            user=self.user,
             date=timezone.datetime(2024, 2, 1, 10, 0, tzinfo=dt_timezone.utc),
             total_amount=30.0,
             description="Feb1",
         )
 
+    def calendar(self, period: str, **params: int) -> dict[int, float]:
+        response = self.client.get(f"/api/calendar/{period}/", params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {int(k): v for k, v in response.json().items()}
+
+    def rollup(self) -> list[tuple]:
+        from ..models import DailySpending
+        return list(DailySpending.objects.order_by("user_id", "day").values_list("user_id", "day", "income", "expense", "count"))
+
+    def test_calendar_reads_rollup(self) -> None:
+        self.assertEqual(self.calendar("daily", year=2024, month=1), {1: 10.0, 2: 20.0})
+        self.assertEqual(self.calendar("monthly", year=2024), {1: 30.0, 2: 30.0})
+
+        # Token lookup and one query over the rollup
+        with self.assertNumQueries(2):
+            self.calendar("monthly", year=2024)
+
+    def test_rollup_follows_updates_and_deletes(self) -> None:
+        from ..models import Transaction
+
+        tx = Transaction.objects.get(description="Jan1")
+        tx.date = timezone.datetime(2024, 1, 2, 12, 0, tzinfo=dt_timezone.utc)
+        tx.total_amount = -4
+        tx.save()
+        self.assertEqual(self.calendar("daily", year=2024, month=1), {2: 16.0})
+
+        Transaction.objects.filter(description="Jan2").delete()
+        self.assertEqual(self.calendar("daily", year=2024, month=1), {2: -4.0})
+
+        tx.delete()
+        self.assertEqual(self.calendar("daily", year=2024, month=1), {})
+
+    def test_rollup_uses_local_day(self) -> None:
+        from ..models import Transaction
+
+        # 23:30 UTC on 31.01 is already 01.02 in Warsaw
+        Transaction.objects.create(
+            user=self.user,
+            date=timezone.datetime(2024, 1, 31, 23, 30, tzinfo=dt_timezone.utc),
+            total_amount=-5,
+        )
+        self.assertEqual(self.calendar("daily", year=2024, month=2), {1: 25.0})
+
+    def test_incremental_rollup_matches_rebuild(self) -> None:
+        import random
+        from ..models import Transaction
+        from ..rollups import rebuild
+
+        rng = random.Random(0)
+        transactions = list(Transaction.objects.all())
+        for _ in range(60):
+            action = rng.random()
+            if action < 0.5 or not transactions:
+                transactions.append(Transaction.objects.create(
+                    user=self.user,
+                    date=timezone.datetime(2024, 3, rng.randint(1, 5), rng.randint(0, 23), tzinfo=dt_timezone.utc),
+                    total_amount=rng.choice([-1, 1]) * rng.randint(1, 5000) / 100,
+                ))
+            elif action < 0.8:
+                tx = rng.choice(transactions)
+                tx.date = timezone.datetime(2024, 3, rng.randint(1, 5), rng.randint(0, 23), tzinfo=dt_timezone.utc)
+                tx.total_amount = rng.randint(-5000, 5000) / 100
+                tx.save()
+            else:
+                transactions.pop(rng.randrange(len(transactions))).delete()
+
+        incremental = self.rollup()
+        rebuild()
+        self.assertEqual(incremental, self.rollup())
+
+    def test_refresh_days_after_bulk_create(self) -> None:
+        from datetime import date
+        from ..models import Transaction
+        from ..rollups import refresh_days
+
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, date=timezone.datetime(2024, 1, 1, 12, tzinfo=dt_timezone.utc), total_amount=-3)
+        ])
+        self.assertEqual(self.calendar("daily", year=2024, month=1), {1: 10.0, 2: 20.0})
+
+        refresh_days(self.user.pk, [date(2024, 1, 1)])
+        self.assertEqual(self.calendar("daily", year=2024, month=1), {1: 7.0, 2: 20.0})
+
+class AnalyticsAPITests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from ..models import Product, Transaction
+
+        def create(day: int, month: int, amount: float, products: dict[str, float]) -> None:
+            tx = Transaction.objects.create(
+                user=self.user,
+                date=timezone.datetime(2024, month, day, 10, 0, tzinfo=dt_timezone.utc),
+                total_amount=amount,
+            )
+            for name, price in products.items():
+                Product.objects.create(transaction=tx, name=name, price=price)
+
+        create(1, 1, -10, {"Mleko": -4, "Chleb": -6})
+        create(3, 1, -20, {"Mleko": -8, "Masło": -12})
+        create(3, 1, 100, {})
+        create(8, 1, -7, {"Chleb": -7})
+        create(5, 2, -30, {"Masło": -30})
+
+        other = get_user_model().objects.create_user(username="other", password="password123")
+        tx = Transaction.objects.create(
+            user=other, date=timezone.datetime(2024, 1, 2, 10, 0, tzinfo=dt_timezone.utc), total_amount=-500
+        )
+        Product.objects.create(transaction=tx, name="Mleko", price=-500)
+
+    def analytics(self, **params: Any) -> dict[str, Any]:
+        response = self.client.get(reverse("analytics"), {"date_from": "2024-01-01", "date_to": "2024-02-29", **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_monthly_buckets_and_totals(self) -> None:
+        data = self.analytics()
+        self.assertEqual(data["totals"], {"income": 100.0, "expense": -67.0, "net": 33.0})
+        self.assertEqual(data["buckets"], [
+            {"start": "2024-01-01", "income": 100.0, "expense": -37.0, "net": 63.0, "count": 4},
+            {"start": "2024-02-01", "income": 0.0, "expense": -30.0, "net": -30.0, "count": 1},
+        ])
+
+    def test_weekly_buckets(self) -> None:
+        data = self.analytics(bucket="week", date_to="2024-01-31")
+        # 01.01.2024 is a Monday
+        self.assertEqual([(row["start"], row["net"]) for row in data["buckets"]], [("2024-01-01", 70.0), ("2024-01-08", -7.0)])
+
+    def test_top_products(self) -> None:
+        data = self.analytics(top=2)
+        self.assertEqual(data["top_products"], [
+            {"name": "Masło", "total": -42.0, "count": 2},
+            {"name": "Chleb", "total": -13.0, "count": 2},
+        ])
+
+        data = self.analytics(date_from="2024-01-02", date_to="2024-01-31")
+        self.assertEqual([row["name"] for row in data["top_products"]], ["Masło", "Mleko", "Chleb"])
+
+    def test_rolling_averages(self) -> None:
+        data = self.analytics(date_from="2024-01-03")
+        rolling = {row["day"]: row for row in data["rolling"]}
+        self.assertEqual(list(rolling), ["2024-01-03", "2024-01-08", "2024-02-05"])
+        # Days before date_from still fill the window, days without transactions count as zero
+        self.assertEqual(rolling["2024-01-03"]["avg_7"], round((-10 + 80) / 7, 2))
+        self.assertEqual(rolling["2024-01-08"]["avg_7"], round((80 - 7) / 7, 2))
+        self.assertEqual(rolling["2024-01-08"]["avg_30"], round((-10 + 80 - 7) / 30, 2))
+        self.assertEqual(rolling["2024-02-05"]["avg_7"], round(-30 / 7, 2))
+        self.assertEqual(rolling["2024-02-05"]["avg_30"], round((-7 - 30) / 30, 2))
+
+    def test_rolling_fallback_matches_window_query(self) -> None:
+        from django.db import connection
+        from .. import analytics
+
+        start, end = timezone.datetime(2024, 1, 1).date(), timezone.datetime(2024, 2, 29).date()
+        expected = analytics.rolling_averages(self.user, start, end)
+        with mock.patch.object(connection.features, "supports_over_clause", False):
+            self.assertEqual(analytics.rolling_averages(self.user, start, end), expected)
+
+    def test_single_query_per_section(self) -> None:
+        # Token lookup, buckets, top products, rolling averages
+        with self.assertNumQueries(4):
+            self.analytics()
+
+    def test_invalid_parameters(self) -> None:
+        for params in ({"date_from": "2024-13-01"}, {"date_from": "2024-03-01"}, {"bucket": "year"}, {"top": "x"}):
+            response = self.client.get(reverse("analytics"), {"date_from": "2024-01-01", "date_to": "2024-02-29", **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
+class SeedDataTests(AuthenticatedAPITestCase):
+    def seed(self, **options: Any) -> list[tuple]:
+        from django.core.management import call_command
+        from io import StringIO
+        from ..models import Transaction
+
+        call_command("seed_data", stdout=StringIO(), **options)
+        return list(
+            Transaction.objects.order_by("user__username", "date", "total_amount")
+            .values_list("user__username", "date", "total_amount", "description")
+        )
+
+    def test_synthetic_data(self) -> None:
+        import datetime
+        from ..models import DailySpending, Transaction
+        from ..rollups import rebuild
+
+        options = {"users": 2, "transactions": 40, "products_per_tx": 2, "years": 1, "end": "2024-06-30", "seed": 3, "batch_size": 15}
+        rows = self.seed(**options)
+        self.assertEqual(len(rows), 80)
+        self.assertEqual({row[0] for row in rows}, {"seed_user_1", "seed_user_2"})
+        self.assertTrue(all(
+            datetime.date(2023, 7, 2) <= timezone.localtime(row[1]).date() <= datetime.date(2024, 6, 30) for row in rows
+        ))
+        for tx in Transaction.objects.prefetch_related("products"):
+            self.assertEqual(tx.total_amount, sum(product.price for product in tx.products.all()))
+
+        # Same options - same data, the old data of the users is replaced
+        self.assertEqual(self.seed(**options), rows)
+
+        rollup = list(DailySpending.objects.order_by("user_id", "day").values_list("user_id", "day", "income", "expense", "count"))
+        self.assertTrue(rollup)
+        rebuild()
+        self.assertEqual(rollup, list(DailySpending.objects.order_by("user_id", "day").values_list("user_id", "day", "income", "expense", "count")))
+
+    def test_synthetic_data_replaces_user_data(self) -> None:
+        from ..models import Transaction
+
+        Transaction.objects.create(user=self.user, date=timezone.now(), total_amount=-1, description="Stara")
+        rows = self.seed(user="tester", transactions=5, products_per_tx=0)
+        self.assertEqual(len(rows), 5)
+        self.assertNotIn("Stara", [row[3] for row in rows])
+        self.assertFalse(Transaction.objects.filter(products__isnull=False).exists())
+
+
+class ProductNormalizationTests(AuthenticatedAPITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        from ..models import Transaction
+        from ..normalization import ProductNormalizer, set_normalizer
+
+        # Fresh in-memory index - canonical products of other tests were rolled back
+        set_normalizer(ProductNormalizer(threshold=85))
+        self.addCleanup(set_normalizer, ProductNormalizer(threshold=85))
+        self.tx = Transaction.objects.create(user=self.user, date=timezone.now(), total_amount=-30)
+
+    def test_name_key(self) -> None:
+        from ..normalization import name_key
+
+        self.assertEqual(name_key("MA5ŁO  EKSTRA!"), "maslo ekstra")
+        self.assertEqual(name_key("Żółć 0,5 l"), "zolc 0 5 l")
+
+    def test_blocking_index_compares_digits(self) -> None:
+        from ..normalization import BlockingIndex, name_key
+
+        index = BlockingIndex()
+        index.add(name_key("MASLO EKSTRA"))
+        index.add(name_key("Mleko 3,2%"))
+        self.assertEqual(index.best_match(name_key("MASŁO EKSTR"), 85)[0], "maslo ekstra")
+        self.assertIsNone(index.best_match(name_key("Mleko 2%"), 85))
+        self.assertIsNone(index.best_match(name_key("Chleb"), 85))
+
+    def test_ocr_spellings_share_canonical_product(self) -> None:
+        from ..models import CanonicalProduct, Product
+
+        products = [
+            Product.objects.create(transaction=self.tx, name=name, price=-8)
+            for name in ("MASLO EKSTRA", "MASŁO EKSTR", "MA5ŁO EKSTRA", "Mleko 2%", "Mleko 3,2%")
+        ]
+        self.assertEqual(len({product.canonical_id for product in products[:3]}), 1)
+        self.assertEqual(len({product.canonical_id for product in products}), 3)
+        self.assertEqual(CanonicalProduct.objects.get(pk=products[2].canonical_id).name, "MASLO EKSTRA")
+
+        # Renaming moves the product, other updates keep it
+        products[3].name = "Mleko 3.2%"
+        products[3].save()
+        self.assertEqual(products[3].canonical_id, products[4].canonical_id)
+
+    def test_bulk_writes_assign_canonical_product(self) -> None:
+        from ..models import Product
+
+        response = self.client.post(reverse("prod-bulk"), {"upsert": [
+            {"name": "MASLO EKSTRA", "price": "-8.00", "transaction": self.tx.pk},
+            {"name": "MASŁO EKSTR", "price": "-8.00", "transaction": self.tx.pk},
+        ]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first, second = response.json()["upsert"]
+        self.assertIsNotNone(first["canonical"])
+        self.assertEqual(first["canonical"], second["canonical"])
+
+        response = self.client.post(reverse("prod-bulk"), {"upsert": [
+            {"id": second["id"], "name": "Chleb", "price": "-4.00", "transaction": self.tx.pk},
+        ]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(Product.objects.get(pk=second["id"]).canonical_id, first["canonical"])
+
+    def test_scan_items_carry_canonical_product(self) -> None:
+        from ..models import CanonicalProduct, Product
+        from ..ocr import ReceiptEngine
+        from ..ocr_pool import ReaderPool
+        from ..scan_cache import set_scan_cache
+        from .tests_ocr import FakeReader, RECEIPT_RAW_OUTPUT
+
+        set_scan_cache(None)
+        self.addCleanup(set_scan_cache, None)
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT)))
+        with mock.patch("receipts.scanning.get_engine", return_value=engine):
+            response = self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+
+        # Scans only look canonical products up - a scan that is never saved leaves nothing behind
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["canonical_id"] for item in response.json()["items"]], [None, None])
+        self.assertEqual([item["canonical_name"] for item in response.json()["items"]], ["SVETER", "TORBA"])
+        self.assertFalse(CanonicalProduct.objects.exists())
+
+        saved = Product.objects.create(transaction=self.tx, name="SVETER", price=-80)
+        with mock.patch("receipts.scanning.get_engine", return_value=engine):
+            response = self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+        self.assertEqual([item["canonical_id"] for item in response.json()["items"]], [saved.canonical_id, None])
+        self.assertEqual(CanonicalProduct.objects.count(), 1)
+
+    def test_canonical_names_are_the_users_own_spelling(self) -> None:
+        from ..analytics import top_products
+        from ..models import Product, Transaction
+        from ..ocr import ReceiptEngine
+        from ..ocr_pool import ReaderPool
+        from ..scan_cache import set_scan_cache
+        from .tests_ocr import FakeReader, RECEIPT_RAW_OUTPUT
+
+        set_scan_cache(None)
+        self.addCleanup(set_scan_cache, None)
+        # Another user saved the product first - the canonical product carries their spelling
+        other = get_user_model().objects.create_user(username="other", password="password123")
+        other_tx = Transaction.objects.create(user=other, date=timezone.now(), total_amount=-1)
+        Product.objects.create(transaction=other_tx, name="Sveter.", price=-1)
+
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT)))
+        with mock.patch("receipts.scanning.get_engine", return_value=engine):
+            response = self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+        self.assertEqual(response.json()["items"][0]["canonical_name"], "SVETER")
+
+        Product.objects.create(transaction=self.tx, name="sveter!", price=-80)
+        with mock.patch("receipts.scanning.get_engine", return_value=engine):
+            response = self.client.post(reverse("receipt-scan"), {"image": make_image_upload()}, format="multipart")
+        item = response.json()["items"][0]
+        self.assertEqual(item["canonical_name"], "sveter!")
+        self.assertEqual(item["canonical_id"], Product.objects.get(transaction=other_tx).canonical_id)
+
+        day = timezone.localdate(self.tx.date)
+        self.assertEqual([row["name"] for row in top_products(self.user, day, day)], ["sveter!"])
+
+    def test_top_products_grouped_by_canonical_product(self) -> None:
+        from ..analytics import top_products
+        from ..models import Product
+
+        for name in ("MASLO EKSTRA", "MASŁO EKSTR", "Chleb"):
+            Product.objects.create(transaction=self.tx, name=name, price=-8)
+        day = timezone.localdate(self.tx.date)
+        self.assertEqual(
+            [(row["name"], row["count"]) for row in top_products(self.user, day, day)],
+            [("MASLO EKSTRA", 2), ("Chleb", 1)]
+        )
+
+    def test_backfill_command(self) -> None:
+        from django.core.management import call_command
+        from io import StringIO
+        from ..models import Product
+
+        with mock.patch("receipts.signals.assign_canonical"):
+            Product.objects.create(transaction=self.tx, name="MASLO EKSTRA", price=-8)
+        Product.objects.bulk_create([Product(transaction=self.tx, name="MA5ŁO EKSTRA", price=-8)])
+        self.assertFalse(Product.objects.filter(canonical__isnull=False).exists())
+
+        call_command("normalize_products", chunk_size=1, stdout=StringIO())
+        self.assertEqual(Product.objects.filter(canonical__isnull=True).count(), 0)
+        self.assertEqual(len(set(Product.objects.values_list("canonical", flat=True))), 1)
+
+
 def test_daily_totals(self) -> None:
     response = self.client.get(
         "/calendar/daily/",
@@ -1,8 +1,173 @@
+import copy
+import importlib.util
+import json
+import random
+import re
+import unicodedata
+
+import cv2
+import numpy as np
 import pytest
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import FrozenInstanceError
 from datetime import date, time
+from types import SimpleNamespace
+
+import torch
+from easyocr.model.vgg_model import Model as RecognitionModel
+from torch import nn
+
+from receipts.benchmark import compare_backends, fixture_samples, run_benchmark, text_corpus
+from receipts.ocr import ReceiptParser, ReceiptEngine, ReceiptResult
+from receipts.fuzzy import KeywordMatcher
+from receipts.layout import LayoutText, TextBox, group_rows
+from receipts.ocr_backends import InferenceBackend, OnnxBackend, OnnxModel, QuantizedBackend, create_backend
+from receipts.ocr_pool import ReaderPool, ReaderPoolTimeout, get_reader_pool
+from receipts.preprocessing import ReceiptPreprocessor
+from receipts.roi import read_regions
+from receipts.segmentation import ProjectionSegmenter
+from receipts.scan_cache import MemoryScanCache, ScanCache, SQLiteScanCache, content_hash, perceptual_hash
+from receipts.uploads import ImageInfo, decode_flag, image_info, validate_image
+from rapidfuzz import fuzz
+
+
+# Synthetic OCR output of a complete receipt
+RECEIPT_RAW_OUTPUT = [
+    "SKLEP ABC",
+    "ul. Przykładowa 1",
+    "PARAGON FISKALNY",
+    "SVETER 1*79,90 79,90 A",
+    "TORBA 2szt x5,99 11,98 A",
+    "SPRZEDAŻ OPODATKOWANA A 91,88",
+    "PTU A 23% 17,18",
+    "SUMA PTU 17,18",
+    "SUMA PLN 91,88",
+    "2025-03-04 14:32",
+    "ABC1234567890",
+    "Karta"
+]
+
+
+
+def receipt_boxes(lines=RECEIPT_RAW_OUTPUT, confidence=0.9, low_confidence=(), jitter=0):
+    # readtext(detail=1) output: every line is split into its name and amounts fragments (amounts right-aligned)
+    entries = []
+    amounts = re.compile(r"\s([*x]?\d[^ ]*\s+)?[^ ]*\d,\d{2}( [A-Z])?$")
+    for row, line in enumerate(lines):
+        match = amounts.search(line) if row > 2 else None
+        fragments = [(line, 20)] if match is None else [(line[:match.start()], 20), (match.group().strip(), 900 - 18 * len(match.group().strip()))]
+        for index, (text, x) in enumerate(fragments):
+            y = 50 * row + (jitter if index else 0)
+            points = [[x, y], [x + 18 * len(text), y], [x + 18 * len(text), y + 30], [x, y + 30]]
+            entries.append((points, text, 0.3 if text in low_confidence else confidence))
+    return entries
+
+
+def reference_fuzzy_find_substring(text, pattern, threshold=85, offset=2, ignore_case=True):
+    # Original pure-Python implementation - the fast matcher must return exactly the same results
+    text = text.lower()
+    pattern = pattern.lower() if ignore_case else pattern
+    best_score = 0
+    best_match = None
+
+    window_size = len(pattern)
+    for i in range(len(text) - window_size + 1):
+        window = text[i:i + window_size + offset]
+        score = fuzz.ratio(window, pattern)
+        if score > best_score and score >= threshold:
+            best_score = score
+            best_match = (i, i + len(window))
+
+    return best_match
+
+
+def random_receipt_texts(count, seed=0):
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnoprstuwyzążśźęćńół0123456789 .,*=-\n"
+    words = ["paragon", "fiskalny", "suma", "pln", "rabat", "zniżka", "opust", "obniżka", "karta", "gotówka", "sprzedaż", "opodatkowana"]
+    texts = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rng.randint(0, 40)):
+            if rng.random() < 0.3:
+                word = list(rng.choice(words))
+                # OCR-like typos
+                for _ in range(rng.randint(0, 2)):
+                    if word:
+                        word[rng.randrange(len(word))] = rng.choice(alphabet)
+                parts.append("".join(word))
+            else:
+                parts.append("".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8))))
+        texts.append(" ".join(parts))
+    return texts
 
-from receipts.ocr import ReceiptParser
+
+class FakeReader:
+
+    def __init__(self, lines=None):
+        self.lines = lines or []
+        self.calls = 0
+        self.images = []
+        self.kwargs = None
+        self.recognized = []
+
+    def readtext(self, image, **kwargs):
+        self.calls += 1
+        self.images.append(image)
+        self.kwargs = kwargs
+        return self.lines
+
+    def readtext_batched(self, images, **kwargs):
+        assert len({image.shape for image in images}) == 1
+        self.calls += 1
+        self.images.extend(images)
+        self.kwargs = kwargs
+        return [self.lines for _ in images]
+
+    def detect(self, image, **kwargs):
+        # One full-width box per line, lines spread evenly over the image
+        self.calls += 1
+        self.images.append(image)
+        height, width = image.shape[:2]
+        step = height / max(len(self.lines), 1)
+        return [[[0, width, round(i * step), round((i + 0.8) * step)] for i in range(len(self.lines))]], [[]]
+
+    def recognize(self, image, horizontal_list=None, free_list=None, **kwargs):
+        self.calls += 1
+        self.kwargs = kwargs
+        self.recognized.extend(horizontal_list)
+        step = image.shape[0] / max(len(self.lines), 1)
+        entries = []
+        for x0, x1, y0, y1 in horizontal_list:
+            line = self.lines[min(round(y0 / step), len(self.lines) - 1)]
+            entries.append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], line if isinstance(line, str) else line[1], 0.9))
+        return entries
+
+
+def printed_receipt(lines, step=60, width=900, amounts=False):
+    # Clean scan of a receipt: line `i` is printed in the band [i * step, (i + 1) * step), amounts right-aligned
+    image = np.full((step * len(lines), width), 255, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        text = unicodedata.normalize("NFKD", line).encode("ascii", "ignore").decode()
+        name, _, amount = text.rpartition("  ") if amounts else ("", "", text)
+        if name:
+            cv2.putText(image, name, (20, i * step + 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+        x = width - 20 - cv2.getTextSize(amount, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0][0] if name else 20
+        cv2.putText(image, amount, (x, i * step + 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    return image
+
+
+def synthetic_receipt_photo(angle=0.0, lines=30, font_scale=2.0):
+    # White receipt with printed lines on a dark table, rotated by `angle` degrees
+    photo = np.full((4000, 3000, 3), 60, dtype=np.uint8)
+    paper = np.full((3000, 1400, 3), 250, dtype=np.uint8)
+    for k in range(lines):
+        cv2.putText(paper, f"PRODUKT {k} 1*3,50 3,50 A", (60, 150 + k * 90), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 4)
+    photo[500:3500, 800:2200] = paper
+
+    matrix = cv2.getRotationMatrix2D((1500, 2000), angle, 1.0)
+    return cv2.warpAffine(photo, matrix, (3000, 4000), borderValue=(60, 60, 60))
 
 
 class TestReceiptParser:
@@ -73,6 +238,20 @@ class TestReceiptParser:
         start, end = match
         assert "paragon fiskalny" in text[start:end].lower()
 
+    @pytest.mark.parametrize("pattern", ["paragon fiskalny", "SUMA PLN", "Sprzed. opod.", "Rabat", "Gotówka", "x"])
+    @pytest.mark.parametrize("threshold,offset", [(85, 2), (75, 2), (65, 2), (70, 0), (50, -1), (0, 2)])
+    def test_fuzzy_find_substring_matches_reference(self, pattern, threshold, offset):
+        texts = random_receipt_texts(60) + ["\n".join(RECEIPT_RAW_OUTPUT), "\n".join(random_receipt_texts(20, seed=1)), "", "ab", pattern, "rabat rabat rabat"]
+
+        for text in texts:
+            assert ReceiptParser.fuzzy_find_substring(text, pattern, threshold=threshold, offset=offset) == \
+                   reference_fuzzy_find_substring(text, pattern, threshold=threshold, offset=offset)
+
+    def test_fuzzy_find_substring_case_sensitive_pattern(self):
+        # With ignore_case=False only the pattern keeps its case (the text is always lowercased)
+        assert ReceiptParser.fuzzy_find_substring("suma pln 1,00", "SUMA PLN", ignore_case=False) is None
+        assert ReceiptParser.fuzzy_find_substring("SUMA PLN 1,00", "suma pln", ignore_case=False) == (0, 10)
+
     def test_extract_items_basic(self):
         # Synthetic output
         test_text = """
@@ -121,4 +300,741 @@ class TestReceiptParser:
         assert "SKLEP ABC" in sections["header"]
         assert "SVETER" in sections["items"]
         assert "SUMA PLN" in sections["summary"]
-        assert "XYZ1234567890" in sections["identifier"]
\ No newline at end of file
+        assert "XYZ1234567890" in sections["identifier"]
+
+
+class TestReaderPool:
+
+    def test_readers_created_lazily_and_reused(self):
+        created = []
+        pool = ReaderPool(size=2, gpu=False, factory=lambda gpu: created.append(FakeReader()) or created[-1])
+
+        assert pool.created == 0
+
+        with pool.reader() as first:
+            pass
+        with pool.reader() as second:
+            pass
+
+        assert first is second
+        assert len(created) == 1
+
+    def test_warm_up_loads_all_readers(self):
+        pool = ReaderPool(size=3, gpu=False, factory=lambda gpu: FakeReader())
+        pool.warm_up()
+        assert pool.created == 3
+
+    def test_acquire_times_out_when_exhausted(self):
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader())
+        reader = pool.acquire()
+
+        with pytest.raises(ReaderPoolTimeout):
+            pool.acquire(timeout=0.01)
+
+        pool.release(reader)
+        assert pool.acquire(timeout=0.01) is reader
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            ReaderPool(size=0)
+
+    def test_process_pools_are_keyed_by_arguments(self):
+        def factory(gpu):
+            return FakeReader()
+
+        pool = get_reader_pool(gpu=False, size=2, factory=factory)
+
+        assert get_reader_pool(gpu=False, size=2, factory=factory) is pool
+        assert get_reader_pool(gpu=False, size=3, factory=factory).size == 3
+        assert get_reader_pool(gpu=False, size=2, factory=lambda gpu: FakeReader()) is not pool
+
+    def test_parser_borrows_reader_from_pool(self):
+        reader = FakeReader(lines=[' PARAGON FISKALNY ', '', 'SUMA PLN 1,00'])
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: reader)
+
+        parser = ReceiptParser(gpu=False, reader_pool=pool)
+        parser.load_image_from_np_ndarray(np.zeros((10, 10, 3), dtype=np.uint8))
+
+        assert parser.extract_text() == ['PARAGON FISKALNY', 'SUMA PLN 1,00']
+        assert reader.calls == 1
+        assert pool.acquire(timeout=0.01) is reader
+
+
+class TestInferenceBackends:
+
+    class FakeBackend(InferenceBackend):
+        def load(self, gpu):
+            return FakeReader(lines=RECEIPT_RAW_OUTPUT)
+
+    def test_create_backend(self):
+        assert type(create_backend(None)) is InferenceBackend
+
+        backend = create_backend({'BACKEND': 'quantized', 'OPTIONS': {'threads': 2, 'engine': 'qnnpack'}})
+        assert isinstance(backend, QuantizedBackend)
+        assert (backend.threads, backend.engine) == (2, 'qnnpack')
+
+        with pytest.raises(ValueError):
+            create_backend({'BACKEND': 'tensorrt'})
+
+    def test_engine_uses_backend_pool(self):
+        backend = self.FakeBackend()
+
+        engine = ReceiptEngine(backend=backend)
+
+        assert engine.reader_pool is backend.reader_pool()
+        assert list(engine.read_text(np.zeros((10, 10, 3), dtype=np.uint8))) == RECEIPT_RAW_OUTPUT
+        assert ReceiptParser(backend=backend).reader_pool is engine.reader_pool
+
+    def test_quantized_backend_converts_recognizer(self):
+        torch.manual_seed(0)
+        recognizer = RecognitionModel(input_channel=1, output_channel=64, hidden_size=32, num_class=20).eval()
+        detector = nn.Conv2d(3, 2, 3)
+        reader = SimpleNamespace(detector=detector, recognizer=copy.deepcopy(recognizer))
+        image = torch.rand(2, 1, 64, 128)
+
+        QuantizedBackend().convert(reader)
+
+        assert reader.detector is detector
+        assert not any(isinstance(module, (nn.LSTM, nn.Linear)) for module in reader.recognizer.modules())
+        with torch.no_grad():
+            expected, quantized = recognizer(image, None), reader.recognizer(image, None)
+        assert quantized.shape == expected.shape
+        assert torch.allclose(quantized, expected, atol=0.1 * float(expected.abs().max()))
+
+    def test_exportable_recognizer_is_equivalent(self):
+        torch.manual_seed(0)
+        recognizer = RecognitionModel(input_channel=1, output_channel=64, hidden_size=32, num_class=20).eval()
+        image = torch.rand(2, 1, 64, 96)
+
+        exportable = OnnxBackend.exportable_recognizer(copy.deepcopy(recognizer))
+
+        assert not any(isinstance(module, nn.AdaptiveAvgPool2d) for module in exportable.modules())
+        with torch.no_grad():
+            assert torch.allclose(exportable(image), recognizer(image, None), atol=1e-5)
+
+    def test_onnx_model_stands_in_for_torch_model(self):
+        class Session:
+            def get_inputs(self):
+                return [SimpleNamespace(name='image')]
+
+            def run(self, outputs, feed):
+                image = feed['image']
+                return [image.sum(axis=1), image.mean(axis=1)]
+
+        image = torch.ones(1, 3, 4, 4)
+
+        y, feature = OnnxModel(Session(), outputs=2).eval()(image)
+        preds = OnnxModel(Session()).to('cpu')(image, None)
+
+        assert isinstance(y, torch.Tensor) and isinstance(feature, torch.Tensor)
+        assert torch.equal(y, torch.full((1, 4, 4), 3.0))
+        assert torch.equal(preds, y)
+
+    @pytest.mark.skipif(importlib.util.find_spec('onnxruntime') is not None, reason='onnxruntime is installed')
+    def test_onnx_backend_requires_onnxruntime(self, tmp_path):
+        reader = SimpleNamespace(detector=nn.Conv2d(3, 2, 3), recognizer=nn.Linear(2, 2))
+
+        with pytest.raises(ImportError, match='onnxruntime'):
+            OnnxBackend(model_dir=tmp_path).convert(reader)
+
+
+class TestReceiptEngine:
+
+    def test_parse_is_stateless(self):
+        result = ReceiptParser.parse(RECEIPT_RAW_OUTPUT)
+
+        assert isinstance(result, ReceiptResult)
+        assert result.raw_output == tuple(RECEIPT_RAW_OUTPUT)
+        assert result.date == date(2025, 3, 4)
+        assert result.time == time(14, 32)
+        assert result.total == 91.88
+        assert result.payment_method == "CARD"
+        assert [item["name"] for item in result.items] == ["SVETER", "TORBA"]
+        assert "SUMA PLN" in result.sections.summary
+
+    def test_result_is_immutable(self):
+        result = ReceiptParser.parse(RECEIPT_RAW_OUTPUT)
+
+        with pytest.raises(FrozenInstanceError):
+            result.total = 0  # type: ignore
+
+        result.to_json()["items"][0]["price"] = 0
+        assert result.items[0]["price"] == 79.90
+
+    def test_scan_matches_stateful_parser(self):
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT))
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+
+        parser = ReceiptParser(gpu=False, reader_pool=pool)
+        parser.load_image_from_np_ndarray(image)
+
+        assert ReceiptEngine(reader_pool=pool).scan(image).to_json() == parser.run()
+
+    def test_scan_from_many_threads(self):
+        pool = ReaderPool(size=2, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT))
+        engine = ReceiptEngine(reader_pool=pool)
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: engine.scan(image), range(16)))
+
+        assert all(result.to_json() == results[0].to_json() for result in results)
+        assert pool.created <= 2
+
+    def test_missing_total_keyword(self):
+        with pytest.raises(ValueError):
+            ReceiptParser.split_sections(["PARAGON FISKALNY", "CHLEB 1*4,50 4,50 A", "SPRZEDAŻ OPODATKOWANA A 4,50"])
+
+    def test_scan_batch_keeps_input_order(self):
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+        images = [np.zeros((h, 10, 3), dtype=np.uint8) for h in (30, 10, 20)] + [np.zeros((0, 0, 3), dtype=np.uint8)]
+
+        results = engine.scan_batch(images, batch_size=2)
+
+        assert [type(result) for result in results] == [ReceiptResult, ReceiptResult, ReceiptResult, ValueError]
+        assert results[0].total == 91.88
+        assert reader.calls == 2
+
+    def test_read_text_batch_falls_back_to_single_images(self):
+        class FailingBatchReader(FakeReader):
+            def readtext_batched(self, images, **kwargs):
+                raise RuntimeError("out of memory")
+
+            def readtext(self, image, **kwargs):
+                if image.shape[0] == 13:
+                    raise RuntimeError("broken image")
+                return super().readtext(image, **kwargs)
+
+        reader = FailingBatchReader(lines=["A"])
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+        images = [np.zeros((h, 10, 3), dtype=np.uint8) for h in (12, 13)]
+
+        results = engine.read_text_batch(images)
+
+        assert results[0] == ("A",)
+        assert isinstance(results[1], RuntimeError)
+
+    def test_pad_to_common_size(self):
+        padded = ReceiptEngine.pad_to_common_size([np.zeros((5, 8, 3), dtype=np.uint8), np.zeros((7, 4), dtype=np.uint8)])
+
+        assert [image.shape for image in padded] == [(7, 8, 3), (7, 8, 3)]
+        assert padded[0][6, 0].tolist() == [255, 255, 255]
+        assert padded[1][0, 0].tolist() == [0, 0, 0]
+
+
+class TestLayout:
+
+    def test_group_rows_sweeps_by_center(self):
+        boxes = [
+            TextBox("12,99", 0.9, 300, 104, 360, 126),
+            TextBox("MLEKO", 0.9, 10, 100, 80, 120),
+            TextBox("CHLEB", 0.9, 10, 140, 80, 160),
+            TextBox("2%", 0.9, 90, 98, 110, 119),
+            TextBox("4,50", 0.9, 300, 142, 350, 163),
+        ]
+
+        rows = group_rows(boxes)
+
+        assert [row.text for row in rows] == ["MLEKO 2% 12,99", "CHLEB 4,50"]
+
+    def test_layout_text_maps_spans_to_boxes(self):
+        layout = LayoutText(group_rows([
+            TextBox("SUMA", 0.95, 0, 0, 40, 10), TextBox("PLN", 0.8, 50, 0, 80, 10), TextBox("91,88", 0.4, 100, 0, 150, 10),
+            TextBox("Karta", 0.7, 0, 20, 50, 30),
+        ]))
+
+        assert layout.text == "SUMA PLN 91,88\nKarta"
+        assert layout.confidence(0, 4) == 0.95
+        assert layout.confidence(5, 14) == 0.4
+        assert layout.find_confidence("Karta") == 0.7
+        assert layout.find_confidence("Gotówka") is None
+        assert [row.text for row in layout.rows_in(5, 20)] == ["PLN 91,88", "Karta"]
+
+    def test_parse_layout_matches_text_parser(self):
+        boxes = [TextBox.from_readtext(entry) for entry in receipt_boxes(jitter=4)]
+
+        result = ReceiptParser.parse_layout(boxes)
+        expected = ReceiptParser.parse(RECEIPT_RAW_OUTPUT).to_json()
+
+        assert result.raw_output == tuple(RECEIPT_RAW_OUTPUT)
+        for item, expected_item in zip(result.to_json()["items"], expected["items"]):
+            assert item.pop("confidence") == {"name": 0.9, "price": 0.9}
+            assert item == expected_item
+        assert result.confidence == {"date": 0.9, "time": 0.9, "total": 0.9}
+        assert {key: value for key, value in result.to_json().items() if key not in ("items", "confidence")} == \
+            {key: value for key, value in expected.items() if key != "items"}
+
+    def test_parse_layout_pairs_wrapped_names_and_confidences(self):
+        lines = [
+            *RECEIPT_RAW_OUTPUT[:3],
+            "SER ZOLTY", "GOUDA PLASTRY 1*6,49 6,49 A",
+            "Rabat -1,00",
+            *RECEIPT_RAW_OUTPUT[5:],
+        ]
+        boxes = [TextBox.from_readtext(entry) for entry in receipt_boxes(lines, low_confidence=("1*6,49 6,49 A",))]
+
+        result = ReceiptParser.parse_layout(boxes).to_json()
+
+        assert result["items"] == [{
+            "name": "SER ZOLTY GOUDA PLASTRY", "price": 6.49, "count": 1, "count_estimated": False,
+            "confidence": {"name": 0.9, "price": 0.3}
+        }]
+        # The whole last row belongs to the items section, even if the fuzzy section end cuts its last characters
+        [discount] = result["discounts"]
+        assert discount["name"].startswith("Rabat")
+        assert discount["amount"] == 1.0
+        assert discount["confidence"] == {"name": 0.9, "amount": 0.9}
+
+    def test_engine_detail_mode(self):
+        reader = FakeReader(lines=receipt_boxes())
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+
+        result = engine.scan(image, detail=True)
+
+        assert reader.kwargs["detail"] == 1 and reader.kwargs["paragraph"] is False
+        assert result.total == 91.88
+        assert [item["name"] for item in result.items] == ["SVETER", "TORBA"]
+        assert engine.scan_batch([image, image], detail=True)[1].to_json() == result.to_json()
+        assert "confidence" not in ReceiptParser.parse(RECEIPT_RAW_OUTPUT).to_json()
+
+
+class TestRegionOfInterest:
+    FOOTER = [f"ZAPRASZAMY PONOWNIE - PROGRAM LOJALNOSCIOWY {i}" for i in range(40)]
+
+    def test_recognizes_rows_down_to_the_tail(self):
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT + self.FOOTER)
+        image = np.full((50 * len(reader.lines), 1000), 255, dtype=np.uint8)
+
+        scan = read_regions(reader, image, ReceiptEngine.detail_options, chunk_rows=8, tail_rows=12)
+
+        # The first chunk ends at "SUMA PTU", the tail is counted from the real "SUMA PLN" found in the next one
+        assert scan.anchors_found
+        assert (scan.detected_rows, scan.recognized_rows) == (52, 21)
+        assert len(reader.recognized) == 21
+        assert reader.images[0].shape == (1300, 500)
+        assert reader.kwargs["detail"] == 1 and not reader.kwargs["paragraph"]
+
+    def test_scan_skips_the_footer(self):
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT + self.FOOTER)
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+        image = np.full((50 * len(reader.lines), 1000), 255, dtype=np.uint8)
+        expected = ReceiptParser.parse(RECEIPT_RAW_OUTPUT).to_json()
+
+        lines = engine.read_text(image, roi=True)
+        result = engine.scan(image, roi=True).to_json()
+        boxes = engine.read_boxes(image, roi=True)
+
+        assert lines[:len(RECEIPT_RAW_OUTPUT)] == tuple(RECEIPT_RAW_OUTPUT)
+        assert len(lines) == len(RECEIPT_RAW_OUTPUT) + 9
+        assert {key: result[key] for key in ("date", "time", "total", "payment_method", "items")} == \
+            {key: expected[key] for key in ("date", "time", "total", "payment_method", "items")}
+        assert engine.parse_boxes(boxes).total == 91.88
+
+    def test_falls_back_to_every_row(self):
+        reader = FakeReader(lines=["SKLEP ABC", "PARAGON FISKALNY", "CHLEB 1*4,50 4,50 A"] + self.FOOTER)
+        image = np.full((50 * len(reader.lines), 1000), 255, dtype=np.uint8)
+
+        scan = read_regions(reader, image, ReceiptEngine.readtext_options)
+
+        assert not scan.anchors_found
+        assert scan.recognized_rows == scan.detected_rows == 43
+        assert len(scan.output) == 43
+
+
+class TestProjectionSegmenter:
+
+    def test_finds_lines_and_fragments(self):
+        lines = ["SKLEP ABC", "PARAGON FISKALNY", "MLEKO 3,2%  1*4,50 4,50 A", "CHLEB  1*6,99 6,99 A", "SUMA PLN  11,49"]
+        image = printed_receipt(lines, amounts=True)
+
+        rows = ProjectionSegmenter()(image)
+
+        assert [len(row) for row in rows] == [1, 1, 2, 2, 2]
+        for i, row in enumerate(rows):
+            assert all(i * 60 <= box.y0 < box.cy < box.y1 <= (i + 1) * 60 for box in row)
+        # Words of a fragment ("MLEKO 3,2%") stay together, the amounts column is a separate box
+        assert rows[2][0].x0 < 20 < 150 < rows[2][0].x1 < rows[2][1].x0 and rows[2][1].x1 >= 880
+
+    def test_merges_diacritics_and_splits_touching_lines(self):
+        image = np.full((400, 600), 255, dtype=np.uint8)
+        cv2.rectangle(image, (20, 20), (300, 50), 0, -1)
+        cv2.rectangle(image, (40, 12), (50, 16), 0, -1)  # Accent above the first line
+        cv2.rectangle(image, (20, 100), (300, 130), 0, -1)
+        cv2.rectangle(image, (20, 180), (300, 210), 0, -1)
+        cv2.rectangle(image, (20, 211), (250, 241), 0, -1)  # Touches the line above
+        cv2.rectangle(image, (20, 242), (280, 272), 0, -1)
+
+        rows = ProjectionSegmenter(margin=0)(image)
+
+        assert [(row[0].y0, row[0].y1) for row in rows[:2]] == [(12, 51), (100, 131)]
+        assert len(rows) == 5
+        assert [row[0].x1 for row in rows[2:]] == [301, 251, 281]
+
+    def test_blank_image(self):
+        assert ProjectionSegmenter()(np.full((200, 300), 255, dtype=np.uint8)) == []
+        with pytest.raises(ValueError):
+            ProjectionSegmenter()(np.zeros((0, 0), dtype=np.uint8))
+
+    def test_engine_recognizes_segmented_lines(self):
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        engine = ReceiptEngine(reader_pool=ReaderPool(size=1, gpu=False, factory=lambda gpu: reader))
+        image = printed_receipt(RECEIPT_RAW_OUTPUT)
+
+        result = engine.scan(image, detector="projection")
+        batch = engine.scan_batch([image, np.zeros((0, 0), dtype=np.uint8)], detector="projection")
+
+        # One recognize call per image, no detector network
+        assert reader.calls == 2
+        assert len(reader.recognized) == 2 * len(RECEIPT_RAW_OUTPUT)
+        assert result.raw_output == tuple(RECEIPT_RAW_OUTPUT)
+        assert result.to_json() == ReceiptParser.parse(RECEIPT_RAW_OUTPUT).to_json()
+        assert batch[0].to_json() == result.to_json() and isinstance(batch[1], ValueError)
+        assert engine.read_boxes(image, detector="projection", roi=True)[0].text == "SKLEP ABC"
+
+        with pytest.raises(ValueError):
+            engine.scan(image, detector="tesseract")
+
+
+class TestKeywordMatcher:
+
+    keywords = ["paragon fiskalny", "Sprzedaż opodatkowana", "Sprzed. opod.", "SUMA PLN", "Rabat", "Opust"]
+
+    @pytest.mark.parametrize("threshold", [65, 75, 85])
+    def test_match_table_matches_reference(self, threshold):
+        matcher = KeywordMatcher(self.keywords, min_threshold=65)
+        texts = random_receipt_texts(40, seed=2) + ["\n".join(RECEIPT_RAW_OUTPUT)]
+
+        for text in texts:
+            table = matcher.scan(text)
+            for start in (0, 7, len(text) // 2):
+                for keyword in self.keywords:
+                    expected = reference_fuzzy_find_substring(text.lower()[start:], keyword, threshold=threshold)
+                    if expected is not None:
+                        expected = (expected[0] + start, expected[1] + start)
+                    assert table.find(keyword, threshold, start=start) == expected
+
+    def test_first_respects_keyword_order(self):
+        table = KeywordMatcher(["Karta", "Gotówka"], min_threshold=70).scan("gotówka 10,00 karta 5,00")
+
+        assert table.first(["Karta", "Gotówka"], 70)[0] == "Karta"
+        assert table.first(["Gotówka", "Karta"], 70)[0] == "Gotówka"
+        assert table.first(["Karta"], 70, start=15) is None
+
+    def test_score_is_best_window_ratio(self):
+        text = "nowe maslo ekstra"
+        table = KeywordMatcher(["masło"], min_threshold=60).scan(text)
+
+        # Windows are len(keyword) + offset characters long
+        expected = max(fuzz.ratio("masło", text[i:i + 7]) for i in range(len(text) - 4))
+        assert table.score("masło") == pytest.approx(expected)
+        assert KeywordMatcher(["masło"], min_threshold=60).scan("chleb").score("masło") == 0
+        assert KeywordMatcher(["masło extra"], min_threshold=60).scan("masło").score("masło extra") == 0
+
+    def test_extract_items_with_discount_keywords(self):
+        items, discounts = ReceiptParser.extract_items("MASŁO 1*7,30 7,30 A\nRabat 1*1,00 -1,00 A\nOpust -2,00")
+
+        assert [item["name"] for item in items] == ["MASŁO"]
+        assert [discount["amount"] for discount in discounts] == [1.00, 2.00]
+
+
+class TestReceiptPreprocessor:
+
+    def test_crops_receipt_region(self):
+        prepared = ReceiptPreprocessor(deskew=False)(synthetic_receipt_photo())
+        x, y, w, h = prepared.crop
+
+        assert prepared.image.ndim == 2
+        assert abs(x - 800) < 50 and abs(y - 500) < 50
+        assert abs(w - 1400) < 100 and abs(h - 3000) < 100
+
+    @pytest.mark.parametrize("angle", [-6.0, -2.5, 0.0, 4.0])
+    def test_deskew(self, angle):
+        prepared = ReceiptPreprocessor()(synthetic_receipt_photo(angle=angle))
+
+        assert prepared.angle == pytest.approx(-angle, abs=0.5)
+
+    def test_resizes_to_target_text_height(self):
+        preprocessor = ReceiptPreprocessor(target_text_height=24)
+        prepared = preprocessor(synthetic_receipt_photo(angle=3.0))
+
+        assert prepared.scale < 1
+        assert preprocessor.estimate_text_height(prepared.image) == pytest.approx(24, abs=4)
+        assert prepared.canvas_size == max(max(prepared.image.shape), preprocessor.min_canvas_size)
+        assert prepared.image.size < 0.15 * 4000 * 3000
+
+    def test_never_upscales(self):
+        image = np.full((600, 400), 255, dtype=np.uint8)
+        cv2.putText(image, "SUMA PLN 9,99", (10, 100), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 0, 1)
+
+        prepared = ReceiptPreprocessor(target_text_height=64)(image)
+
+        assert prepared.scale == 1.0
+        assert prepared.image.shape == (600, 400)
+        assert prepared.canvas_size == 1280
+
+    def test_blank_image(self):
+        prepared = ReceiptPreprocessor()(np.full((300, 200, 3), 255, dtype=np.uint8))
+
+        assert prepared.angle == 0.0
+        assert prepared.scale == 1.0
+
+    def test_max_canvas_size(self):
+        image = np.full((8000, 100), 255, dtype=np.uint8)
+
+        prepared = ReceiptPreprocessor(max_canvas_size=2000, crop=False, deskew=False)(image)
+
+        assert max(prepared.image.shape) <= 2000
+        assert prepared.canvas_size == 2000
+
+    def test_engine_reads_preprocessed_image(self):
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: reader)
+        engine = ReceiptEngine(reader_pool=pool, preprocessor=ReceiptPreprocessor())
+
+        result = engine.scan(synthetic_receipt_photo(angle=2.0))
+
+        assert result.total == 91.88
+        assert reader.images[0].ndim == 2
+        assert reader.kwargs["canvas_size"] == max(max(reader.images[0].shape), 1280)
+        assert reader.kwargs["canvas_size"] < ReceiptEngine.readtext_options["canvas_size"]
+
+    def test_engine_batch_uses_largest_canvas(self):
+        reader = FakeReader(lines=RECEIPT_RAW_OUTPUT)
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: reader)
+        engine = ReceiptEngine(reader_pool=pool, preprocessor=ReceiptPreprocessor(min_canvas_size=0))
+        images = [synthetic_receipt_photo(), synthetic_receipt_photo(font_scale=1.0, lines=50)]
+
+        results = engine.scan_batch(images, batch_size=2)
+
+        assert [result.total for result in results] == [91.88, 91.88]
+        assert reader.calls == 1
+        assert reader.kwargs["canvas_size"] == max(reader.images[0].shape)
+
+
+class TestScanCache:
+
+    @pytest.fixture(params=["memory", "sqlite"])
+    def make_cache(self, request, tmp_path):
+        def make(**kwargs):
+            if request.param == "memory":
+                return MemoryScanCache(**kwargs)
+            return SQLiteScanCache(tmp_path / "scan_cache.sqlite3", **kwargs)
+        return make
+
+    def test_roundtrip(self, make_cache):
+        cache = make_cache()
+        image = synthetic_receipt_photo()
+        result = ReceiptParser.parse(RECEIPT_RAW_OUTPUT).to_json()
+
+        assert cache.get(image) is None
+        cache.set(image, result)
+
+        assert cache.get(image) == result
+        assert cache.get(image.copy()) == result
+        assert cache.get(image[:, :-1]) is None
+
+    def test_returns_copies(self, make_cache):
+        cache = make_cache()
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        cache.set(image, {"total": 1.0})
+
+        cache.get(image)["total"] = 2.0
+
+        assert cache.get(image) == {"total": 1.0}
+
+    def test_lru_eviction(self, make_cache):
+        cache = make_cache(max_entries=2)
+        images = [np.full((10, 10), value, dtype=np.uint8) for value in range(3)]
+
+        cache.set(images[0], {"i": 0})
+        cache.set(images[1], {"i": 1})
+        cache.get(images[0])  # 1 is now the least recently used
+        cache.set(images[2], {"i": 2})
+
+        assert cache.get(images[1]) is None
+        assert cache.get(images[0]) == {"i": 0}
+        assert cache.get(images[2]) == {"i": 2}
+        assert len(cache) == 2
+
+    def test_ttl(self, make_cache):
+        cache = make_cache(ttl=-1)
+        image = np.zeros((10, 10), dtype=np.uint8)
+        cache.set(image, {"total": 1.0})
+
+        assert cache.get(image) is None
+
+    def test_perceptual_hash_matches_reencoded_image(self, make_cache):
+        cache = make_cache(perceptual=True)
+        image = synthetic_receipt_photo()
+        _, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        reencoded = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        cache.set(image, {"total": 1.0}, owner=1)
+
+        assert content_hash(image) != content_hash(reencoded)
+        assert perceptual_hash(image) == perceptual_hash(reencoded)
+        assert cache.get(reencoded, owner=1) == {"total": 1.0}
+
+    def test_perceptual_keys_are_scoped_to_owner(self, make_cache):
+        cache = make_cache(perceptual=True)
+        image = synthetic_receipt_photo()
+        _, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        reencoded = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        cache.set(image, {"total": 1.0}, owner=1)
+
+        assert cache.get(reencoded, owner=2) is None
+        assert cache.get(reencoded) is None
+        # The exact image is the same receipt whoever uploads it
+        assert cache.get(image, owner=2) == {"total": 1.0}
+
+    def test_backend_must_implement_storage(self):
+        class IncompleteCache(ScanCache):
+            def _get(self, key):
+                return None
+
+        with pytest.raises(TypeError):
+            IncompleteCache()
+
+    def test_sqlite_cache_is_shared(self, tmp_path):
+        image = np.zeros((10, 10), dtype=np.uint8)
+        SQLiteScanCache(tmp_path / "cache.sqlite3").set(image, {"total": 1.0})
+
+        assert SQLiteScanCache(tmp_path / "cache.sqlite3").get(image) == {"total": 1.0}
+
+
+class TestUploads:
+    @pytest.mark.parametrize("extension, name", [(".jpg", "JPEG"), (".png", "PNG"), (".webp", "WebP"), (".bmp", "BMP")])
+    def test_image_info_reads_header(self, extension, name):
+        image = np.full((123, 321, 3), 200, dtype=np.uint8)
+        encoded = cv2.imencode(extension, image)[1].tobytes()
+
+        assert image_info(encoded) == ImageInfo(name, 321, 123)
+        assert image_info(memoryview(encoded)) == ImageInfo(name, 321, 123)
+
+    def test_image_info_lossless_webp(self):
+        encoded = cv2.imencode(".webp", np.zeros((50, 70), dtype=np.uint8), [cv2.IMWRITE_WEBP_QUALITY, 101])[1].tobytes()
+        assert image_info(encoded) == ImageInfo("WebP", 70, 50)
+
+    def test_image_info_skips_jpeg_metadata(self):
+        encoded = cv2.imencode(".jpg", np.zeros((40, 60), dtype=np.uint8))[1].tobytes()
+        # APP1 segment (ex. EXIF) before the frame header
+        app1 = b"\xff\xe1" + (2 + 1000).to_bytes(2, "big") + bytes(1000)
+        assert image_info(encoded[:2] + app1 + encoded[2:]) == ImageInfo("JPEG", 60, 40)
+
+    @pytest.mark.parametrize("data", [b"not an image", b"GIF89a" + bytes(30), b"\xff\xd8\xff\xe0\x00"])
+    def test_image_info_rejects_other_data(self, data):
+        with pytest.raises(ValueError):
+            image_info(data)
+
+    def test_validate_image_limits(self):
+        encoded = cv2.imencode(".png", np.zeros((100, 100), dtype=np.uint8))[1].tobytes()
+
+        assert validate_image(encoded, max_size=len(encoded), max_pixels=10000).width == 100
+        with pytest.raises(ValueError, match="za duży"):
+            validate_image(encoded, max_size=len(encoded) - 1, max_pixels=10000)
+        with pytest.raises(ValueError, match="pikseli"):
+            validate_image(encoded, max_size=len(encoded), max_pixels=9999)
+        with pytest.raises(ValueError, match="pusty"):
+            validate_image(b"", max_size=10, max_pixels=10)
+
+    @pytest.mark.parametrize("width, height, min_side, flag", [
+        (1000, 800, 2000, cv2.IMREAD_GRAYSCALE),
+        (3000, 4000, 2000, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+        (8000, 6000, 2000, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+        (8000, 6000, None, cv2.IMREAD_GRAYSCALE),
+    ])
+    def test_decode_flag(self, width, height, min_side, flag):
+        assert decode_flag(ImageInfo("JPEG", width, height), min_side) == flag
+
+
+class TestBenchmark:
+
+    def test_corpus_is_deterministic_and_parseable(self):
+        corpus = text_corpus(50, seed=3)
+
+        assert corpus == text_corpus(50, seed=3)
+        for lines in corpus:
+            result = ReceiptParser.parse(lines)
+            assert result.total is not None
+            assert result.items
+
+    def test_report(self):
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT))
+
+        report = run_benchmark(receipts=10, images=1, reader_pool=pool, trace_memory=True)
+
+        assert set(report["stages"]) == {
+            "split_receipt_sections", "extract_items", "parse", "decode", "decode_reduced", "preprocess", "segment_lines",
+            "detect", "extract_text", "extract_text_preprocessed", "extract_text_projection", "extract_text_roi", "run"
+        }
+        for stats in report["stages"].values():
+            assert stats["p50_ms"] <= stats["p95_ms"]
+            assert stats["throughput_per_s"] > 0
+            assert stats["peak_rss_mb"] > 0
+            assert stats["python_peak_mb"] is not None
+        assert report["stages"]["parse"]["calls"] == 10
+        json.dumps(report)
+
+    def test_ocr_stages_skipped_when_readers_fail(self):
+        def broken_factory(gpu):
+            raise RuntimeError("no weights")
+
+        report = run_benchmark(receipts=2, images=1, reader_pool=ReaderPool(size=1, gpu=False, factory=broken_factory))
+
+        assert report["stages"]["extract_text"] == {"skipped": "RuntimeError: no weights"}
+        assert "p50_ms" in report["stages"]["parse"]
+
+    def test_stages_without_inputs_skipped(self):
+        pool = ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT))
+
+        report = run_benchmark(receipts=2, images=0, reader_pool=pool)
+        assert report["stages"]["extract_text"] == {"skipped": "ValueError: No inputs"}
+        assert "p50_ms" in report["stages"]["parse"]
+
+        report = run_benchmark(receipts=2, images=1, repeat=0, reader_pool=pool)
+        assert report["stages"]["run"] == {"skipped": "ValueError: repeat must be at least 1"}
+
+    def test_compare_backends(self):
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        typos = [line.replace('SVETER', 'SWETER') for line in RECEIPT_RAW_OUTPUT]
+
+        def broken_factory(gpu):
+            raise RuntimeError("no onnxruntime")
+
+        pools = {
+            'quantized': ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=typos)),
+            'easyocr': ReaderPool(size=1, gpu=False, factory=lambda gpu: FakeReader(lines=RECEIPT_RAW_OUTPUT)),
+            'onnx': ReaderPool(size=1, gpu=False, factory=broken_factory),
+        }
+
+        report = compare_backends(pools, [(image, RECEIPT_RAW_OUTPUT)] * 2, reference='easyocr', preprocess=False)
+
+        reference, quantized = report["backends"]["easyocr"], report["backends"]["quantized"]
+        assert (reference["char_accuracy"], reference["field_accuracy"], reference["speedup"]) == (1.0, 1.0, 1.0)
+        assert 0.95 < quantized["char_accuracy"] < 1.0
+        assert quantized["char_accuracy"] == quantized["reference_text_agreement"]
+        # Only the item name differs
+        assert quantized["field_accuracy"] == quantized["reference_field_agreement"] == 0.8
+        assert quantized["speedup"] > 0
+        assert report["backends"]["onnx"] == {"skipped": "RuntimeError: no onnxruntime"}
+        json.dumps(report)
+
+        with pytest.raises(ValueError):
+            compare_backends(pools, [(image, RECEIPT_RAW_OUTPUT)], reference='torch')
+
+    def test_fixture_samples(self, tmp_path):
+        cv2.imwrite(str(tmp_path / "receipt.png"), np.full((20, 20, 3), 255, dtype=np.uint8))
+        (tmp_path / "receipt.txt").write_text("PARAGON FISKALNY\nSUMA PLN 1,00\n", encoding="utf-8")
+        cv2.imwrite(str(tmp_path / "no_text.png"), np.zeros((20, 20, 3), dtype=np.uint8))
+
+        samples = fixture_samples(directory=tmp_path)
+
+        assert len(samples) == 1
+        assert samples[0][0].shape == (20, 20, 3)
+        assert samples[0][1] == ["PARAGON FISKALNY", "SUMA PLN 1,00"]
+        assert all(line.isascii() for _, lines in fixture_samples(images=2, seed=1) for line in lines)
+
+        (tmp_path / "empty").mkdir()
+        with pytest.raises(ValueError):
+            fixture_samples(directory=tmp_path / "empty")
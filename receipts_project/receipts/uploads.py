@@ -0,0 +1,172 @@
+"""
+Receipt photo uploads: streamed to disk and decoded straight from a memory-mapped file.
+
+1. The scan views replace the default upload handlers with `TemporaryFileUploadHandler`, so the multipart parser
+   writes the photo to a temporary file chunk by chunk instead of buffering it in memory.
+2. `open_upload` memory-maps that file - the encoded bytes are never copied into a Python `bytes` object.
+3. The size, format and dimensions are read from the image header before anything is decoded (`image_info`),
+   so oversized files, decompression bombs and non-images are rejected up front.
+4. Photos much larger than OCR needs are decoded at 1/2 or 1/4 resolution, in grayscale (`decode_flag`).
+   For JPEG libjpeg scales while decoding, so the full-resolution bitmap never exists.
+"""
+import mmap
+import struct
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional, Union
+
+import cv2
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# Reduction factor: OpenCV flag (grayscale output, the preprocessor converts to grayscale anyway)
+_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+}
+# JPEG frame markers carrying the image size (SOF0-SOF15 without DHT, JPG and DAC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length field
+_JPEG_STANDALONE = {0x01, 0xD8, *range(0xD0, 0xD8)}
+
+SUPPORTED_FORMATS = ("JPEG", "PNG", "WebP", "BMP")
+_CORRUPT_HEADER = "Nie udało się zdekodować obrazu: uszkodzony nagłówek"
+
+
+@dataclass(frozen=True, slots=True)
+class ImageInfo:
+    """
+    Image properties read from the file header
+    """
+    format: str  # One of SUPPORTED_FORMATS
+    width: int
+    height: int
+
+
+class TemporaryUploadsMixin:
+    """
+    View mixin streaming uploaded files to temporary files (never kept in memory, whatever FILE_UPLOAD_MAX_MEMORY_SIZE is)
+    """
+
+    def initialize_request(self, request: Any, *args: Any, **kwargs: Any) -> Any:
+        # Must be set before the body is parsed
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+
+def image_info(data: Buffer) -> ImageInfo:
+    """
+    Read the format and dimensions of an encoded image without decoding it
+    :param data: encoded image (only the header is read)
+    :return: ImageInfo
+    :raises ValueError: unsupported format or malformed header
+    """
+    head = bytes(data[:32])
+    try:
+        if head.startswith(b"\xff\xd8"):
+            width, height = _jpeg_size(data)
+            return ImageInfo("JPEG", width, height)
+        if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+            width, height = struct.unpack(">II", head[16:24])
+            return ImageInfo("PNG", width, height)
+        if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+            width, height = _webp_size(head)
+            return ImageInfo("WebP", width, height)
+        if head.startswith(b"BM"):
+            width, height = struct.unpack("<ii", head[18:26])
+            return ImageInfo("BMP", width, abs(height))
+    except struct.error:
+        raise ValueError(_CORRUPT_HEADER)
+    raise ValueError(f"Nie udało się zdekodować obrazu: nieobsługiwany format (obsługiwane: {', '.join(SUPPORTED_FORMATS)})")
+
+
+def _jpeg_size(data: Buffer) -> tuple[int, int]:
+    # Walk the segments up to the first frame header (EXIF thumbnails etc. come before it)
+    position, size = 2, len(data)
+    while position + 4 <= size:
+        if data[position] != 0xFF:
+            raise ValueError(_CORRUPT_HEADER)
+        marker = data[position + 1]
+        if marker == 0xFF:  # Fill byte
+            position += 1
+            continue
+        if marker in _JPEG_STANDALONE:
+            position += 2
+            continue
+        if marker in (0xD9, 0xDA):  # End of image / start of scan before any frame header
+            break
+        length = struct.unpack(">H", bytes(data[position + 2:position + 4]))[0]
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack(">HH", bytes(data[position + 5:position + 9]))
+            return width, height
+        position += 2 + length
+    raise ValueError(_CORRUPT_HEADER)
+
+
+def _webp_size(head: bytes) -> tuple[int, int]:
+    chunk = head[12:16]
+    if chunk == b"VP8X":
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    if chunk == b"VP8L":
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    raise ValueError(_CORRUPT_HEADER)
+
+
+def validate_image(data: Buffer, max_size: int, max_pixels: int) -> ImageInfo:
+    """
+    Reject files OCR shouldn't decode
+    :param data: encoded image
+    :param max_size: maximum file size (bytes)
+    :param max_pixels: maximum number of pixels (protects against decompression bombs)
+    :return: ImageInfo
+    :raises ValueError: with the reason (for the API response)
+    """
+    if not len(data):
+        raise ValueError("Przesłany plik jest pusty")
+    if len(data) > max_size:
+        raise ValueError(f"Plik jest za duży (maksymalnie {max_size // (1024 * 1024)} MB)")
+    info = image_info(data)
+    if info.width <= 0 or info.height <= 0:
+        raise ValueError(_CORRUPT_HEADER)
+    if info.width * info.height > max_pixels:
+        raise ValueError(f"Obraz ma za dużo pikseli ({info.width}x{info.height}, maksymalnie {max_pixels})")
+    return info
+
+
+def decode_flag(info: ImageInfo, min_side: Optional[int]) -> int:
+    """
+    OpenCV imread flag decoding the image at the largest reduction keeping its longer side at least `min_side` pixels
+    :param info: image header
+    :param min_side: minimal length (px) of the longer side after the reduction (None = full resolution)
+    :return: cv2.IMREAD_* flag
+    """
+    if min_side is None:
+        return _DECODE_FLAGS[1]
+    longer = max(info.width, info.height)
+    factor = max(factor for factor in _DECODE_FLAGS if factor == 1 or longer // factor >= min_side)
+    return _DECODE_FLAGS[factor]
+
+
+@contextmanager
+def open_upload(upload: Any) -> Iterator[Buffer]:
+    """
+    Zero-copy view of an uploaded file: the memory-mapped temporary file, or the in-memory content
+    (only for uploads handled by another upload handler)
+    :param upload: UploadedFile
+    :return: context manager yielding the encoded bytes
+    """
+    if not hasattr(upload, "temporary_file_path") or not upload.size:
+        upload.seek(0)
+        yield upload.read()
+        return
+
+    with open(upload.temporary_file_path(), "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
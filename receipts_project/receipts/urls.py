@@ -1,17 +1,25 @@
 from django.urls import path
 from .views import (
-    TransactionListAPI, TransactionDetailAPI,
-    ProductListAPI, ProductDetailAPI,
-    ReceiptScanAPI, UserUpdateAPI, ChangePasswordAPI, CalendarAPI
+    TransactionListAPI, TransactionExportAPI, TransactionBulkAPI, TransactionDetailAPI,
+    ProductListAPI, ProductBulkAPI, ProductSearchAPI, ProductDetailAPI,
+    ReceiptScanAPI, ReceiptBatchScanAPI, ReceiptScanJobAPI, UserUpdateAPI, ChangePasswordAPI, CalendarAPI,
+    AnalyticsAPI,
 )
 
 urlpatterns = [
     path("transactions/", TransactionListAPI.as_view(), name="tx-list"),
+    path("transactions/export/", TransactionExportAPI.as_view(), name="tx-export"),
+    path("transactions/bulk/", TransactionBulkAPI.as_view(), name="tx-bulk"),
     path("transactions/<int:pk>/", TransactionDetailAPI.as_view(), name="tx-detail"),
     path("products/", ProductListAPI.as_view(), name="prod-list"),
+    path("products/bulk/", ProductBulkAPI.as_view(), name="prod-bulk"),
+    path("products/search/", ProductSearchAPI.as_view(), name="prod-search"),
     path("products/<int:pk>/", ProductDetailAPI.as_view(), name="prod-detail"),
     path("receipts/scan/", ReceiptScanAPI.as_view(), name="receipt-scan"),
+    path("receipts/scan/batch/", ReceiptBatchScanAPI.as_view(), name="receipt-scan-batch"),
+    path("receipts/scan/<int:pk>/", ReceiptScanJobAPI.as_view(), name="receipt-scan-job"),
     path("auth/user/", UserUpdateAPI.as_view(), name="user-update"),    
     path("auth/password/", ChangePasswordAPI.as_view(), name="change-password"), 
     path('calendar/<str:period>/', CalendarAPI.as_view()),
+    path("analytics/", AnalyticsAPI.as_view(), name="analytics"),
 ]
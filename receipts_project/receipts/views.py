@@ -1,19 +1,28 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Transaction, Product
-from .serializers import TransactionSerializer, ProductSerializer
+from .models import DailySpending, Transaction, Product, ScanJob
+from .serializers import TransactionSerializer, TransactionWriteSerializer, ProductSerializer, ScanJobSerializer
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.password_validation import validate_password
-from django.db.models.functions import TruncDay, TruncMonth
-from django.db.models import Sum
-from .ocr import ReceiptParser
+from . import analytics
+from .bulk import ProductBulkOperation, TransactionBulkOperation
+from .export import csv_lines, ndjson_lines
+from .jobs import enqueue_scan, wait_for_job
+from .pagination import KeysetPagination, RankedPagination
+from .scanning import decode_image, scan_image, scan_images, transaction_data, validate_upload
+from .search import search_products
+from .uploads import TemporaryUploadsMixin, open_upload
 from rest_framework.parsers import MultiPartParser, FormParser
-import numpy as np
-import cv2
+from rest_framework.reverse import reverse
+import datetime
 import traceback
+from decimal import Decimal
 
 class UserUpdateAPI(APIView):
     permission_classes = [IsAuthenticated]
@@ -45,69 +54,153 @@ class ChangePasswordAPI(APIView):
 
 class TransactionListAPI(APIView):
     def get(self, request: Request) -> Response:
-        qs = Transaction.objects.all()
-        serializer = TransactionSerializer(qs, many=True)
-        return Response(serializer.data)
+        # Products of the whole page are fetched with a single query
+        qs = Transaction.objects.filter(user=request.user).prefetch_related("products")
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        serializer = TransactionSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request: Request) -> Response:
-        serializer = TransactionSerializer(data=request.data)
+        # Products can be sent nested in the transaction, they are saved with it in one database transaction
+        serializer = TransactionWriteSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        serializer.save(user=request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class TransactionExportAPI(APIView):
+    content_types = {
+        "ndjson": "application/x-ndjson",
+        "csv": "text/csv; charset=utf-8",
+    }
+
+    def get(self, request: Request) -> Response | StreamingHttpResponse:
+        export_type = request.query_params.get("type", "ndjson")
+        if export_type not in self.content_types:
+            return Response(
+                {"detail": f"Nieobsługiwany typ eksportu: {export_type} (dostępne: ndjson, csv)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        qs = Transaction.objects.filter(user=request.user)
+
+        # Optional date range (inclusive, YYYY-MM-DD) in the local timezone
+        for param, lookup, offset in (("date_from", "date__gte", 0), ("date_to", "date__lt", 1)):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                day = datetime.date.fromisoformat(value)
+            except ValueError:
+                return Response(
+                    {"detail": f"Nieprawidłowa data {param}: {value}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            start = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=offset), datetime.time.min))
+            qs = qs.filter(**{lookup: start})
+
+        lines = ndjson_lines if export_type == "ndjson" else csv_lines
+        response = StreamingHttpResponse(
+            lines(qs, chunk_size=settings.EXPORT_CHUNK_SIZE),
+            content_type=self.content_types[export_type]
+        )
+        response["Content-Disposition"] = f'attachment; filename="transactions.{export_type}"'
+        return response
+
+
+class TransactionBulkAPI(APIView):
+    def post(self, request: Request) -> Response:
+        operation = TransactionBulkOperation(
+            Transaction.objects.filter(user=request.user), request.data,
+            max_items=settings.BULK_MAX_ITEMS, user=request.user
+        )
+        if not operation.is_valid():
+            return Response(operation.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(operation.save())
+
+
 class TransactionDetailAPI(APIView):
     def get(self, request: Request, pk: int) -> Response:
-        tx = Transaction.objects.get(pk=pk)
+        tx = get_object_or_404(Transaction, pk=pk, user=request.user)
         serializer = TransactionSerializer(tx)
         return Response(serializer.data)
 
     def put(self, request: Request, pk: int) -> Response:
-        tx = Transaction.objects.get(pk=pk)
+        tx = get_object_or_404(Transaction, pk=pk, user=request.user)
         serializer = TransactionSerializer(tx, data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
 
     def delete(self, request: Request, pk: int) -> Response:
-        tx = Transaction.objects.get(pk=pk)
+        tx = get_object_or_404(Transaction, pk=pk, user=request.user)
         tx.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class ProductListAPI(APIView):
     def get(self, request: Request) -> Response:
-        qs = Product.objects.all()
+        qs = Product.objects.filter(transaction__user=request.user)
         serializer = ProductSerializer(qs, many=True)
         return Response(serializer.data)
 
     def post(self, request: Request) -> Response:
-        serializer = ProductSerializer(data=request.data)
+        serializer = ProductSerializer(data=request.data, context={"request": request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class ProductBulkAPI(APIView):
+    def post(self, request: Request) -> Response:
+        operation = ProductBulkOperation(
+            Product.objects.filter(transaction__user=request.user), request.data,
+            context={"request": request}, max_items=settings.BULK_MAX_ITEMS
+        )
+        if not operation.is_valid():
+            return Response(operation.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(operation.save())
+
+
+class ProductSearchAPI(APIView):
+    def get(self, request: Request) -> Response:
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"detail": "Brak parametru 'q'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = search_products(
+            request.user, query,
+            candidates=settings.PRODUCT_SEARCH_CANDIDATES, threshold=settings.PRODUCT_SEARCH_THRESHOLD
+        )
+        paginator = RankedPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response([
+            {**ProductSerializer(product).data, "date": product.transaction.date, "score": round(product.score, 1)}
+            for product in page
+        ])
+
+
 class ProductDetailAPI(APIView):
     def get(self, request: Request, pk: int) -> Response:
-        prod = Product.objects.get(pk=pk)
+        prod = get_object_or_404(Product, pk=pk, transaction__user=request.user)
         serializer = ProductSerializer(prod)
         return Response(serializer.data)
 
     def put(self, request: Request, pk: int) -> Response:
-        prod = Product.objects.get(pk=pk)
-        serializer = ProductSerializer(prod, data=request.data)
+        prod = get_object_or_404(Product, pk=pk, transaction__user=request.user)
+        serializer = ProductSerializer(prod, data=request.data, context={"request": request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
 
     def delete(self, request: Request, pk: int) -> Response:
-        prod = Product.objects.get(pk=pk)
+        prod = get_object_or_404(Product, pk=pk, transaction__user=request.user)
         prod.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ReceiptScanAPI(APIView):
+class ReceiptScanAPI(TemporaryUploadsMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request, *args, **kwargs):
@@ -118,19 +211,42 @@ class ReceiptScanAPI(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        file_bytes = image_file.read()
-        np_arr = np.frombuffer(file_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if img is None:
+        save = self._flag(request, 'save')
+        is_async = self._is_async(request)
+        if is_async and save:
+            return Response(
+                {"detail": "Zapis transakcji (save) jest dostępny tylko w trybie synchronicznym"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The upload is on disk (TemporaryUploadsMixin) - it's read through a memory map, without copies
+        try:
+            with open_upload(image_file) as data:
+                if is_async:
+                    validate_upload(data)
+                    file_bytes = bytes(data)
+                else:
+                    img = decode_image(data)
+        except ValueError as ve:
             return Response(
-                {"detail": "Nie udało się zdekodować obrazu"},
+                {"detail": str(ve)},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        parser = ReceiptParser()
+        # Async mode: queue the image for the OCR workers and answer right away
+        if is_async:
+            job = enqueue_scan(request.user, file_bytes)
+            return Response(
+                {
+                    "id": job.id,
+                    "status": job.status,
+                    "url": reverse("receipt-scan-job", args=[job.id], request=request),
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
+
         try:
-            parser.load_image_from_np_ndarray(img)
-            parser.run()
+            parsed = scan_image(img, user=request.user)
         except ValueError as ve:
             print("ValueError:", ve)
             traceback.print_exc()
@@ -145,16 +261,87 @@ class ReceiptScanAPI(APIView):
                 {"detail": f"Błąd parsowania: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        parsed = parser.to_json()
 
-        if 'total' in parsed:
-            parsed['total'] = -abs(parsed['total'])
+        if not save:
+            return Response(parsed, status=status.HTTP_200_OK)
+
+        # Scan and save: the transaction with all its products is created in one database transaction
+        serializer = TransactionWriteSerializer(data=transaction_data(parsed))
+        if not serializer.is_valid():
+            return Response(
+                {"detail": "Nie można zapisać paragonu", "errors": serializer.errors, "scan": parsed},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer.save(user=request.user)
+        return Response({"transaction": serializer.data, "scan": parsed}, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def _flag(request: Request, name: str) -> bool:
+        return str(request.query_params.get(name) or request.data.get(name) or '').lower() in ('1', 'true', 'yes')
+
+    @staticmethod
+    def _is_async(request: Request) -> bool:
+        mode = request.query_params.get('mode') or request.data.get('mode')
+        if mode:
+            return mode == 'async'
+        return settings.OCR_ASYNC_SCANS
+
+
+class ReceiptBatchScanAPI(TemporaryUploadsMixin, APIView):
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request, *args, **kwargs):
+        image_files = request.FILES.getlist('images')
+        if not image_files:
+            return Response(
+                {"detail": "Brak plików 'images' w żądaniu"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(image_files) > settings.OCR_BATCH_MAX_IMAGES:
+            return Response(
+                {"detail": f"Maksymalna liczba zdjęć: {settings.OCR_BATCH_MAX_IMAGES}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Decode everything first, only valid images go through batched inference
+        results: list[dict] = []
+        images, indices = [], []
+        for index, image_file in enumerate(image_files):
+            results.append({"index": index, "filename": image_file.name})
+            try:
+                with open_upload(image_file) as data:
+                    images.append(decode_image(data))
+                indices.append(index)
+            except ValueError as ve:
+                results[index].update(status="error", detail=str(ve))
+
+        for index, parsed in zip(indices, scan_images(images, user=request.user)):
+            if isinstance(parsed, ValueError):
+                results[index].update(status="error", detail=f"Błąd danych: {str(parsed)}")
+            elif isinstance(parsed, Exception):
+                results[index].update(status="error", detail=f"Błąd parsowania: {str(parsed)}")
+            else:
+                results[index].update(status="ok", result=parsed)
+
+        return Response(results, status=status.HTTP_200_OK)
+
+
+class ReceiptScanJobAPI(APIView):
+    def get(self, request: Request, pk: int) -> Response:
+        job = get_object_or_404(ScanJob, pk=pk, user=request.user)
+
+        # Long polling: ?wait=<seconds> blocks until the job is finished (up to OCR_JOB_MAX_WAIT)
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            return Response({"detail": "Invalid wait"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if wait > 0:
+            job = wait_for_job(job, timeout=min(wait, settings.OCR_JOB_MAX_WAIT))
+
+        return Response(ScanJobSerializer(job).data)
 
-        for item in parsed.get('items', []):
-            item['price'] = -abs(item.get('price', 0))
 
-        return Response(parsed, status=status.HTTP_200_OK)
-    
 class CalendarAPI(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -164,29 +351,67 @@ class CalendarAPI(APIView):
         except ValueError:
             return JsonResponse({'detail': 'Invalid year'}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Reads the precomputed rollup (see rollups.py): one row per day with transactions
         if period == 'daily':
             try:
                 month = int(request.query_params.get('month', 0))
             except ValueError:
                 return JsonResponse({'detail': 'Invalid month'}, status=status.HTTP_400_BAD_REQUEST)
-            qs = Transaction.objects.filter(date__year=year, date__month=month)
-            data = (
-                qs.annotate(day=TruncDay('date'))
-                  .values('day')
-                  .annotate(total=Sum('total_amount'))
-                  .order_by('day')
-            )
-            result = {entry['day'].day: float(entry['total'] or 0) for entry in data}
+            rows = DailySpending.objects.filter(user=request.user, day__year=year, day__month=month)
+            result = {}
+            for day, income, expense in rows.order_by('day').values_list('day', 'income', 'expense'):
+                result[day.day] = float(income + expense)
         elif period == 'monthly':
-            qs = Transaction.objects.filter(date__year=year)
-            data = (
-                qs.annotate(month=TruncMonth('date'))
-                  .values('month')
-                  .annotate(total=Sum('total_amount'))
-                  .order_by('month')
-            )
-            result = {entry['month'].month: float(entry['total'] or 0) for entry in data}
+            rows = DailySpending.objects.filter(user=request.user, day__year=year)
+            totals: dict[int, Decimal] = {}
+            for day, income, expense in rows.order_by('day').values_list('day', 'income', 'expense'):
+                totals[day.month] = totals.get(day.month, Decimal(0)) + income + expense
+            result = {month: float(total) for month, total in totals.items()}
         else:
             return JsonResponse({'detail': 'Unsupported period'}, status=status.HTTP_400_BAD_REQUEST)
 
-        return JsonResponse(result, safe=True)
\ No newline at end of file
+        return JsonResponse(result, safe=True)
+
+class AnalyticsAPI(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request) -> Response:
+        today = timezone.localdate()
+        params = request.query_params
+
+        dates = {}
+        for param, default in (("date_from", today - datetime.timedelta(days=364)), ("date_to", today)):
+            value = params.get(param)
+            try:
+                dates[param] = datetime.date.fromisoformat(value) if value else default
+            except ValueError:
+                return Response({"detail": f"Nieprawidłowa data {param}: {value}"}, status=status.HTTP_400_BAD_REQUEST)
+        start, end = dates["date_from"], dates["date_to"]
+        if start > end:
+            return Response({"detail": "date_from nie może być późniejsza niż date_to"}, status=status.HTTP_400_BAD_REQUEST)
+
+        bucket = params.get("bucket", "month")
+        if bucket not in analytics.BUCKETS:
+            return Response(
+                {"detail": f"Nieobsługiwany przedział: {bucket} (dostępne: week, month)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            top = int(params.get("top", 10))
+        except ValueError:
+            return Response({"detail": "Nieprawidłowa wartość top"}, status=status.HTTP_400_BAD_REQUEST)
+        top = max(1, min(top, 100))
+
+        buckets = analytics.bucket_totals(request.user, start, end, bucket)
+        income = sum(row["income"] for row in buckets)
+        expense = sum(row["expense"] for row in buckets)
+
+        return Response({
+            "date_from": start.isoformat(),
+            "date_to": end.isoformat(),
+            "totals": {"income": round(income, 2), "expense": round(expense, 2), "net": round(income + expense, 2)},
+            "buckets": buckets,
+            "top_products": analytics.top_products(request.user, start, end, top),
+            "rolling": analytics.rolling_averages(request.user, start, end),
+        })
@@ -140,10 +140,59 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Keyset pagination of list endpoints (receipts/pagination.py), ?page_size=<n> up to the maximum
+PAGINATION_PAGE_SIZE = 50
+PAGINATION_MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000  # Transactions fetched at once by GET /api/transactions/export/
+BULK_MAX_ITEMS = 1000  # Upserts + deletions accepted by a single bulk request
+
+# Product search (GET /api/products/search/)
+PRODUCT_SEARCH_CANDIDATES = 500  # Names taken from the trigram index for fuzzy reranking
+PRODUCT_SEARCH_THRESHOLD = 60  # Minimal fuzzy score (0-100)
+PRODUCT_SEARCH_PAGE_SIZE = 20
+
+# Product name normalization (normalization.py), None = disabled
+PRODUCT_NORMALIZATION = {
+    'threshold': 85,  # Minimal similarity of normalized names to reuse a canonical product
+    'cache_size': 4096,  # Recent name -> canonical mappings kept in memory
+}
+
 ACCOUNT_LOGIN_METHODS = {'username', 'email'}
 ACCOUNT_SIGNUP_FIELDS = ['email*', 'username*', 'password1*', 'password2*']
 ACCOUNT_EMAIL_VERIFICATION = "none"
 SOCIALACCOUNT_PROVIDERS = {}
 
 CORS_ALLOW_ALL_ORIGINS = True
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+
+# OCR
+# Each worker process keeps OCR_READER_POOL_SIZE warm EasyOCR readers (one reader serves one scan at a time)
+OCR_USE_GPU = True
+OCR_READER_POOL_SIZE = 1
+OCR_PRELOAD_READERS = not DEBUG  # Load readers when the WSGI/ASGI worker starts instead of on the first scan
+OCR_ASYNC_SCANS = False  # Default scan mode, can be overridden per request with ?mode=async / ?mode=sync
+OCR_JOB_MAX_WAIT = 30  # Maximum long-poll time (s) of GET /api/receipts/scan/<id>/?wait=<seconds>
+OCR_BATCH_SIZE = 4  # Images passed to the text detector at once by POST /api/receipts/scan/batch/
+OCR_BATCH_MAX_IMAGES = 50  # Maximum number of images in a single batch request
+OCR_DETAIL = False  # Keep OCR boxes and confidences: items are paired from the row layout, results get confidences (see receipts/layout.py)
+OCR_DETECTOR = 'craft'  # Text detector: 'craft' (EasyOCR) or 'projection' (projection profiles, much cheaper - clean scans, see receipts/segmentation.py)
+OCR_ROI = False  # Detect text at low resolution and recognize only the rows the parser reads, skipping the footer (see receipts/roi.py, single scans only)
+# Inference backend of the OCR models (see receipts/ocr_backends.py, compare them with `manage.py compare_ocr_backends`).
+# BACKEND: 'easyocr' (default), 'torch' (fp32 on CPU), 'quantized' (dynamic int8 on CPU) or 'onnx' (ONNX Runtime, CPU)
+# OPTIONS: threads (intra-op threads, None = library default), engine ('quantized'), model_dir and providers ('onnx')
+OCR_INFERENCE = {
+    'BACKEND': 'easyocr',
+    'OPTIONS': {'threads': None},
+}
+OCR_PREPROCESS = True  # Crop, deskew and downscale photos before OCR (see receipts/preprocessing.py)
+OCR_TARGET_TEXT_HEIGHT = 32  # Height (px) of a text line after downscaling
+OCR_MAX_UPLOAD_SIZE = 20 * 1024 * 1024  # Maximum size (bytes) of an uploaded photo
+OCR_MAX_IMAGE_PIXELS = 50_000_000  # Maximum width x height read from the image header (decompression bombs)
+OCR_DECODE_MIN_SIDE = 2000  # Photos are decoded at 1/2 or 1/4 resolution while their longer side stays >= this (None = full resolution)
+# Results of repeated uploads (same decoded image) are served without OCR.
+# BACKEND: 'memory' (per process LRU), 'django' (settings.CACHES), 'sqlite' (file shared by workers of a host) or None
+OCR_SCAN_CACHE = {
+    'BACKEND': 'memory',
+    'OPTIONS': {'max_entries': 512, 'ttl': 3600, 'perceptual': False},
+}
+OCR_STORE_RAW_OUTPUT = True  # Keep the raw OCR output of every scan (ReceiptScan), so `manage.py reparse_scans` can parse it again
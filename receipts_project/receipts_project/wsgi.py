@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'receipts_project.settings')
 
 application = get_wsgi_application()
+
+# Load the OCR models once per worker process, before the first scan request
+from django.conf import settings  # noqa: E402
+
+if settings.OCR_PRELOAD_READERS:
+    from receipts.ocr_pool import get_configured_reader_pool  # noqa: E402
+    get_configured_reader_pool().warm_up()